@@ -10,7 +10,9 @@ CREATE TABLE IF NOT EXISTS SpamRepository (
     MessageText TEXT NOT NULL,          -- The actual content of the SMS message
     SpamLabel BOOLEAN NOT NULL,         -- Spam label (1 for spam, 0 for not spam)
     DateAdded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- Date when the message was added
-    MessageType VARCHAR(100)            -- Type of spam (e.g., Phishing, Advertisement, etc.)
+    MessageType VARCHAR(100),           -- Type of spam (e.g., Phishing, Advertisement, etc.)
+    MessageHash CHAR(32) NULL,          -- Hash of the normalised text, filled in by spamfilter.bulkload
+    INDEX idx_repository_hash (MessageHash)
 );
 
 -- Insert sample data into SpamRepository
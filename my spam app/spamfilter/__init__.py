@@ -0,0 +1,6 @@
+# Shared code for the SMS spam filtering apps.
+#
+# Keep this module free of heavy imports (nltk, sklearn, pandas, mysql) so that
+# importing the package stays cheap; submodules import what they need lazily.
+
+__version__ = "0.1.0"
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+# File names the Streamlit apps load from their working directory
+MODEL_FILE = 'model.pkl'
+VECTORIZER_FILE = 'vectorizer.pkl'
+
+
+# Function to pickle an object without ever leaving a half-written file behind:
+# the data goes to a temporary file in the same directory and is then renamed
+# over the target, which is atomic on the same filesystem.
+def atomic_pickle_dump(obj, path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.pkl')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Function to save the vectorizer and model the apps load
+def save_artifacts(vectorizer, model, directory='.'):
+    os.makedirs(directory, exist_ok=True)
+    atomic_pickle_dump(vectorizer, os.path.join(directory, VECTORIZER_FILE))
+    atomic_pickle_dump(model, os.path.join(directory, MODEL_FILE))
+
+
+# Function to identify the saved vectorizer and model: a short digest of both
+# files, which changes whenever either is retrained or replaced
+def artifact_version(directory='.'):
+    digest = hashlib.blake2b(digest_size=8)
+    for name in (VECTORIZER_FILE, MODEL_FILE):
+        with open(os.path.join(directory, name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to load the vectorizer and model separately
+def load_artifacts(directory='.'):
+    with open(os.path.join(directory, VECTORIZER_FILE), 'rb') as f:
+        vectorizer = pickle.load(f)
+    with open(os.path.join(directory, MODEL_FILE), 'rb') as f:
+        model = pickle.load(f)
+    return vectorizer, model
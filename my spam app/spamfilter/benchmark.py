@@ -0,0 +1,263 @@
+# End-to-end benchmark of the classification pipeline.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.benchmark --output bench.json
+#     python -m spamfilter.benchmark --data spam.csv --synthetic 1000 100000 --db sqlite
+#     python -m spamfilter.benchmark --compare bench.json --fail-on-regression
+#
+# Each message goes through the same steps as the apps' Predict handler and
+# every step is timed on its own: nltk.word_tokenize, stopword filtering,
+# ps.stem, vectorizer.transform, predict, predict_proba and the DB log insert,
+# plus the whole pipeline end to end and a batched variant. Corpora are
+# "SMS MESSAGES.txt", the notebook's dataset (--data) and synthetic corpora of
+# the requested sizes. Results (throughput and p50/p95/p99 latency per stage)
+# go to JSON; --compare flags stages whose p50 got slower than a baseline file.
+
+import argparse
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .artifacts import load_artifacts
+from .datasets import DEFAULT_ENCODING, iter_labelled_csv, read_message_list, synthetic_corpus
+from .preprocessing import (_PUNCTUATION, _stemmer, english_stopwords, ensure_nltk_data,
+                            transform_many, transform_text)
+from .timing import latency_percentiles, write_json_report
+
+SMS_MESSAGES_FILE = 'SMS MESSAGES.txt'
+STAGES = ['tokenize', 'stopwords', 'stem', 'vectorize', 'predict', 'predict_proba', 'db_log']
+
+
+# Logs like ap.py's log_to_database: one insert and commit per message
+class SQLiteLogger:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS sms_classification_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sms_message TEXT, prediction TEXT, confidence REAL, classification_time TEXT)
+        """)
+
+    def log(self, message, prediction, confidence):
+        self.connection.execute(
+            "INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time) "
+            "VALUES (?, ?, ?, ?)", (message, prediction, confidence, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+# Logs like ap.py's log_to_database: a new MySQL connection per message
+class MySQLLogger:
+    def log(self, message, prediction, confidence):
+        from .db import LOGS_DB, connect_to_db
+
+        connection = connect_to_db(LOGS_DB)
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time)
+                VALUES (%s, %s, %s, %s)
+            """, (message, prediction, confidence, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+
+    def close(self):
+        pass
+
+
+def _summary(samples, count=None):
+    total = sum(samples)
+    count = len(samples) if count is None else count
+    return {
+        'messages': count,
+        'total_seconds': round(total, 4),
+        'messages_per_second': round(count / total, 1) if total else None,
+        **latency_percentiles(samples),
+    }
+
+
+# Function to time every stage of the pipeline on each message of a corpus
+def benchmark_corpus(messages, vectorizer, model, logger=None):
+    from nltk import word_tokenize
+
+    stop_words = english_stopwords()
+    ps = _stemmer()
+    samples = {stage: [] for stage in STAGES + ['pipeline']}
+    clock = time.perf_counter
+
+    for message in messages:
+        t0 = clock()
+        tokens = word_tokenize(message.lower())
+        t1 = clock()
+        kept = [i for i in tokens if i.isalnum() and i not in stop_words and i not in _PUNCTUATION]
+        t2 = clock()
+        transformed = " ".join([ps.stem(i) for i in kept])
+        t3 = clock()
+        vectorized = vectorizer.transform([transformed])
+        t4 = clock()
+        prediction = model.predict(vectorized)[0]
+        t5 = clock()
+        confidence = model.predict_proba(vectorized)[0][prediction] * 100
+        t6 = clock()
+        if logger is not None:
+            logger.log(message, 'Spam' if prediction == 1 else 'Not Spam', float(confidence))
+        t7 = clock()
+
+        for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5, t7 - t6)):
+            samples[stage].append(seconds)
+
+        # The whole pipeline as the apps run it, timed separately so the
+        # per-stage clock calls above are not part of it
+        t0 = clock()
+        vectorized = vectorizer.transform([transform_text(message)])
+        prediction = model.predict(vectorized)[0]
+        model.predict_proba(vectorized)[0][prediction]
+        samples['pipeline'].append(clock() - t0)
+
+    if logger is None:
+        del samples['db_log']
+    results = {stage: _summary(values) for stage, values in samples.items()}
+
+    # Batched variant: one transform / predict_proba call for the whole corpus
+    start = clock()
+    X = vectorizer.transform(transform_many(messages))
+    model.predict_proba(X)
+    batch_seconds = clock() - start
+    results['pipeline_batch'] = {
+        'messages': len(messages),
+        'total_seconds': round(batch_seconds, 4),
+        'messages_per_second': round(len(messages) / batch_seconds, 1) if batch_seconds else None,
+    }
+    return results
+
+
+# Function to collect the corpora to benchmark as {name: messages}
+def load_corpora(args):
+    corpora = {}
+    if os.path.exists(args.messages):
+        corpora['sms_messages_txt'] = read_message_list(args.messages)
+    if args.data:
+        texts = []
+        for batch_texts, _ in iter_labelled_csv(args.data, encoding=args.encoding):
+            texts.extend(batch_texts)
+        corpora['notebook_dataset'] = texts
+    for size in args.synthetic:
+        corpora[f'synthetic_{size}'] = synthetic_corpus(size, seed=args.seed)[0]
+    return corpora
+
+
+def make_logger(kind, tmp_dir):
+    if kind == 'sqlite':
+        return SQLiteLogger(os.path.join(tmp_dir, 'bench_logs.db'))
+    if kind == 'mysql':
+        return MySQLLogger()
+    return None
+
+
+def run(args):
+    import sklearn
+
+    ensure_nltk_data()
+    vectorizer, model = load_artifacts(args.model_dir)
+    corpora = load_corpora(args)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scikit_learn': sklearn.__version__,
+            'model': type(model).__name__,
+            'db': args.db,
+        },
+        'corpora': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        logger = make_logger(args.db, tmp_dir)
+        try:
+            # Warm-up so one-off costs (NLTK lazy loading, first sklearn call)
+            # do not end up in the first corpus' tail latency
+            benchmark_corpus(synthetic_corpus(50, seed=-1)[0], vectorizer, model)
+            for name, messages in corpora.items():
+                report['corpora'][name] = benchmark_corpus(messages, vectorizer, model, logger)
+        finally:
+            if logger is not None:
+                logger.close()
+    return report
+
+
+# Function to compare p50 latencies with a baseline report; returns the list
+# of (corpus, stage, old_ms, new_ms) that got slower than the threshold
+def compare_reports(baseline, current, threshold=0.10):
+    regressions = []
+    for corpus, stages in current['corpora'].items():
+        for stage, result in stages.items():
+            old = baseline.get('corpora', {}).get(corpus, {}).get(stage, {}).get('p50_ms')
+            new = result.get('p50_ms')
+            if old and new and new > old * (1 + threshold):
+                regressions.append((corpus, stage, old, new))
+    return regressions
+
+
+def print_report(report):
+    for corpus, stages in report['corpora'].items():
+        print(f"\n{corpus}")
+        print(f"  {'stage':<16}{'msg/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, r in stages.items():
+            print(f"  {stage:<16}{r['messages_per_second'] or 0:>12.0f}"
+                  + ''.join(f"{r[key]:>10.3f}" if r.get(key) is not None else f"{'-':>10}"
+                            for key in ('p50_ms', 'p95_ms', 'p99_ms')))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the classification pipeline.")
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--messages', default=SMS_MESSAGES_FILE, help="Plain-text message list")
+    parser.add_argument('--data', help="The notebook's labelled CSV (spam.csv)")
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING)
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[1000],
+                        help="Sizes of synthetic corpora to generate")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', choices=['none', 'sqlite', 'mysql'], default='sqlite',
+                        help="Where the db_log stage writes (sqlite is a local stand-in for MySQL)")
+    parser.add_argument('--output', help="Save the results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON to compare p50 latencies against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed p50 slowdown (0.10 = 10%%)")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    import json
+
+    args = build_parser().parse_args(argv)
+    report = run(args)
+    print_report(report)
+
+    if args.output:
+        write_json_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        print()
+        for corpus, stage, old, new in regressions:
+            print(f"REGRESSION {corpus}/{stage}: p50 {old:.3f} ms -> {new:.3f} ms")
+        if not regressions:
+            print(f"No p50 regressions above {args.threshold:.0%} against {args.compare}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+# Bulk import of labelled corpora into the SpamRepository table.
+#
+# Streams a labelled CSV (spam.csv's v1/v2 columns by default) or a TXT file
+# (a message list with one --label for every line, or "label<TAB>message"
+# lines as in the UCI SMSSpamCollection), normalises each message (Unicode
+# NFC, surrounding whitespace stripped) and skips messages already in the
+# table or earlier in the input. Duplicates are found by message_hash, stored
+# in a MessageHash column that the loader adds (and back-fills) on first use.
+#
+# Rows are written in transactions of --transaction-rows, either as multi-row
+# INSERTs or, with --method load-data, with LOAD DATA LOCAL INFILE (needs
+# local_infile enabled on the server). With --defer-indexes the secondary
+# indexes of SpamRepository are dropped for the load and rebuilt at the end.
+#
+# After every transaction the input position is saved next to the input
+# (<input>.bulkload.json), so an interrupted load continues where it stopped
+# when run again; rows committed just before the interruption are recognised
+# as duplicates, not loaded twice. Progress is reported in rows per second.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.bulkload spam.csv
+#     python -m spamfilter.bulkload "SMS MESSAGES.txt" --label ham --method load-data --defer-indexes
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import unicodedata
+
+from .datasets import DEFAULT_ENCODING, DEFAULT_LABEL_COLUMN, DEFAULT_TEXT_COLUMN, encode_label, iter_labelled_csv
+from .db import SPAM_REPOSITORY_DB, db_config
+from .preprocessing import message_hash
+
+IMPORTED_MESSAGE_TYPE = 'Imported'
+HASH_INDEX = 'idx_repository_hash'
+
+
+# Function to normalise a message before it is stored
+def normalize_text(text):
+    return unicodedata.normalize('NFC', str(text)).strip()
+
+
+# Function to read (position after the chunk, texts, labels) chunks from a
+# CSV or TXT file, starting after `skip` data rows/lines
+def iter_source(path, label=None, chunk_size=10000, skip=0, label_column=DEFAULT_LABEL_COLUMN,
+                text_column=DEFAULT_TEXT_COLUMN, encoding=None):
+    if path.lower().endswith('.csv'):
+        encoding = encoding or DEFAULT_ENCODING
+        position = skip
+        for texts, labels in iter_labelled_csv(path, chunk_size, label_column, text_column, encoding, skip):
+            position += len(texts)
+            yield position, texts, labels
+        return
+
+    from .datasets import _NUMBERING
+
+    fixed = None if label is None else encode_label(label)
+    texts, labels = [], []
+    position = 0
+    with open(path, encoding=encoding or 'utf-8', errors='replace') as f:
+        for line in f:
+            position += 1
+            if position <= skip:
+                continue
+            line = line.rstrip('\r\n')
+            if fixed is None:
+                if '\t' not in line:
+                    raise ValueError(f"{path}:{position}: expected 'label<TAB>message' (or pass --label)")
+                line_label, line = line.split('\t', 1)
+                labels.append(encode_label(line_label))
+            else:
+                labels.append(fixed)
+            texts.append(_NUMBERING.sub('', line.strip()))
+            if len(texts) >= chunk_size:
+                yield position, texts, labels
+                texts, labels = [], []
+    if texts:
+        yield position, texts, labels
+
+
+def _connect(database, local_infile=False):
+    import mysql.connector
+
+    return mysql.connector.connect(**db_config(database), allow_local_infile=local_infile)
+
+
+# Function to add the MessageHash column and index if missing, and hash the
+# rows written without one (by the app's sinks or feedback) the same way the
+# loader hashes its input, so those rows are recognised as duplicates
+def prepare_table(connection, batch_size=10000):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW COLUMNS FROM SpamRepository LIKE 'MessageHash'")
+        if not cursor.fetchall():
+            cursor.execute(f"ALTER TABLE SpamRepository ADD COLUMN MessageHash CHAR(32) NULL, "
+                           f"ADD INDEX {HASH_INDEX} (MessageHash)")
+        backfilled = 0
+        after_id = 0
+        while True:
+            cursor.execute("SELECT ID, MessageText FROM SpamRepository WHERE ID > %s AND MessageHash IS NULL "
+                           "ORDER BY ID LIMIT %s", (after_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            cursor.executemany("UPDATE SpamRepository SET MessageHash = %s WHERE ID = %s",
+                               [(message_hash(normalize_text(text)), row_id) for row_id, text in rows])
+            connection.commit()
+            backfilled += len(rows)
+        return backfilled
+    finally:
+        cursor.close()
+
+
+# Function to read the hashes already in the table. They are kept as 16-byte
+# digests rather than the column's 32-character hex strings: about 90 bytes
+# per row in the set instead of about 120 (1M rows: ~90 MB).
+def existing_hashes(connection, batch_size=50000):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT MessageHash FROM SpamRepository WHERE MessageHash IS NOT NULL")
+        hashes = set()
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return hashes
+            hashes.update(bytes.fromhex(row[0]) for row in rows)
+    finally:
+        cursor.close()
+
+
+# Function to drop the secondary indexes; returns their definitions
+# [(name, unique, [column spec, ...])] for restore_indexes
+def drop_indexes(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW INDEX FROM SpamRepository")
+        columns = [description[0] for description in cursor.description]
+        indexes = {}
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            if row['Key_name'] == 'PRIMARY':
+                continue
+            spec = f"`{row['Column_name']}`" + (f"({row['Sub_part']})" if row['Sub_part'] else '')
+            name = row['Key_name']
+            indexes.setdefault(name, (name, not int(row['Non_unique']), []))[2].append((row['Seq_in_index'], spec))
+        definitions = [(name, unique, [spec for _, spec in sorted(specs)])
+                       for name, unique, specs in indexes.values()]
+        for name, _, _ in definitions:
+            cursor.execute(f"ALTER TABLE SpamRepository DROP INDEX `{name}`")
+        return definitions
+    finally:
+        cursor.close()
+
+
+def restore_indexes(connection, definitions):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW INDEX FROM SpamRepository")
+        present = {row[2] for row in cursor.fetchall()}
+        missing = [f"ADD {'UNIQUE ' if unique else ''}INDEX `{name}` ({', '.join(specs)})"
+                   for name, unique, specs in definitions if name not in present]
+        if missing:  # one ALTER builds them all in a single pass over the table
+            cursor.execute("ALTER TABLE SpamRepository " + ", ".join(missing))
+    finally:
+        cursor.close()
+
+
+def _insert_rows(cursor, rows, statement_rows=1000):
+    # mysql-connector sends executemany() of an INSERT ... VALUES as one
+    # multi-row INSERT; keep each under max_allowed_packet
+    for start in range(0, len(rows), statement_rows):
+        cursor.executemany("INSERT INTO SpamRepository (MessageText, SpamLabel, MessageType, MessageHash) "
+                           "VALUES (%s, %s, %s, %s)", rows[start:start + statement_rows])
+
+
+def _escape_field(value):
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _load_data_rows(cursor, rows):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', delete=False, newline='\n') as f:
+        for row in rows:
+            f.write("\t".join(_escape_field(value) for value in row) + "\n")
+        path = f.name
+    try:
+        cursor.execute(f"""
+            LOAD DATA LOCAL INFILE '{path.replace(os.sep, '/')}' INTO TABLE SpamRepository
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'
+            (MessageText, SpamLabel, MessageType, MessageHash)
+        """)
+    finally:
+        os.remove(path)
+
+
+def checkpoint_path(path):
+    return path + '.bulkload.json'
+
+
+def read_checkpoint(path):
+    if not os.path.exists(checkpoint_path(path)):
+        return None
+    with open(checkpoint_path(path), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_checkpoint(path, state):
+    target = checkpoint_path(path)
+    with open(target + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(target + '.tmp', target)
+
+
+# Function to load one file; returns the final state (rows read, loaded,
+# skipped as duplicates or empty, seconds, rows per second)
+def bulk_load(path, database=SPAM_REPOSITORY_DB, label=None, method='insert', transaction_rows=50000,
+              defer_indexes=False, message_type=IMPORTED_MESSAGE_TYPE, restart=False, progress=print, **read_options):
+    state = None if restart else read_checkpoint(path)
+    size = os.path.getsize(path)
+    if state is not None and state['size'] != size:
+        raise ValueError(f"{path} changed since the interrupted load ({state['size']} -> {size} bytes); "
+                         f"use --restart to load it from the beginning")
+    if state is None or state.get('finished'):
+        state = {'size': size, 'position': 0, 'loaded': 0, 'duplicates': 0, 'empty': 0,
+                 'seconds': 0.0, 'deferred_indexes': [], 'finished': False}
+
+    connection = _connect(database, local_infile=method == 'load-data')
+    cursor = connection.cursor()
+    try:
+        backfilled = prepare_table(connection)
+        if backfilled:
+            progress(f"Hashed {backfilled} existing rows")
+        seen = existing_hashes(connection)
+        if defer_indexes:
+            definitions = drop_indexes(connection)
+            # Keep the definitions of indexes an interrupted run already dropped
+            known = {definition[0] for definition in state['deferred_indexes']}
+            state['deferred_indexes'] += [list(d) for d in definitions if d[0] not in known]
+            # Save them now: if the load fails before its first commit, the
+            # next run must still know which indexes to rebuild
+            _write_checkpoint(path, state)
+        cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        write = _load_data_rows if method == 'load-data' else _insert_rows
+
+        started = time.perf_counter()
+        base_seconds, base_loaded = state['seconds'], state['loaded']
+        pending = []
+
+        def commit(position):
+            if pending:
+                write(cursor, pending)
+            connection.commit()
+            state['loaded'] += len(pending)
+            state['position'] = position
+            state['seconds'] = base_seconds + time.perf_counter() - started
+            _write_checkpoint(path, state)
+            pending.clear()
+            rate = (state['loaded'] - base_loaded) / max(state['seconds'] - base_seconds, 1e-9)
+            progress(f"{state['position']} rows read, {state['loaded']} loaded, "
+                     f"{state['duplicates']} duplicates, {rate:,.0f} rows/s")
+
+        position = state['position']
+        for position, texts, labels in iter_source(path, label, skip=state['position'], **read_options):
+            for text, spam in zip(texts, labels):
+                text = normalize_text(text)
+                if not text:
+                    state['empty'] += 1
+                    continue
+                digest = message_hash(text)
+                key = bytes.fromhex(digest)
+                if key in seen:
+                    state['duplicates'] += 1
+                    continue
+                seen.add(key)
+                pending.append((text, spam, message_type, digest))
+            if len(pending) >= transaction_rows:
+                commit(position)
+        commit(position)
+
+        if state['deferred_indexes']:
+            progress(f"Rebuilding {len(state['deferred_indexes'])} indexes")
+            restore_indexes(connection, state['deferred_indexes'])
+            state['deferred_indexes'] = []
+        state['finished'] = True
+        state['rows_per_second'] = state['loaded'] / max(state['seconds'], 1e-9)
+        _write_checkpoint(path, state)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+    return state
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Bulk-load labelled messages into SpamRepository.")
+    parser.add_argument('paths', nargs='+', help="CSV files (label and text columns) or TXT files")
+    parser.add_argument('--database', default=SPAM_REPOSITORY_DB)
+    parser.add_argument('--label', help="Label for every line of a TXT message list (spam/ham)")
+    parser.add_argument('--label-column', default=DEFAULT_LABEL_COLUMN)
+    parser.add_argument('--text-column', default=DEFAULT_TEXT_COLUMN)
+    parser.add_argument('--encoding', help=f"Default: {DEFAULT_ENCODING} for CSV, utf-8 for TXT")
+    parser.add_argument('--method', choices=['insert', 'load-data'], default='insert')
+    parser.add_argument('--transaction-rows', type=int, default=50000, help="Rows per committed transaction")
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help="Drop secondary indexes during the load and rebuild them afterwards")
+    parser.add_argument('--message-type', default=IMPORTED_MESSAGE_TYPE, help="MessageType of the loaded rows")
+    parser.add_argument('--restart', action='store_true', help="Ignore an interrupted load's checkpoint")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    for path in args.paths:
+        print(f"Loading {path}")
+        state = bulk_load(path, args.database, args.label, args.method, args.transaction_rows,
+                          args.defer_indexes, args.message_type, args.restart,
+                          label_column=args.label_column, text_column=args.text_column, encoding=args.encoding)
+        print(f"{path}: {state['loaded']} rows loaded, {state['duplicates']} duplicates and "
+              f"{state['empty']} empty rows skipped, {state['rows_per_second']:,.0f} rows/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# Cheap-first cascade in front of transform_text and the model.
+#
+# Most traffic is short, obvious ham ("hi", "hey", "ok see you"), and each of
+# those messages otherwise pays for NLTK tokenising, stemming, the vectorizer
+# and the model. The tiers below run in order and the first confident one
+# decides; everything else falls through to the full pipeline:
+#
+#   cache     - the model's earlier verdict for the same normalised message
+#   allowlist - the sender is on a known-sender allowlist (ham)
+#   template  - precomputed verdict for a common message template (digits
+#               masked), kept only when the model was confident about it
+#   short     - at most max_tokens plain words / max_chars characters, none
+#               of which stems to a vocabulary entry that leans towards spam
+#
+# The short tier is exact for MultinomialNB (and linear models). Its words
+# go through the same stopword list and Porter stemmer as transform_text,
+# only without NLTK's tokenizer, so anything that tokenizer would split
+# differently (apostrophes, quotes, "cannot", ...) is left to the model. The
+# stems are scored with the model's log-odds weights, and the message is
+# only decided here when that score is ham; the reported confidence is the
+# model's own posterior for it.
+#
+# Per-tier counts are kept in Cascade.stats and the
+# spam_cascade_resolved_total{tier=...} counter.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.cascade build-templates --messages classification_log.txt "SMS MESSAGES.txt"
+#     python -m spamfilter.cascade evaluate --data spam.csv
+
+import argparse
+import json
+import math
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+
+from .metrics import REGISTRY
+from .preprocessing import message_hash, normalize_message
+
+RESOLVED = REGISTRY.counter('spam_cascade_resolved_total', 'Messages decided by each cascade tier')
+
+TEMPLATES_FILE = 'templates.json'
+TIERS = ('cache', 'allowlist', 'template', 'short', 'model')
+
+# Punctuation NLTK's tokenizer always splits off a word, and words it splits
+# into two tokens even without an apostrophe
+_EDGE_PUNCTUATION = ',!?'
+_SPLIT_WORDS = frozenset(('cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'))
+_DIGITS = re.compile(r'\d+')
+# Anything that looks like a link, an amount or a phone number goes to the model
+_SUSPICIOUS = re.compile(r'https?:|www\.|[£$€]|\d{5,}')
+# Log lines written by the file sink: "... | Message: '...' | Prediction: ..."
+_LOG_MESSAGE = re.compile(r"\| Message: '(.*)' \| (?:Transformed: '.*' \| )?Prediction: ")
+
+
+# Function to reduce a message to its template: normalised, digit runs masked
+def template_key(text):
+    return _DIGITS.sub('0', normalize_message(text))
+
+
+def normalize_sender(sender):
+    return re.sub(r'[^\d+a-z]', '', str(sender).lower()).lstrip('+')
+
+
+def read_allowlist(path):
+    with open(path, encoding='utf-8') as f:
+        return frozenset(normalize_sender(line) for line in f if line.strip() and not line.startswith('#'))
+
+
+def read_templates(path):
+    with open(path, encoding='utf-8') as f:
+        return {key: (int(value[0]), float(value[1])) for key, value in json.load(f)['templates'].items()}
+
+
+# Function to read a model's spam-vs-ham log-odds as bias + weights . x.
+# Returns (None, None) for models that are not linear in the TF-IDF features.
+def log_odds_weights(model):
+    import numpy as np
+
+    if hasattr(model, 'feature_log_prob_') and hasattr(model, 'class_log_prior_'):
+        weights = model.feature_log_prob_[1] - model.feature_log_prob_[0]
+        bias = model.class_log_prior_[1] - model.class_log_prior_[0]
+    elif hasattr(model, 'coef_') and hasattr(model, 'intercept_') and len(model.coef_) == 1:
+        weights = model.coef_[0]
+        bias = model.intercept_[0]
+    else:
+        return None, None
+    return np.asarray(weights, dtype=np.float64), float(bias)
+
+
+# Function to find the vocabulary entries that push a message towards spam
+# by more than margin; None for models log_odds_weights cannot read, or whose
+# prior favours spam
+def spam_leaning_stems(vectorizer, model, margin=0.0):
+    weights, bias = log_odds_weights(model)
+    if weights is None or bias > 0:
+        return None
+    vocabulary = vectorizer.get_feature_names_out()
+    return frozenset(str(vocabulary[i]) for i in (weights > margin).nonzero()[0])
+
+
+# Function to split a short message into the words transform_text would
+# stem, or None when NLTK's tokenizer might split it differently
+def plain_words(message):
+    words = message.lower().split()
+    tokens = []
+    for position, word in enumerate(words):
+        token = word.strip(_EDGE_PUNCTUATION)
+        if position == len(words) - 1:
+            token = token.rstrip('.').rstrip(_EDGE_PUNCTUATION)
+        if not token.strip('.'):
+            continue  # punctuation only, which transform_text drops
+        if not token.isalnum() or token in _SPLIT_WORDS:
+            return None
+        tokens.append(token)
+    return tokens
+
+
+class Cascade:
+    # max_chars/max_tokens: what counts as a short message. spam_margin:
+    # log-probability margin above which a stem counts as spam-leaning (raise
+    # it to score more messages in the short tier; the verdict stays the
+    # model's). template_confidence: lowest model confidence (%) for a
+    # template verdict to be used. cache_size: 0 disables the cache.
+    def __init__(self, allowlist=(), templates=None, max_chars=40, max_tokens=4, spam_margin=0.0,
+                 template_confidence=95.0, cache_size=10000):
+        self.allowlist = frozenset(normalize_sender(sender) for sender in allowlist)
+        self.templates = {key: verdict for key, verdict in (templates or {}).items()
+                          if verdict[1] >= template_confidence}
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.spam_margin = spam_margin
+        self.cache_size = cache_size
+        self.stats = Counter()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._spam_stems = None
+        self._vectorizer = None
+        self._vocabulary = None
+        self._weights = None
+        self._bias = None
+
+    @classmethod
+    def from_config(cls, config):
+        allowlist = read_allowlist(config['sender_allowlist']) if config.get('sender_allowlist') else ()
+        templates = read_templates(config['templates_file']) if config.get('templates_file') else None
+        return cls(allowlist, templates, max_chars=config['cascade_max_chars'],
+                   max_tokens=config['cascade_max_tokens'],
+                   spam_margin=config['cascade_spam_margin'],
+                   template_confidence=config['cascade_template_confidence'])
+
+    # Function to derive the short tier's tables from the loaded model; the
+    # short tier stays off for models it cannot reason about
+    def prepare(self, vectorizer, model):
+        self._spam_stems = spam_leaning_stems(vectorizer, model, self.spam_margin)
+        self._weights, self._bias = log_odds_weights(model)
+        self._vectorizer = vectorizer
+        self._vocabulary = vectorizer.vocabulary_
+        with self._cache_lock:
+            self._cache.clear()
+
+    # Function to score a short message the way the model would; returns
+    # (transformed, ham confidence in %), or None when the model has to decide
+    def _short_ham(self, message):
+        from .preprocessing import _stemmer, english_stopwords
+
+        if self._spam_stems is None or len(message) > self.max_chars or _SUSPICIOUS.search(message):
+            return None
+        words = plain_words(message)
+        if words is None or len(words) > self.max_tokens:
+            return None
+        stop_words = english_stopwords()
+        ps = _stemmer()
+        stems = [ps.stem(word) for word in words if word not in stop_words]
+        if any(stem in self._spam_stems for stem in stems):
+            return None
+        transformed = " ".join(stems)
+        log_odds = self._bias
+        if any(stem in self._vocabulary for stem in stems):
+            log_odds += float(self._vectorizer.transform([transformed]).dot(self._weights)[0])
+        if log_odds > 0:
+            return None
+        return transformed, 100 / (1 + math.exp(log_odds))
+
+    def _resolve(self, tier):
+        self.stats[tier] += 1
+        RESOLVED.inc(tier=tier)
+
+    # Function to decide a message with the cheap tiers; returns a
+    # Classification, or None when the full model has to decide
+    def check(self, message, sender=None):
+        from .engine import Classification
+
+        if self.cache_size:
+            with self._cache_lock:
+                cached = self._cache.get(message_hash(message))
+            if cached is not None:
+                self._resolve('cache')
+                return Classification(message, cached[0], cached[1], cached[2], 'cache')
+
+        if sender is not None and normalize_sender(sender) in self.allowlist:
+            self._resolve('allowlist')
+            return Classification(message, None, 0, 100.0, 'allowlist')
+
+        if self.templates:
+            verdict = self.templates.get(template_key(message))
+            if verdict is not None:
+                self._resolve('template')
+                return Classification(message, None, verdict[0], verdict[1], 'template')
+
+        short = self._short_ham(message)
+        if short is not None:
+            self._resolve('short')
+            return Classification(message, short[0], 0, short[1], 'short')
+        return None
+
+    # Function to record a verdict of the full model
+    def remember(self, result):
+        self._resolve('model')
+        if not self.cache_size:
+            return
+        key = message_hash(result.message)
+        with self._cache_lock:
+            self._cache[key] = (result.transformed, result.prediction, result.confidence)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # Function to report the share of traffic each tier decided
+    def report(self):
+        total = sum(self.stats.values())
+        return {tier: {'messages': self.stats[tier], 'share': self.stats[tier] / total if total else 0.0}
+                for tier in TIERS}
+
+
+# Function to read messages from text files: lines written by the file sink
+# (classification_log.txt) or plain message lists such as "SMS MESSAGES.txt"
+def iter_logged_messages(paths):
+    from .datasets import _NUMBERING
+
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = _LOG_MESSAGE.search(line)
+                text = match.group(1) if match else _NUMBERING.sub('', line.strip())
+                if text.strip():
+                    yield text
+
+
+# Function to score the most common templates once with the full model
+def build_templates(engine, messages, min_count=2, min_confidence=95.0, limit=10000):
+    counts = Counter()
+    examples = {}
+    for message in messages:
+        key = template_key(message)
+        counts[key] += 1
+        examples.setdefault(key, message)
+    common = [key for key, count in counts.most_common(limit) if count >= min_count]
+    results = engine.classify_batch([examples[key] for key in common])
+    return {key: [result.prediction, round(result.confidence, 2), counts[key]]
+            for key, result in zip(common, results) if result.confidence >= min_confidence}
+
+
+# Function to run a labelled corpus through the cascade and the full model,
+# reporting per-tier shares and where the cascade disagreed with the model
+def evaluate(engine, cascade, texts):
+    import time
+
+    full = engine.classify_batch(texts)
+    disagreements = {tier: 0 for tier in TIERS}
+    start = time.perf_counter()
+    for text, expected in zip(texts, full):
+        result = cascade.check(text)
+        if result is None:
+            cascade.remember(expected)
+        elif result.prediction != expected.prediction:
+            disagreements[result.source] += 1
+    cheap_seconds = time.perf_counter() - start
+    return {'tiers': cascade.report(), 'disagreements_with_model': disagreements,
+            'cascade_check_seconds': cheap_seconds}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Build and evaluate the cheap-first cascade.")
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build-templates', help="Precompute verdicts for common message templates")
+    build.add_argument('--messages', nargs='+', required=True, help="Log files or message lists")
+    build.add_argument('--output', default=TEMPLATES_FILE)
+    build.add_argument('--min-count', type=int, default=2, help="Occurrences for a template to be kept")
+    build.add_argument('--min-confidence', type=float, default=95.0)
+
+    check = commands.add_parser('evaluate', help="Per-tier traffic shares and agreement with the model")
+    check.add_argument('--data', help="Labelled CSV (spam.csv)")
+    check.add_argument('--messages', nargs='*', default=[], help="Log files or message lists")
+    check.add_argument('--templates', help="Templates JSON to use")
+    check.add_argument('--max-chars', type=int, default=40)
+    check.add_argument('--max-tokens', type=int, default=4)
+    check.add_argument('--spam-margin', type=float, default=0.0)
+    return parser
+
+
+def main(argv=None):
+    from .engine import ClassificationEngine
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    engine = ClassificationEngine(args.model_dir).load()
+
+    if args.command == 'build-templates':
+        templates = build_templates(engine, iter_logged_messages(args.messages), args.min_count,
+                                    args.min_confidence)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'templates': templates}, f, indent=1)
+        print(f"Wrote {len(templates)} templates to {args.output}")
+        return 0
+
+    texts = list(iter_logged_messages(args.messages))
+    if args.data:
+        from .datasets import iter_labelled_csv
+
+        for chunk, _ in iter_labelled_csv(args.data):
+            texts.extend(chunk)
+    if not texts:
+        parser.error("give --data and/or --messages")
+    cascade = Cascade(templates=read_templates(args.templates) if args.templates else None,
+                      max_chars=args.max_chars, max_tokens=args.max_tokens, spam_margin=args.spam_margin)
+    cascade.prepare(engine.vectorizer, engine.model)
+    print(json.dumps(evaluate(engine, cascade, texts), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# Adaptive micro-batching for concurrent single-message requests.
+#
+# Every Streamlit session (or API caller) classifying on its own pays
+# scikit-learn's per-call overhead for vectorizer.transform([x]) and
+# predict_proba. A RequestCoalescer collects the requests that arrive within
+# a short window, scores them with one classify_batch call and hands every
+# caller its own result.
+#
+# The window adapts to load. Requests that queued up while the previous batch
+# was being scored are always taken without waiting. When a batch found such
+# company, or picked some up while waiting, the window doubles (up to
+# max_wait); when it found none, the window halves and soon drops to min_wait,
+# so a lone caller is not delayed by a window that only helps under load.
+#
+# Exposed metrics: spam_coalescer_batch_size, spam_coalescer_queue_delay_seconds
+# and the spam_coalescer_window_seconds gauge.
+#
+# Enable it in the app with SPAM_COALESCE=1, or benchmark it:
+#     python -m spamfilter.coalescer --threads 1 8 32
+
+import argparse
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from .metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram('spam_coalescer_batch_size', 'Requests scored per coalesced batch',
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+QUEUE_DELAY = REGISTRY.histogram('spam_coalescer_queue_delay_seconds',
+                                 'Time a request waited before its batch was scored')
+WINDOW = REGISTRY.gauge('spam_coalescer_window_seconds', 'Current batch collection window')
+
+_STOP = object()
+
+
+class RequestCoalescer:
+    # max_batch: most requests per batch. min_wait/max_wait: bounds of the
+    # collection window in seconds; the smallest non-zero window is
+    # max_wait / 16.
+    def __init__(self, engine, max_batch=64, min_wait=0.0, max_wait=0.005):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.window = min_wait
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-coalescer', daemon=True)
+                self._thread.start()
+
+    # Function to resize the window after a batch of batch_size requests
+    def _adapt(self, batch_size):
+        step = self.max_wait / 16
+        if batch_size > 1:
+            window = min(self.max_wait, max(self.window * 2, step))
+        else:
+            window = self.window / 2
+            if window < step:
+                window = self.min_wait
+        self.window = window
+        WINDOW.set(window)
+
+    # Function to queue a (message, transformed) pair; returns a Future of
+    # its Classification
+    def submit(self, message, transformed=None):
+        self._start()
+        future = Future()
+        self._queue.put((message, transformed, time.perf_counter(), future))
+        return future
+
+    # Function to score one message through the batcher, blocking until done
+    def score(self, message, transformed=None, timeout=None):
+        return self.submit(message, transformed).result(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                # Whatever queued up while the last batch was scored is taken
+                # without waiting; after that, wait until the deadline
+                timeout = deadline - time.perf_counter()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            self._adapt(len(batch))
+            started = time.perf_counter()
+            BATCH_SIZE.observe(len(batch))
+            self.batches += 1
+            self.requests += len(batch)
+            for _, _, queued_at, _ in batch:
+                QUEUE_DELAY.observe(started - queued_at)
+            messages = [item[0] for item in batch]
+            transformed = [item[1] for item in batch]
+            try:
+                results = self.engine.classify_batch(messages, None if None in transformed else transformed)
+            except Exception as error:
+                for item in batch:
+                    item[3].set_exception(error)
+                continue
+            for item, result in zip(batch, results):
+                item[3].set_result(result)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+
+# Function to run threads × requests_per_thread classify() calls and report
+# throughput and latency
+def _load_test(classify, messages, threads, requests_per_thread):
+    from .timing import latency_percentiles
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        own = []
+        for i in range(requests_per_thread):
+            start = time.perf_counter()
+            classify(messages[(offset + i) % len(messages)])
+            own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=worker, args=(n * requests_per_thread,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'requests_per_second': len(latencies) / elapsed, **latency_percentiles(latencies)}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare per-request scoring with coalesced batches.")
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32], help="Concurrent callers")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per caller")
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    return parser
+
+
+def main(argv=None):
+    from .datasets import synthetic_corpus
+    from .engine import ClassificationEngine
+
+    args = build_parser().parse_args(argv)
+    engine = ClassificationEngine(args.model_dir).load()
+    coalescer = RequestCoalescer(engine, args.max_batch, max_wait=args.max_wait_ms / 1000)
+    messages, _ = synthetic_corpus(2000)
+
+    print(f"{'threads':>8}{'mode':>11}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for threads in args.threads:
+        for mode, classify in (('direct', engine.classify), ('coalesced', coalescer.score)):
+            result = _load_test(classify, messages, threads, args.requests)
+            print(f"{threads:>8}{mode:>11}{result['requests_per_second']:>10.0f}"
+                  f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}")
+    coalescer.close()
+    print(f"\nMean coalesced batch: {coalescer.requests / max(coalescer.batches, 1):.1f} requests")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
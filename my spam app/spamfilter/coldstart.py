@@ -0,0 +1,201 @@
+# Cold-start benchmark: how long a fresh Python process takes before the app
+# can paint its page, and before it can classify.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.coldstart --output coldstart.json
+#     python -m spamfilter.coldstart --compare coldstart.json --fail-on-regression
+#
+# Every scenario runs in its own interpreter under `python -X importtime`, a
+# few times, and reports the median wall time plus, for the median run, the
+# slowest top-level imports and the import time of each package:
+#
+#   shell          - import spamfilter.ui and build the engine, i.e. what has
+#                    to happen before Streamlit can render the page
+#   model_ready    - the engine's load(): NLTK data, scikit-learn and the pickles,
+#                    which the UI now does in a background warm-up
+#   legacy_imports - the imports the original scripts did before rendering
+#                    anything (nltk, sklearn.exceptions, mysql.connector)
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from .timing import write_json_report
+
+_SHELL = """
+from spamfilter.config import load_config
+from spamfilter.engine import ClassificationEngine
+import spamfilter.ui
+ClassificationEngine.from_config(load_config(sinks=['none'], model_dir=MODEL_DIR))
+"""
+
+_MODEL_READY = """
+from spamfilter.engine import ClassificationEngine
+ClassificationEngine(MODEL_DIR).load()
+"""
+
+_LEGACY_IMPORTS = """
+import importlib
+for name in ('streamlit', 'pickle', 'nltk', 'nltk.corpus', 'nltk.stem.porter',
+             'sklearn.exceptions', 'mysql.connector'):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+"""
+
+SCENARIOS = {
+    'shell': _SHELL,
+    'model_ready': _MODEL_READY,
+    'legacy_imports': _LEGACY_IMPORTS,
+}
+
+# Times the scenario inside the child, so interpreter start-up is reported
+# separately from the work itself
+_WRAPPER = """
+import json, sys, time
+MODEL_DIR = {model_dir!r}
+start = time.perf_counter()
+exec(compile({code!r}, '<{name}>', 'exec'))
+sys.stdout.write(json.dumps({{'seconds': time.perf_counter() - start}}))
+"""
+
+
+# Function to parse `-X importtime` output into (module, self_us,
+# cumulative_us, depth) tuples
+def parse_importtime(stderr):
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        entries.append((stripped, int(parts[0]), int(parts[1]), depth))
+    return entries
+
+
+# Function to run one scenario in a fresh interpreter; returns the wall time
+# of the whole process, of the scenario itself and the parsed import times
+def run_scenario(name, code, model_dir='.', python=sys.executable):
+    script = _WRAPPER.format(model_dir=model_dir, code=code, name=name)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    start = time.perf_counter()
+    completed = subprocess.run([python, '-X', 'importtime', '-c', script],
+                               capture_output=True, text=True, env=env)
+    process_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario {name!r} failed:\n{completed.stderr[-2000:]}")
+    return {
+        'process_ms': process_seconds * 1000,
+        'scenario_ms': json.loads(completed.stdout)['seconds'] * 1000,
+        'imports': parse_importtime(completed.stderr),
+    }
+
+
+# Function to summarise the import times of one run: the total, the slowest
+# top-level imports and the self time summed per top-level package (which
+# says whether streamlit, nltk or scikit-learn is to blame)
+def import_breakdown(imports, top=10):
+    top_level = [entry for entry in imports if entry[3] == 0]
+    slowest = sorted(top_level, key=lambda entry: entry[2], reverse=True)[:top]
+    packages = {}
+    for module, self_us, _, _ in imports:
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'total_import_ms': sum(entry[2] for entry in top_level) / 1000,
+        'modules_imported': len(imports),
+        'slowest_imports': [{'module': module, 'cumulative_ms': cumulative / 1000, 'self_ms': self_us / 1000}
+                            for module, self_us, cumulative, _ in slowest],
+        'packages': [{'package': package, 'self_ms': self_us / 1000} for package, self_us in heaviest],
+    }
+
+
+def run(args):
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        runs = [run_scenario(name, SCENARIOS[name], args.model_dir) for _ in range(args.repeat)]
+        runs.sort(key=lambda result: result['scenario_ms'])
+        median = runs[len(runs) // 2]
+        report['scenarios'][name] = {
+            'scenario_ms': statistics.median(result['scenario_ms'] for result in runs),
+            'process_ms': statistics.median(result['process_ms'] for result in runs),
+            'min_scenario_ms': runs[0]['scenario_ms'],
+            **import_breakdown(median['imports'], args.top),
+        }
+    return report
+
+
+# Function to compare median scenario times with a baseline report; returns
+# the list of (scenario, old_ms, new_ms) that got slower than the threshold
+def compare_reports(baseline, current, threshold=0.10):
+    regressions = []
+    for name, result in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name, {}).get('scenario_ms')
+        new = result['scenario_ms']
+        if old and new > old * (1 + threshold):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def print_report(report):
+    for name, result in report['scenarios'].items():
+        print(f"\n{name}: {result['scenario_ms']:.0f} ms (process {result['process_ms']:.0f} ms, "
+              f"{result['modules_imported']} modules)")
+        for entry in result['packages']:
+            print(f"  {entry['self_ms']:>9.1f} ms  {entry['package']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Measure the app's cold-start time with python -X importtime.")
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument('--top', type=int, default=10, help="Slowest imports and packages to list per scenario")
+    parser.add_argument('--output', help="Write the report as JSON")
+    parser.add_argument('--compare', help="Baseline JSON to compare median times against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed slowdown (0.10 = 10%%)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Exit with status 1 when a scenario regressed")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.output:
+        write_json_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:.0f} ms -> {new:.0f} ms")
+        if not regressions:
+            print(f"\nNo cold-start regressions above {args.threshold:.0%} against {args.compare}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
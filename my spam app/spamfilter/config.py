@@ -0,0 +1,100 @@
+import os
+
+from .db import LOGS_DB, SPAM_REPOSITORY_DB
+
+DEFAULTS = {
+    'model_dir': '.',
+    'sinks': ['none'],
+    'log_file': 'classification_log.txt',
+    'log_format': 'simple',
+    'sqlite_path': 'spam_logs.db',
+    'logs_database': LOGS_DB,
+    'multi_database': 'SMSClassifierDB',
+    'repository_database': SPAM_REPOSITORY_DB,
+    'repository_spam_only': True,
+    'repository_lookup': False,
+    'feedback': False,
+    'show_stats': False,
+    'dashboard': False,
+    'db_resilience': True,
+    'spill_dir': 'spill_journal',
+    'stats_port': None,
+    'upload': True,
+    'explain': True,
+    'coalesce': False,
+    'languages': False,
+    'cascade': False,
+    'verdict_cache': False,
+    'verdict_cache_size': 10000,
+    'shared_cache': None,
+    'scoring_workers': 0,
+    'sender_allowlist': None,
+    'templates_file': None,
+    'cascade_max_chars': 40,
+    'cascade_max_tokens': 4,
+    'cascade_spam_margin': 0.0,
+    'cascade_template_confidence': 95.0,
+    'title': '📱 SMS Spam Classifier',
+    'footer': 'Built with ❤️ using Streamlit',
+}
+
+# Presets reproducing each of the original app scripts
+PRESETS = {
+    'ap': {'sinks': ['mysql'], 'show_stats': True, 'title': '📱 SMS Spam Filtering System',
+           'footer': 'My Final Year Project❤️ using Streamlit'},
+    'app': {'sinks': ['mysql'], 'title': '📱 SMS Spam Filtering System'},
+    'apps': {'sinks': ['file']},
+    'n': {'sinks': ['mysql-multi', 'file'], 'repository_spam_only': False,
+          'log_file': 'classified_messages_log.txt', 'log_format': 'detailed'},
+    'new': {'sinks': ['mysql-multi']},
+    'newapp': {'sinks': ['mysql-multi'], 'multi_database': None},
+    'mysmsapps': {'sinks': ['repository'], 'repository_lookup': True, 'feedback': True},
+    'sqlite': {'sinks': ['sqlite'], 'show_stats': True},
+}
+
+# Environment variables that override a configuration value
+_ENVIRONMENT = {
+    'SPAM_MODEL_DIR': ('model_dir', str),
+    'SPAM_SINKS': ('sinks', lambda value: [name.strip() for name in value.split(',') if name.strip()]),
+    'SPAM_LOG_FILE': ('log_file', str),
+    'SPAM_SQLITE_PATH': ('sqlite_path', str),
+    'SPAM_LOGS_DATABASE': ('logs_database', str),
+    'SPAM_MULTI_DATABASE': ('multi_database', lambda value: value or None),
+    'SPAM_REPOSITORY_DATABASE': ('repository_database', str),
+    'SPAM_SHOW_STATS': ('show_stats', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_DB_RESILIENCE': ('db_resilience', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_SPILL_DIR': ('spill_dir', str),
+    'SPAM_DASHBOARD': ('dashboard', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_STATS_PORT': ('stats_port', lambda value: int(value) if value else None),
+    'SPAM_UPLOAD': ('upload', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_EXPLAIN': ('explain', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_COALESCE': ('coalesce', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_LANGUAGES': ('languages', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_VERDICT_CACHE': ('verdict_cache', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_VERDICT_CACHE_SIZE': ('verdict_cache_size', int),
+    'SPAM_SCORING_WORKERS': ('scoring_workers', int),
+    'SPAM_SHARED_CACHE': ('shared_cache', lambda value: value or None),
+    'SPAM_CASCADE': ('cascade', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'SPAM_SENDER_ALLOWLIST': ('sender_allowlist', lambda value: value or None),
+    'SPAM_TEMPLATES_FILE': ('templates_file', lambda value: value or None),
+    'SPAM_CASCADE_MAX_CHARS': ('cascade_max_chars', int),
+    'SPAM_CASCADE_MAX_TOKENS': ('cascade_max_tokens', int),
+    'SPAM_CASCADE_SPAM_MARGIN': ('cascade_spam_margin', float),
+    'SPAM_CASCADE_TEMPLATE_CONFIDENCE': ('cascade_template_confidence', float),
+}
+
+
+# Function to build a configuration: defaults, then the preset (SPAM_PRESET
+# if none is given), then SPAM_* environment variables, then overrides
+def load_config(preset=None, **overrides):
+    config = dict(DEFAULTS)
+    preset = preset or os.environ.get('SPAM_PRESET')
+    if preset:
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset {preset!r}, expected one of {sorted(PRESETS)}")
+        config.update(PRESETS[preset])
+    for variable, (key, parse) in _ENVIRONMENT.items():
+        if variable in os.environ:
+            config[key] = parse(os.environ[variable])
+    config.update(overrides)
+    return config
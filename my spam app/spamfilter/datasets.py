@@ -0,0 +1,126 @@
+import hashlib
+import random
+import re
+
+# Column names and encoding of the Kaggle spam.csv used in the notebook
+DEFAULT_LABEL_COLUMN = 'v1'
+DEFAULT_TEXT_COLUMN = 'v2'
+DEFAULT_ENCODING = 'ISO-8859-1'
+
+_SPAM_LABELS = {'spam', '1', 'true'}
+_HAM_LABELS = {'ham', '0', 'false', 'not spam'}
+
+
+# Function to turn a label into 1 (spam) / 0 (ham), like the notebook's LabelEncoder
+def encode_label(label):
+    value = str(label).strip().lower()
+    if value in _SPAM_LABELS:
+        return 1
+    if value in _HAM_LABELS:
+        return 0
+    raise ValueError(f"Unknown label: {label!r}")
+
+
+# Function to read a labelled CSV in chunks of (texts, labels) without loading
+# the whole file into memory. skip_rows skips that many data rows (not counting
+# the header), e.g. the rows an earlier incremental run already consumed.
+def iter_labelled_csv(path, chunk_size=10000, label_column=DEFAULT_LABEL_COLUMN,
+                      text_column=DEFAULT_TEXT_COLUMN, encoding=DEFAULT_ENCODING, skip_rows=0):
+    import pandas as pd
+
+    reader = pd.read_csv(path, encoding=encoding, usecols=[label_column, text_column],
+                         dtype=str, keep_default_na=False, chunksize=chunk_size,
+                         skiprows=range(1, skip_rows + 1) if skip_rows else None)
+    for chunk in reader:
+        if chunk.empty:
+            continue
+        labels = [encode_label(label) for label in chunk[label_column]]
+        yield chunk[text_column].tolist(), labels
+
+
+# Function to drop duplicate (text, label) rows across chunks, keeping the first
+# one as the notebook's drop_duplicates(keep='first') does. Only an 8-byte digest
+# per distinct row is kept in memory.
+def iter_deduplicated(batches):
+    seen = set()
+    for texts, labels in batches:
+        kept_texts, kept_labels = [], []
+        for text, label in zip(texts, labels):
+            digest = hashlib.blake2b(f"{label}\x00{text}".encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            kept_texts.append(text)
+            kept_labels.append(label)
+        if kept_texts:
+            yield kept_texts, kept_labels
+
+
+_NUMBERING = re.compile(r'^\d+[.)]\s*')
+
+
+# Function to read a plain-text message list such as "SMS MESSAGES.txt", one
+# message per line with optional "12. " numbering
+def read_message_list(path, encoding='utf-8'):
+    messages = []
+    with open(path, encoding=encoding) as f:
+        for line in f:
+            text = _NUMBERING.sub('', line.strip())
+            if text:
+                messages.append(text)
+    return messages
+
+
+_SPAM_PHRASES = ["Congratulations! You have won", "Claim your free", "URGENT! Your account",
+                 "Call now to claim your", "Limited time offer:", "Win a brand new",
+                 "You have been selected for a", "Text WIN to 80086 for a"]
+_SPAM_OBJECTS = ["$1000 gift card", "cash prize", "iPhone", "holiday voucher", "loan of $5000",
+                 "ringtone subscription", "mobile upgrade", "lottery reward"]
+_HAM_PHRASES = ["hey are we still on for", "can you pick up", "I'll call you after", "don't forget",
+                "thanks for the", "see you at", "running late for", "did you finish"]
+_HAM_OBJECTS = ["lunch", "the kids", "the meeting", "dinner tonight", "my notes", "the gym",
+                "mum's birthday", "the report"]
+
+
+# Function to generate a labelled synthetic corpus of any size, as
+# (texts, labels), with roughly the notebook dataset's 13% spam rate
+def synthetic_corpus(size, spam_rate=0.13, seed=0):
+    rng = random.Random(seed)
+    texts, labels = [], []
+    for _ in range(size):
+        if rng.random() < spam_rate:
+            text = f"{rng.choice(_SPAM_PHRASES)} {rng.choice(_SPAM_OBJECTS)}! Reply {rng.randint(100, 99999)}"
+            labels.append(1)
+        else:
+            text = f"{rng.choice(_HAM_PHRASES)} {rng.choice(_HAM_OBJECTS)} {rng.choice(['', 'ok?', 'lol', ':)'])}"
+            labels.append(0)
+        texts.append(text.strip())
+    return texts, labels
+
+
+# MessageType values mysmsapps.py writes for the model's own predictions. They
+# are not confirmed labels, so training skips them unless asked otherwise.
+PREDICTED_MESSAGE_TYPES = ('Detected Spam', 'Not Spam')
+
+
+# Function to read labelled rows of the SpamRepository table in ID order, in
+# batches of (last_id, texts, labels). Keyset pagination on the primary key
+# means each batch is an index range scan, however large the table grows.
+def iter_spam_repository(connection, after_id=0, batch_size=10000, exclude_types=PREDICTED_MESSAGE_TYPES):
+    query = "SELECT ID, MessageText, SpamLabel FROM SpamRepository WHERE ID > %s"
+    if exclude_types:
+        placeholders = ", ".join(["%s"] * len(exclude_types))
+        query += f" AND (MessageType IS NULL OR MessageType NOT IN ({placeholders}))"
+    query += " ORDER BY ID LIMIT %s"
+
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(query, (after_id, *exclude_types, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            yield after_id, [row[1] for row in rows], [1 if row[2] else 0 for row in rows]
+    finally:
+        cursor.close()
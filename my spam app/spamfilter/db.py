@@ -0,0 +1,26 @@
+import os
+
+# Database names used by the apps
+LOGS_DB = 'spam_repository'            # sms_classification_logs, error_logs (ap.py, app.py)
+SPAM_REPOSITORY_DB = 'SpamRepositoryDB'  # SpamRepository (mysmsapps.py, spam_repository.sql)
+
+
+# Connection settings, defaulting to the local XAMPP setup the apps use.
+# Override them with SPAM_DB_HOST / SPAM_DB_PORT / SPAM_DB_USER / SPAM_DB_PASSWORD
+# and SPAM_DB_CONNECT_TIMEOUT (seconds).
+def db_config(database):
+    return {
+        'connection_timeout': int(os.environ.get('SPAM_DB_CONNECT_TIMEOUT', '5')),
+        'host': os.environ.get('SPAM_DB_HOST', 'localhost'),
+        'port': int(os.environ.get('SPAM_DB_PORT', '3306')),
+        'user': os.environ.get('SPAM_DB_USER', 'root'),
+        'password': os.environ.get('SPAM_DB_PASSWORD', ''),
+        'database': database,
+    }
+
+
+# Function to connect to a MySQL database (raises mysql.connector.Error)
+def connect_to_db(database):
+    import mysql.connector
+
+    return mysql.connector.connect(**db_config(database))
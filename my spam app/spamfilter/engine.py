@@ -0,0 +1,438 @@
+import threading
+from collections import namedtuple
+
+from .metrics import ERRORS, PREDICTIONS, stage_timer
+from .preprocessing import transform_text
+
+# prediction is 1 for spam and 0 for ham, confidence a percentage.
+# source is 'model', 'repository' when the SpamRepository lookup decided, or
+# the cascade tier that decided ('cache', 'allowlist', 'template', 'short'),
+# or the verdict cache level that had it ('verdict-cache', 'shared-cache');
+# transformed is None when transform_text was skipped.
+class Classification(namedtuple('Classification', 'message transformed prediction confidence source')):
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return 'Spam' if self.prediction == 1 else 'Not Spam'
+
+
+# The classification pipeline shared by every front-end: transform_text,
+# vectorizer, model and a logging sink. Artifacts and the heavy libraries
+# behind them are only loaded on first use (or by calling load()).
+# With route_languages, messages go to per-language bundles (see
+# spamfilter.languages); the cascade and the coalescer only handle English.
+class ClassificationEngine:
+    def __init__(self, model_dir='.', sink=None, repository_lookup=False, route_languages=False):
+        from .sinks import NullSink
+
+        self.model_dir = model_dir
+        self.sink = sink if sink is not None else NullSink()
+        self.repository_lookup = repository_lookup
+        self.route_languages = route_languages
+        self.vectorizer = None
+        self.model = None
+        self.router = None
+        self.load_error = None
+        self.coalescer = None
+        self.cascade = None
+        self.verdict_cache = None
+        self.verdict_cache_options = None
+        self.pool = None
+        self.pool_size = 0
+        self.config = None
+        self._load_lock = threading.Lock()
+        self._warm_up_thread = None
+        # The last message each thread scored in process and its TF-IDF row,
+        # so explain() right after classify() does not vectorize it again
+        self._scored = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        from .sinks import make_sink
+
+        engine = cls(config['model_dir'], make_sink(config), config['repository_lookup'],
+                     config.get('languages', False))
+        if config.get('coalesce'):
+            engine.enable_coalescing()
+        if config.get('cascade'):
+            from .cascade import Cascade
+
+            engine.cascade = Cascade.from_config(config)
+        if config.get('verdict_cache'):
+            engine.enable_verdict_cache(config['verdict_cache_size'], config.get('shared_cache'))
+        engine.pool_size = config.get('scoring_workers', 0)
+        engine.config = config
+        return engine
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    # Function to load the NLTK data, vectorizer and model (once)
+    def load(self):
+        if self.loaded:
+            return self
+        with self._load_lock:
+            if not self.loaded:
+                from .artifacts import load_artifacts
+                from .preprocessing import english_stopwords, ensure_nltk_data
+
+                with stage_timer('load_artifacts'):
+                    ensure_nltk_data()
+                    english_stopwords()
+                    vectorizer, model = load_artifacts(self.model_dir)
+                    if self.route_languages:
+                        from .languages import LanguageRouter
+
+                        self.router = LanguageRouter.load(self.model_dir, vectorizer, model)
+                if self.cascade is not None:
+                    self.cascade.prepare(vectorizer, model)
+                if self.verdict_cache_options is not None:
+                    self.verdict_cache = self._make_verdict_cache()
+                if self.pool_size and self.pool is None:
+                    from .workers import ScoringPool
+
+                    with stage_timer('start_workers'):
+                        self.pool = ScoringPool(self.model_dir, self.pool_size, config=self.config,
+                                                verdict_cache_options=self.verdict_cache_options).start()
+                self.vectorizer = vectorizer
+                self.model = model
+                self.load_error = None
+        return self
+
+    # Function to start loading in a background thread, so a UI can render
+    # before nltk, scikit-learn and the pickles are imported. Safe to call on
+    # every rerun; only the first call starts a thread.
+    def warm_up(self):
+        with self._load_lock:
+            if self._warm_up_thread is not None or self.loaded:
+                return
+
+            def load_in_background():
+                try:
+                    self.load()
+                except Exception as error:
+                    self.load_error = error
+
+            self._warm_up_thread = threading.Thread(target=load_in_background, name='engine-warm-up', daemon=True)
+            self._warm_up_thread.start()
+
+    # Function to wait for a warm-up started by warm_up(); returns whether the
+    # engine is loaded
+    def wait_until_loaded(self, timeout=None):
+        thread = self._warm_up_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.loaded
+
+    # Function to score concurrent classify() calls together in small
+    # batches (see spamfilter.coalescer)
+    def enable_coalescing(self, **options):
+        from .coalescer import RequestCoalescer
+
+        self.coalescer = RequestCoalescer(self, **options)
+        return self.coalescer
+
+    # Function to keep model verdicts in a two-level cache (see
+    # spamfilter.sharedcache): an in-process LRU of local_size entries and,
+    # with shared ('memory' or 'host:port'), a shared tier. Not used with the
+    # repository lookup, whose answer can change without a new model.
+    def enable_verdict_cache(self, local_size=10000, shared=None):
+        self.verdict_cache_options = (local_size, shared)
+        if self.loaded:
+            self.verdict_cache = self._make_verdict_cache()
+
+    def _make_verdict_cache(self):
+        from .artifacts import artifact_version
+        from .sharedcache import VerdictCache, make_backend
+
+        local_size, shared = self.verdict_cache_options
+        return VerdictCache(artifact_version(self.model_dir), local_size,
+                            make_backend(shared) if shared else None)
+
+    def _use_verdict_cache(self):
+        return (self.verdict_cache is not None and not self.repository_lookup
+                and (self.router is None or len(self.router.bundles) == 1))
+
+    # Function to classify one message. sender is only used by the
+    # cascade's allowlist.
+    def classify(self, message, sender=None):
+        self.load()
+        language, text = 'en', message
+        if self.router is not None:
+            with stage_timer('route_language'):
+                language, text = self.router.route(message)
+            if language != self.router.default:
+                return self._classify_language(message, text, language)
+
+        if self.cascade is not None:
+            with stage_timer('cascade'):
+                result = self.cascade.check(message, sender)
+            if result is not None:
+                PREDICTIONS.inc(prediction=result.label)
+                return result
+
+        use_cache = self._use_verdict_cache()
+        if use_cache:
+            with stage_timer('verdict_cache'):
+                cached = self.verdict_cache.get(text)
+            if cached is not None:
+                result = Classification(message, cached[2], cached[0], cached[1], cached[3])
+                PREDICTIONS.inc(prediction=result.label)
+                return result
+
+        result = None
+        if self.pool is not None and not self.repository_lookup:
+            # transform_text and the model run in a worker process
+            from .workers import PoolUnavailable
+
+            try:
+                with stage_timer('scoring_worker'):
+                    result = self.pool.classify(text)._replace(message=message)
+            except PoolUnavailable:
+                ERRORS.inc(stage='scoring_workers')  # scored in process below
+            else:
+                PREDICTIONS.inc(prediction=result.label)
+        if result is None:
+            with stage_timer('transform_text'):
+                transformed = transform_text(text)
+
+            if self.repository_lookup and self.sink.lookup_spam(transformed):
+                PREDICTIONS.inc(prediction='Spam')
+                return Classification(message, transformed, 1, 100.0, 'repository')
+
+            if self.coalescer is not None:
+                result = self.coalescer.score(message, transformed)
+            else:
+                with stage_timer('vectorize'):
+                    vectorized = self.vectorizer.transform([transformed])
+                self._scored.last = (message, transformed, self.vectorizer, self.model, vectorized)
+                with stage_timer('predict'):
+                    prediction = int(self.model.predict(vectorized)[0])
+                with stage_timer('predict_proba'):
+                    confidence = float(self.model.predict_proba(vectorized)[0][prediction] * 100)
+
+                result = Classification(message, transformed, prediction, confidence, 'model')
+                PREDICTIONS.inc(prediction=result.label)
+        if use_cache:
+            self.verdict_cache.put(result)
+        if self.cascade is not None:
+            self.cascade.remember(result)
+        return result
+
+    # Function to classify a message routed to a non-English bundle
+    def _classify_language(self, message, text, language):
+        vectorizer, model = self.router.bundles[language]
+        with stage_timer('transform_text'):
+            transformed = self.router.transform(text, language)
+        if self.repository_lookup and self.sink.lookup_spam(transformed):
+            PREDICTIONS.inc(prediction='Spam')
+            return Classification(message, transformed, 1, 100.0, 'repository')
+        return self._score_batch([message], [transformed], vectorizer, model)[0]
+
+    # Function to classify many messages with one vectorizer.transform and one
+    # predict_proba call (no repository lookup, no logging). With language
+    # routing, each language's messages form one batch.
+    def classify_batch(self, messages, transformed=None):
+        self.load()
+        messages = list(messages)
+        if not messages:
+            return []
+        if self.router is not None and transformed is None and len(self.router.bundles) > 1:
+            return self._classify_batch_by_language(messages)
+        if transformed is None and self.pool is not None:
+            from .workers import PoolUnavailable
+
+            texts = [self.router.route(message)[1] for message in messages] if self.router else messages
+            try:
+                with stage_timer('scoring_workers_batch'):
+                    results = [result._replace(message=message)
+                               for message, result in zip(messages, self.pool.classify_batch(texts))]
+            except PoolUnavailable:
+                ERRORS.inc(stage='scoring_workers')  # scored in process below
+            else:
+                spam = sum(result.prediction for result in results)
+                PREDICTIONS.inc(spam, prediction='Spam')
+                PREDICTIONS.inc(len(results) - spam, prediction='Not Spam')
+                return results
+        if transformed is None and self._use_verdict_cache():
+            return self._classify_batch_cached(messages)
+        if transformed is None:
+            with stage_timer('transform_text_batch'):
+                texts = [self.router.route(message)[1] for message in messages] if self.router else messages
+                transformed = [transform_text(text) for text in texts]
+        return self._score_batch(messages, transformed, self.vectorizer, self.model)
+
+    # Function to score only the messages the verdict cache does not have
+    def _classify_batch_cached(self, messages):
+        texts = [self.router.route(message)[1] for message in messages] if self.router else messages
+        with stage_timer('verdict_cache_batch'):
+            cached = self.verdict_cache.get_many(texts)
+        results = [None if verdict is None else Classification(message, verdict[2], verdict[0], verdict[1], verdict[3])
+                   for message, verdict in zip(messages, cached)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            with stage_timer('transform_text_batch'):
+                transformed = [transform_text(texts[i]) for i in missing]
+            scored = self._score_batch([messages[i] for i in missing], transformed, self.vectorizer, self.model)
+            self.verdict_cache.put_many(scored)
+            for i, result in zip(missing, scored):
+                results[i] = result
+        hits = [result for result in results if result.source != 'model']
+        spam = sum(result.prediction for result in hits)
+        PREDICTIONS.inc(spam, prediction='Spam')
+        PREDICTIONS.inc(len(hits) - spam, prediction='Not Spam')
+        return results
+
+    def _classify_batch_by_language(self, messages):
+        groups = {}
+        for index, message in enumerate(messages):
+            language, text = self.router.route(message)
+            groups.setdefault(language, []).append((index, text))
+        results = [None] * len(messages)
+        for language, members in groups.items():
+            vectorizer, model = self.router.bundles[language]
+            with stage_timer('transform_text_batch'):
+                transformed = [self.router.transform(text, language) for _, text in members]
+            scored = self._score_batch([messages[index] for index, _ in members], transformed, vectorizer, model)
+            for (index, _), result in zip(members, scored):
+                results[index] = result
+        return results
+
+    def _score_batch(self, messages, transformed, vectorizer, model):
+        with stage_timer('vectorize_batch'):
+            vectorized = vectorizer.transform(transformed)
+        if len(messages) == 1:
+            self._scored.last = (messages[0], transformed[0], vectorizer, model, vectorized)
+        return self._score_vectorized(messages, transformed, vectorized, model)
+
+    def _score_vectorized(self, messages, transformed, vectorized, model):
+        with stage_timer('predict_proba_batch'):
+            proba = model.predict_proba(vectorized)
+        predictions = proba.argmax(axis=1)
+        confidences = proba.max(axis=1) * 100
+
+        results = [Classification(message, text, int(prediction), float(confidence), 'model')
+                   for message, text, prediction, confidence in zip(messages, transformed, predictions, confidences)]
+        spam = int(predictions.sum())
+        PREDICTIONS.inc(spam, prediction='Spam')
+        PREDICTIONS.inc(len(results) - spam, prediction='Not Spam')
+        return results
+
+    # Function to find the (language, vectorizer, model) that scores a message
+    def _bundle_for(self, message):
+        if self.router is None:
+            return 'en', self.vectorizer, self.model
+        language = self.router.route(message)[0]
+        return (language, *self.router.bundles[language])
+
+    # Function to explain a result: the top stemmed tokens behind its
+    # prediction, as spamfilter.explain.Contribution(token, weight)
+    def explain(self, result, top=5):
+        last = getattr(self._scored, 'last', None)
+        if last is not None and result.source == 'model' and last[:2] == (result.message, result.transformed):
+            from .explain import explain_matrix
+
+            with stage_timer('explain'):
+                return explain_matrix(last[2], last[3], last[4], [result.prediction], top)[0]
+        return self.explain_results([result], top)[0]
+
+    # Function to explain many results, one vectorizer.transform per bundle
+    def explain_results(self, results, top=5):
+        from .explain import explain_transformed
+
+        self.load()
+        groups = {}
+        for index, result in enumerate(results):
+            language, vectorizer, model = self._bundle_for(result.message)
+            transformed = result.transformed
+            if transformed is None:
+                text = self.router.route(result.message)[1] if self.router else result.message
+                transformed = self.router.transform(text, language) if self.router else transform_text(text)
+            groups.setdefault(language, (vectorizer, model, []))[2].append((index, transformed, result.prediction))
+        explanations = [None] * len(results)
+        with stage_timer('explain'):
+            for vectorizer, model, members in groups.values():
+                rows = explain_transformed(vectorizer, model, [m[1] for m in members], [m[2] for m in members], top)
+                for (index, _, _), explanation in zip(members, rows):
+                    explanations[index] = explanation
+        return explanations
+
+    # Function to classify and explain many messages (for bulk audits);
+    # returns (Classification, explanation) pairs
+    def explain_batch(self, messages, top=5):
+        self.load()
+        messages = list(messages)
+        if messages and self.router is None and self.pool is None and not self._use_verdict_cache():
+            # Score and explain from the same TF-IDF matrix
+            from .explain import explain_matrix
+
+            with stage_timer('transform_text_batch'):
+                transformed = [transform_text(message) for message in messages]
+            with stage_timer('vectorize_batch'):
+                vectorized = self.vectorizer.transform(transformed)
+            results = self._score_vectorized(messages, transformed, vectorized, self.model)
+            with stage_timer('explain'):
+                explanations = explain_matrix(self.vectorizer, self.model, vectorized,
+                                              [result.prediction for result in results], top)
+            return list(zip(results, explanations))
+        results = self.classify_batch(messages)
+        return list(zip(results, self.explain_results(results, top)))
+
+    # Function to log a result; returns a list of error messages (empty when
+    # everything was written)
+    def log(self, result):
+        try:
+            self.sink.log(result)
+        except Exception as error:
+            ERRORS.inc(stage='log')
+            return [f"Failed to log the classification: {error}"]
+        return []
+
+    # Function to log several results in one call to the sink (one
+    # transaction for the database sinks); returns a list of error messages
+    def log_many(self, results):
+        try:
+            self.sink.log_many(results)
+        except Exception as error:
+            ERRORS.inc(len(results), stage='log')
+            return [f"Failed to log {len(results)} classifications: {error}"]
+        return []
+
+    # Function to log an application error, never raising
+    def log_error(self, error_message):
+        try:
+            self.sink.log_error(error_message)
+        except Exception:
+            ERRORS.inc(stage='log_error')
+
+    def recent(self, limit=5):
+        return self.sink.recent(limit)
+
+    def spam_count(self):
+        return self.sink.spam_count()
+
+    def close(self):
+        if self.coalescer is not None:
+            self.coalescer.close()
+        if self.verdict_cache is not None:
+            self.verdict_cache.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.sink.close()
+
+
+# Function to build the engine a scoring worker process runs: with the
+# parent's configuration, the same language routing, cascade and verdict
+# cache (including the shared tier), but no sink (the parent logs) and no
+# workers or coalescer of its own
+def make_worker_engine(model_dir, config=None, verdict_cache_options=None):
+    if config is not None:
+        return ClassificationEngine.from_config(dict(config, model_dir=model_dir, sinks=['none'], dashboard=False,
+                                                     coalesce=False, scoring_workers=0))
+    engine = ClassificationEngine(model_dir)
+    if verdict_cache_options is not None:
+        engine.enable_verdict_cache(*verdict_cache_options)
+    return engine
@@ -0,0 +1,188 @@
+# Fast soft-voting ensemble of linear models on sparse TF-IDF input.
+#
+# The notebook's VotingClassifier uses SVC(probability=True) on dense arrays,
+# which trains an extra 5-fold Platt scaling and scores through an RBF kernel.
+# Here every member is linear (MultinomialNB, LogisticRegression, SGDClassifier
+# with log loss), so each one's spam probability is sigmoid(X @ w + b). After
+# fitting, the members' weights are stacked into one matrix and scoring is a
+# single sparse matrix product followed by a weighted average of sigmoids.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.ensemble --data spam.csv              # benchmark only
+#     python -m spamfilter.ensemble --data spam.csv --save .     # also write model.pkl
+#     python -m spamfilter.ensemble --data spam.csv --with-svc   # include the notebook's SVC
+
+import argparse
+import sys
+import time
+
+from .artifacts import save_artifacts
+from .timing import StageRecorder, latency_percentiles, write_json_report
+from .train import add_data_arguments, load_corpus
+
+
+# Function to build the default members as (name, estimator, weight)
+def default_estimators(random_state=2):
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+    from sklearn.naive_bayes import MultinomialNB
+
+    return [
+        ('nb', MultinomialNB(), 1.0),
+        ('lr', LogisticRegression(C=10.0, solver='liblinear'), 1.0),
+        ('sgd', SGDClassifier(loss='log_loss', alpha=1e-5, random_state=random_state), 1.0),
+    ]
+
+
+# Function to turn a fitted binary linear model into (w, b) with
+# P(class 1) = sigmoid(X @ w + b)
+def log_odds_weights(estimator):
+    import numpy as np
+
+    if hasattr(estimator, 'feature_log_prob_'):  # MultinomialNB
+        w = estimator.feature_log_prob_[1] - estimator.feature_log_prob_[0]
+        b = estimator.class_log_prior_[1] - estimator.class_log_prior_[0]
+        return np.asarray(w, dtype=np.float64), float(b)
+    return np.asarray(estimator.coef_[0], dtype=np.float64), float(estimator.intercept_[0])
+
+
+# Soft-voting ensemble with the same predict / predict_proba interface as the
+# scikit-learn model the apps load from model.pkl
+class LinearEnsemble:
+    def __init__(self, estimators=None):
+        self.estimators = estimators if estimators is not None else default_estimators()
+
+    def fit(self, X, y):
+        import numpy as np
+
+        columns, biases, weights = [], [], []
+        for _, estimator, weight in self.estimators:
+            estimator.fit(X, y)
+            w, b = log_odds_weights(estimator)
+            columns.append(w)
+            biases.append(b)
+            weights.append(weight)
+
+        self.classes_ = np.array([0, 1])
+        self.coef_matrix_ = np.column_stack(columns)              # (n_features, n_members)
+        self.intercepts_ = np.asarray(biases)
+        self.member_weights_ = np.asarray(weights) / np.sum(weights)
+        return self
+
+    def predict_proba(self, X):
+        import numpy as np
+
+        log_odds = X @ self.coef_matrix_ + self.intercepts_      # one sparse product for all members
+        spam = (1.0 / (1.0 + np.exp(-log_odds))) @ self.member_weights_
+        return np.column_stack([1.0 - spam, spam])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] >= 0.5).astype(int)
+
+
+# Function to time a model: fit, batch throughput and one-message latency
+def benchmark_model(name, model, vectorizer, X_train, y_train, X_test, y_test, test_corpus,
+                    single_runs=500, dense=False):
+    from sklearn.metrics import accuracy_score, precision_score
+
+    to_input = (lambda X: X.toarray()) if dense else (lambda X: X)
+
+    start = time.perf_counter()
+    model.fit(to_input(X_train), y_train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proba = model.predict_proba(to_input(X_test))
+    batch_seconds = time.perf_counter() - start
+    y_pred = proba.argmax(axis=1)
+
+    # What the apps do per click: transform one message and score it
+    samples = []
+    for i in range(min(single_runs, len(test_corpus))):
+        start = time.perf_counter()
+        model.predict_proba(to_input(vectorizer.transform([test_corpus[i]])))
+        samples.append(time.perf_counter() - start)
+
+    return {
+        'model': name,
+        'accuracy': round(accuracy_score(y_test, y_pred), 4),
+        'precision': round(precision_score(y_test, y_pred, zero_division=0), 4),
+        'fit_seconds': round(fit_seconds, 4),
+        'batch_messages_per_second': round(X_test.shape[0] / batch_seconds, 1) if batch_seconds else None,
+        **latency_percentiles(samples),
+    }
+
+
+def run(args):
+    import numpy as np
+    from sklearn.ensemble import VotingClassifier
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.model_selection import train_test_split
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.svm import SVC
+
+    from .preprocessing import ensure_nltk_data
+
+    recorder = StageRecorder(trace_memory=False)
+    with recorder.stage('nltk_data'):
+        ensure_nltk_data()
+    corpus, labels = load_corpus(args, recorder)
+
+    with recorder.stage('tfidf_fit'):
+        vectorizer = TfidfVectorizer(max_features=args.max_features)
+        X = vectorizer.fit_transform(corpus)
+        y = np.asarray(labels)
+    indices = np.arange(len(corpus))
+    X_train, X_test, y_train, y_test, _, test_idx = train_test_split(
+        X, y, indices, test_size=0.2, random_state=2)
+    test_corpus = [corpus[i] for i in test_idx]
+
+    candidates = [('MultinomialNB (current)', MultinomialNB(), False),
+                  ('LinearEnsemble', LinearEnsemble(), False)]
+    if args.with_svc:
+        candidates.append(('Voting NB+SVC(probability=True), dense',
+                           VotingClassifier([('nb', MultinomialNB()), ('svc', SVC(probability=True))],
+                                            voting='soft'), True))
+
+    results = []
+    for name, model, dense in candidates:
+        with recorder.stage(name):
+            results.append(benchmark_model(name, model, vectorizer, X_train, y_train, X_test, y_test,
+                                           test_corpus, single_runs=args.single_runs, dense=dense))
+        if args.save and isinstance(model, LinearEnsemble):
+            save_artifacts(vectorizer, model, args.save)
+
+    return {'rows': int(X.shape[0]), 'results': results, **recorder.to_dict()}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the linear ensemble against the current model.")
+    add_data_arguments(parser)
+    parser.add_argument('--max-features', type=int, default=3000)
+    parser.add_argument('--with-svc', action='store_true',
+                        help="Also benchmark the notebook's VotingClassifier with SVC (slow)")
+    parser.add_argument('--single-runs', type=int, default=500, help="Messages timed one at a time")
+    parser.add_argument('--save', metavar='DIR', help="Write the ensemble as model.pkl (and its vectorizer) here")
+    parser.add_argument('--report', help="Write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = run(args)
+
+    header = f"{'model':<42}{'acc':>8}{'prec':>8}{'fit s':>9}{'msg/s':>12}{'p50 ms':>9}{'p99 ms':>9}"
+    print(header)
+    for r in report['results']:
+        print(f"{r['model']:<42}{r['accuracy']:>8.4f}{r['precision']:>8.4f}{r['fit_seconds']:>9.3f}"
+              f"{r['batch_messages_per_second'] or 0:>12.0f}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}")
+
+    if args.report:
+        write_json_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    # Run the imported module's main so a saved ensemble pickles as
+    # spamfilter.ensemble.LinearEnsemble, which the apps can load, not __main__
+    from .ensemble import main as module_main
+    sys.exit(module_main())
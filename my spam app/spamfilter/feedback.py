@@ -0,0 +1,465 @@
+# Online learning from user-confirmed labels.
+#
+# Feedback ("this was wrong") is stored in the SpamRepository table as a row
+# with MessageType 'User Feedback' and the corrected SpamLabel. An
+# OnlineLearner folds feedback into a private copy of the MultinomialNB model
+# with partial_fit, which only adds the message's TF-IDF row to the class
+# feature counts, and every publish_interval seconds swaps the updated copy in
+# as the published model. Scoring code just reads learner.model, so it is never
+# blocked by an update.
+#
+# Guard rails against poisoning:
+#   - each distinct message (by normalised hash) counts once, first label wins
+#   - per-source rate limit (e.g. per Streamlit session). Rows read from
+#     SpamRepository carry no session, so they share the source 'db'; a row
+#     over the limit is not skipped but left for a later poll
+#   - total feedback weight is capped at a share of the original training data
+#     (the training row count when feedback was first learned, not the
+#     current count, which grows with the feedback itself)
+#   - before publishing, the candidate is checked against a labelled canary set
+#     and rejected if its accuracy drops too much
+#
+# The guard's memory (messages seen, per-source history, feedback weight so
+# far, the training count) is saved in feedback_state.json with the last
+# feedback row applied, so it holds across `learn --once` runs.
+#
+# Every published model is also kept under model_snapshots/ (the newest
+# --keep-snapshots of them), and
+#     python -m spamfilter.feedback rollback [--to VERSION]
+# puts an earlier one back as model.pkl.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.feedback learn --canary canary.csv
+#     python -m spamfilter.feedback list
+#     python -m spamfilter.feedback rollback
+
+import argparse
+import copy
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+
+from .artifacts import MODEL_FILE, atomic_pickle_dump, load_artifacts
+from .db import SPAM_REPOSITORY_DB, connect_to_db
+from .preprocessing import ensure_nltk_data, message_hash, transform_text
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_MESSAGE_TYPE = 'User Feedback'
+SNAPSHOT_DIR = 'model_snapshots'
+STATE_FILE = 'feedback_state.json'
+KEEP_SNAPSHOTS = 20
+
+
+# Function to store a user correction in the SpamRepository table
+def record_feedback(connection, message, is_spam):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO SpamRepository (MessageText, SpamLabel, DateAdded, MessageType)
+            VALUES (%s, %s, %s, %s)
+        """, (message, bool(is_spam), datetime.now(), FEEDBACK_MESSAGE_TYPE))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+# Function to read feedback rows added after a given ID, as (id, message, label)
+def fetch_feedback(connection, after_id=0, limit=1000):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT ID, MessageText, SpamLabel FROM SpamRepository
+            WHERE ID > %s AND MessageType = %s
+            ORDER BY ID
+            LIMIT %s
+        """, (after_id, FEEDBACK_MESSAGE_TYPE, limit))
+        return [(row[0], row[1], 1 if row[2] else 0) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+# Decides whether a piece of feedback may be learned. base_count is the
+# number of training rows the share cap is measured against; without it the
+# cap is off.
+class FeedbackGuard:
+    def __init__(self, max_per_source_per_hour=20, max_feedback_share=0.05, remember=100000, base_count=None):
+        self.max_per_source_per_hour = max_per_source_per_hour
+        self.max_feedback_share = max_feedback_share
+        self.remember = remember
+        self.base_count = base_count
+        self.feedback_weight = 0.0
+        self._seen = OrderedDict()
+        self._by_source = defaultdict(deque)
+        self.rejected = defaultdict(int)
+
+    # Function to export what the guard remembers, as JSON-friendly values
+    def state(self):
+        return {'training_count': self.base_count, 'feedback_weight': self.feedback_weight,
+                'seen': list(self._seen), 'sources': {source: list(times) for source, times in self._by_source.items()}}
+
+    # Function to pick up what an earlier run remembered
+    def restore(self, state):
+        if state.get('training_count') is not None:
+            self.base_count = state['training_count']
+        self.feedback_weight = float(state.get('feedback_weight', 0.0))
+        self._seen = OrderedDict.fromkeys(state.get('seen', [])[-self.remember:])
+        self._by_source = defaultdict(deque, {source: deque(times)
+                                              for source, times in state.get('sources', {}).items()})
+
+    def admit(self, message, source, weight, now=None):
+        return self.check(message, source, weight, now) is None
+
+    # Function to admit a piece of feedback; returns None when it may be
+    # learned, or why not ('duplicate', 'rate_limited' or 'share_cap')
+    def check(self, message, source, weight, now=None):
+        now = time.time() if now is None else now
+
+        key = message_hash(message)
+        if key in self._seen:
+            return self._reject('duplicate')
+
+        recent = self._by_source[source]
+        while recent and recent[0] < now - 3600:
+            recent.popleft()
+        if len(recent) >= self.max_per_source_per_hour:
+            return self._reject('rate_limited')
+
+        if self.base_count and self.feedback_weight + weight > self.max_feedback_share * self.base_count:
+            return self._reject('share_cap')
+
+        self.feedback_weight += weight
+        recent.append(now)
+        self._seen[key] = None
+        if len(self._seen) > self.remember:
+            self._seen.popitem(last=False)
+        return None
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        return reason
+
+
+# Function to measure accuracy on a labelled canary set (X, y)
+def canary_accuracy(model, canary):
+    X, y = canary
+    return float((model.predict(X) == y).mean())
+
+
+# Function to keep a copy of a model under snapshot_dir, returns its version
+def save_snapshot(model, snapshot_dir=SNAPSHOT_DIR):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    atomic_pickle_dump(model, os.path.join(snapshot_dir, f'model-{version}.pkl'))
+    return version
+
+
+# Function to write a model snapshot and publish it as model.pkl
+def publish_snapshot(model, model_dir='.', snapshot_dir=SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS):
+    version = save_snapshot(model, snapshot_dir)
+    atomic_pickle_dump(model, os.path.join(model_dir, MODEL_FILE))
+    prune_snapshots(snapshot_dir, keep)
+    return version
+
+
+# Function to delete all but the newest `keep` snapshots (and rolled-back
+# snapshots); returns how many files were removed
+def prune_snapshots(snapshot_dir=SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS):
+    if not keep or not os.path.isdir(snapshot_dir):
+        return 0
+    removed = 0
+    for suffix in ('.pkl', '.pkl.rolledback'):
+        names = sorted(name for name in os.listdir(snapshot_dir)
+                       if name.startswith('model-') and name.endswith(suffix))
+        for name in names[:-keep]:
+            os.remove(os.path.join(snapshot_dir, name))
+            removed += 1
+    return removed
+
+
+# Function to list snapshot versions, oldest first
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(name[len('model-'):-len('.pkl')] for name in os.listdir(snapshot_dir)
+                  if name.startswith('model-') and name.endswith('.pkl'))
+
+
+# Function to put a snapshot back as model.pkl. Without a version, goes back to
+# the snapshot before the newest one.
+def rollback(model_dir='.', snapshot_dir=SNAPSHOT_DIR, version=None):
+    versions = list_snapshots(snapshot_dir)
+    if version is None:
+        if len(versions) < 2:
+            raise ValueError("No earlier snapshot to roll back to")
+        version = versions[-2]
+    elif version not in versions:
+        raise ValueError(f"Unknown snapshot version: {version}")
+
+    source = os.path.join(snapshot_dir, f'model-{version}.pkl')
+    tmp_path = os.path.join(model_dir, f'.tmp-rollback-{MODEL_FILE}')
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, os.path.join(model_dir, MODEL_FILE))
+
+    # Snapshots newer than the restored one are moved aside, so the next
+    # rollback keeps going back instead of returning to the bad model
+    for newer in versions[versions.index(version) + 1:]:
+        path = os.path.join(snapshot_dir, f'model-{newer}.pkl')
+        os.replace(path, path + '.rolledback')
+    return version
+
+
+# Applies user feedback to a copy of the model in a background thread and
+# periodically publishes it
+class OnlineLearner:
+    def __init__(self, vectorizer, model, model_dir='.', snapshot_dir=SNAPSHOT_DIR,
+                 publish_interval=300, guard=None, canary=None, feedback_weight=1.0,
+                 max_accuracy_drop=0.01, queue_size=10000, keep_snapshots=KEEP_SNAPSHOTS):
+        self.vectorizer = vectorizer
+        self.model = model                      # published model, safe to score with
+        self._candidate = copy.deepcopy(model)  # only touched by the learner thread
+        self.model_dir = model_dir
+        self.snapshot_dir = snapshot_dir
+        self.publish_interval = publish_interval
+        self.guard = guard or FeedbackGuard()
+        self.canary = canary
+        self.feedback_weight = feedback_weight
+        self.max_accuracy_drop = max_accuracy_drop
+        self.keep_snapshots = keep_snapshots
+        if self.guard.base_count is None and hasattr(model, 'class_count_'):
+            self.guard.base_count = float(model.class_count_.sum())
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    # Queue feedback without blocking; returns False if the queue is full
+    def submit(self, message, is_spam, source='anonymous'):
+        try:
+            self._queue.put_nowait((message, 1 if is_spam else 0, source))
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='online-learner', daemon=True)
+        self._thread.start()
+
+    def stop(self, publish=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.drain()
+        if publish:
+            self.publish()
+
+    def _run(self):
+        deadline = time.monotonic() + self.publish_interval
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=max(0.0, min(1.0, deadline - time.monotonic())))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                self._learn(*item)
+            if time.monotonic() >= deadline:
+                self.publish()
+                deadline = time.monotonic() + self.publish_interval
+
+    # Apply everything queued so far (used by stop() and by the CLI)
+    def drain(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._learn(*item)
+
+    # Function to apply one piece of feedback now, from any thread; returns
+    # None when it was learned, or the guard's reason for rejecting it
+    def learn(self, message, is_spam, source='anonymous'):
+        return self._learn(message, 1 if is_spam else 0, source)
+
+    def _learn(self, message, label, source):
+        import numpy as np
+
+        with self._lock:
+            reason = self.guard.check(message, source, self.feedback_weight)
+            if reason is not None:
+                self.stats['rejected'] += 1
+                return reason
+
+            X = self.vectorizer.transform([transform_text(message)])
+            # partial_fit on an already-fitted MultinomialNB just adds X to the
+            # class counts and recomputes the log probabilities
+            self._candidate.partial_fit(X, np.asarray([label]), sample_weight=[self.feedback_weight])
+            self._pending += 1
+            self.stats['applied'] += 1
+            return None
+
+    # Function to read the guard's state between two updates
+    def guard_state(self):
+        with self._lock:
+            return self.guard.state()
+
+    # Publish the candidate if it has new feedback and passes the canary check
+    def publish(self):
+        with self._lock:  # learn() may be updating the candidate from another thread
+            return self._publish()
+
+    def _publish(self):
+        if not self._pending:
+            return None
+
+        if self.canary is not None:
+            before = canary_accuracy(self.model, self.canary)
+            after = canary_accuracy(self._candidate, self.canary)
+            if after < before - self.max_accuracy_drop:
+                logger.warning("Rejected model update: canary accuracy %.4f -> %.4f", before, after)
+                self.stats['rejected_updates'] += 1
+                self._candidate = copy.deepcopy(self.model)
+                self._pending = 0
+                return None
+
+        if not list_snapshots(self.snapshot_dir):
+            # Keep the model we started from, so the first update can be rolled back
+            save_snapshot(self.model, self.snapshot_dir)
+
+        published = copy.deepcopy(self._candidate)
+        version = publish_snapshot(published, self.model_dir, self.snapshot_dir, self.keep_snapshots)
+        self.model = published
+        self._pending = 0
+        self.stats['published'] += 1
+        logger.info("Published model snapshot %s", version)
+        return version
+
+
+# Function to load a labelled canary CSV as (X, y)
+def load_canary(path, vectorizer):
+    import numpy as np
+
+    from .datasets import iter_labelled_csv
+
+    texts, labels = [], []
+    for batch_texts, batch_labels in iter_labelled_csv(path):
+        texts.extend(transform_text(text) for text in batch_texts)
+        labels.extend(batch_labels)
+    return vectorizer.transform(texts), np.asarray(labels)
+
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {'last_feedback_id': 0}
+
+
+def _save_state(state, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+# Function to poll SpamRepository for new feedback and feed it to the learner
+def learn_from_db(args):
+    ensure_nltk_data()
+    vectorizer, model = load_artifacts(args.model_dir)
+    state = _load_state(args.state)
+    guard = FeedbackGuard(max_feedback_share=args.max_feedback_share)
+    guard.restore(state)
+    canary = load_canary(args.canary, vectorizer) if args.canary else None
+    learner = OnlineLearner(vectorizer, model, model_dir=args.model_dir, snapshot_dir=args.snapshot_dir,
+                            publish_interval=args.interval, guard=guard, canary=canary,
+                            feedback_weight=args.weight, max_accuracy_drop=args.max_accuracy_drop,
+                            keep_snapshots=args.keep_snapshots)
+
+    learner.start()
+    try:
+        while True:
+            connection = connect_to_db(args.database)
+            try:
+                rows = fetch_feedback(connection, state['last_feedback_id'])
+            finally:
+                connection.close()
+            for row_id, message, label in rows:
+                if learner.learn(message, label, source='db') == 'rate_limited':
+                    # Leave it and everything after it for a later poll
+                    learner.stats['deferred'] += 1
+                    break
+                state['last_feedback_id'] = row_id
+            _save_state(dict(state, **learner.guard_state()), args.state)
+
+            if args.once:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        learner.stop()
+        _save_state(dict(state, **learner.guard_state()), args.state)
+    print(f"Applied {learner.stats['applied']}, rejected {learner.stats['rejected']} "
+          f"({dict(learner.guard.rejected)}), published {learner.stats['published']} snapshot(s)")
+    if learner.stats['deferred']:
+        print(f"Rate limit reached; feedback after row {state['last_feedback_id']} is applied on a later run")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Learn from user feedback and manage model snapshots.")
+    parser.add_argument('--model-dir', default='.')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--keep-snapshots', type=int, default=KEEP_SNAPSHOTS,
+                        help="Snapshots kept in --snapshot-dir (0: keep all)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    learn = commands.add_parser('learn', help="Poll SpamRepository for feedback and publish updated models")
+    learn.add_argument('--database', default=SPAM_REPOSITORY_DB)
+    learn.add_argument('--state', default=STATE_FILE,
+                       help="Remembers the last feedback row applied and the guard's history")
+    learn.add_argument('--interval', type=float, default=300, help="Seconds between model publishes")
+    learn.add_argument('--poll', type=float, default=30, help="Seconds between feedback polls")
+    learn.add_argument('--once', action='store_true', help="Apply pending feedback, publish and exit")
+    learn.add_argument('--canary', help="Labelled CSV an update must not get worse on")
+    learn.add_argument('--max-accuracy-drop', type=float, default=0.01)
+    learn.add_argument('--max-feedback-share', type=float, default=0.05,
+                       help="Cap on total feedback weight, as a share of the training rows")
+    learn.add_argument('--weight', type=float, default=1.0, help="Sample weight of one piece of feedback")
+
+    commands.add_parser('list', help="List model snapshots")
+
+    back = commands.add_parser('rollback', help="Restore an earlier model snapshot")
+    back.add_argument('--to', dest='version', help="Snapshot version (default: the previous one)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'learn':
+        learn_from_db(args)
+    elif args.command == 'list':
+        for version in list_snapshots(args.snapshot_dir):
+            print(version)
+    else:
+        try:
+            version = rollback(args.model_dir, args.snapshot_dir, args.version)
+        except ValueError as error:
+            raise SystemExit(str(error))
+        print(f"Restored model snapshot {version}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
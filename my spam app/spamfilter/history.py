@@ -0,0 +1,346 @@
+# Columnar export of the classification history.
+#
+# Copies classification logs out of the OLTP stores into Parquet files
+# partitioned by day (hive style, <output>/day=YYYY-MM-DD/part-*.parquet),
+# so months of history can be scanned without touching MySQL. Every export is
+# incremental: each source has a watermark (the last exported row id, or the
+# byte offset of a text log) in <output>/_watermarks.json, and only newer rows
+# are read. A run's files are named after the source and the watermark it
+# started from, so re-running after a crash rewrites the same files instead of
+# duplicating rows.
+#
+# Sources: the sqlite and mysql sinks' sms_classification_logs, the
+# partitioned log store's events (export more often than its --keep-days) and
+# the file sink's text logs.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.history export --source sqlite --output history
+#     python -m spamfilter.history export --source file --log-file classification_log.txt --output history
+#     python -m spamfilter.history compact --output history
+#     python -m spamfilter.history summary --output history --start 2026-01-01
+#
+# In code, read_history(path, start, end) returns a pyarrow Table and
+# daily_summary(...) the spam/ham counts per day.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+
+from .db import LOGS_DB
+
+WATERMARKS_FILE = '_watermarks.json'
+COLUMNS = ('classified_at', 'message', 'prediction', 'confidence', 'source')
+
+# Entries written by FileSink, in the simple (apps.py) or detailed (n.py)
+# format. FileSink writes messages as they are, so an entry spans several
+# lines when its message does.
+_LOG_LINE = re.compile(r"^(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:\.\d+)? [|-] Message: '(?P<message>.*)' \| "
+                       r"(?:Transformed: '.*' \| )?Prediction: (?P<label>Spam|Not Spam) \| "
+                       r"Confidence: (?P<confidence>[\d.]+)%$", re.DOTALL)
+_ENTRY_START = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d+)? [|-] ")
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('classified_at', pa.timestamp('ms')),
+        ('message', pa.string()),
+        ('prediction', pa.int8()),
+        ('confidence', pa.float32()),
+        ('source', pa.dictionary(pa.int8(), pa.string())),
+    ])
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value)[:23])
+
+
+# Each source yields (watermark after the chunk, rows) chunks of rows with a
+# position beyond `after`; rows are (classified_at, message, prediction,
+# confidence, source)
+def _iter_sms_logs(cursor, param, after, chunk_size):
+    while True:
+        cursor.execute(f"""
+            SELECT id, classification_time, sms_message, prediction, confidence
+            FROM sms_classification_logs WHERE id > {param} ORDER BY id LIMIT {param}
+        """, (after, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield after, [(_as_datetime(at), message, int(label == 'Spam'), confidence, 'log')
+                      for _, at, message, label, confidence in rows]
+
+
+def _iter_events(cursor, param, after, chunk_size):
+    while True:
+        cursor.execute(f"""
+            SELECT e.ID, e.ClassifiedAt, t.MessageText, e.Prediction, e.Confidence, e.Source
+            FROM ClassificationEvents e JOIN MessageTexts t ON t.MessageHash = e.MessageHash
+            WHERE e.ID > {param} ORDER BY e.ID LIMIT {param}
+        """, (after, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield after, [(_as_datetime(at), message, int(prediction), confidence, source)
+                      for _, at, message, prediction, confidence, source in rows]
+
+
+# Continuation lines are joined onto their entry before matching. The
+# watermark only moves past complete entries, so an entry still being
+# written is read again next time. Entries that never match (a new entry
+# starts first) are appended to `skipped` when a list is given.
+def iter_file_log(path, after=0, chunk_size=50000, skipped=None):
+    with open(path, 'rb') as f:
+        f.seek(after)
+        rows = []
+        pending = []  # lines of the entry being read
+        position = after
+        while True:
+            line = f.readline()
+            if not line.endswith(b'\n'):  # end of file, or a line still being written
+                break
+            text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if pending and _ENTRY_START.match(text):
+                if skipped is not None:
+                    skipped.append('\n'.join(pending))
+                pending = []
+                after = position
+            pending.append(text)
+            position += len(line)
+            match = _LOG_LINE.match('\n'.join(pending))
+            if match:
+                rows.append((datetime.strptime(match['time'], '%Y-%m-%d %H:%M:%S'), match['message'],
+                             int(match['label'] == 'Spam'), float(match['confidence']), 'log'))
+                pending = []
+                after = position
+            if len(rows) >= chunk_size:
+                yield after, rows
+                rows = []
+        if rows or after:
+            yield after, rows
+
+
+def _iter_database(cursor_source, query_rows, after, chunk_size):
+    connection, param = cursor_source()
+    try:
+        cursor = connection.cursor()
+        yield from query_rows(cursor, param, after, chunk_size)
+        cursor.close()
+    finally:
+        connection.close()
+
+
+# Function to build the row iterator for a named source; returns
+# (watermark key, function(after, chunk_size) -> chunks). File entries that
+# cannot be parsed are appended to `skipped`.
+def open_source(name, sqlite_path='spam_logs.db', database=LOGS_DB, log_file='classification_log.txt',
+                skipped=None):
+    import sqlite3
+
+    from .db import connect_to_db
+
+    if name == 'file':
+        return (f"file:{os.path.abspath(log_file)}",
+                lambda after, size: iter_file_log(log_file, after, size, skipped))
+    if name in ('sqlite', 'partitioned-sqlite'):
+        connect, key = (lambda: (sqlite3.connect(sqlite_path), '?')), f"{name}:{os.path.abspath(sqlite_path)}"
+    elif name in ('mysql', 'partitioned'):
+        connect, key = (lambda: (connect_to_db(database), '%s')), f"{name}:{database}"
+    else:
+        raise ValueError(f"Unknown source {name!r}")
+    query_rows = _iter_events if name.startswith('partitioned') else _iter_sms_logs
+    return key, lambda after, size: _iter_database(connect, query_rows, after, size)
+
+
+def read_watermarks(output):
+    path = os.path.join(output, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_watermarks(output, watermarks):
+    path = os.path.join(output, WATERMARKS_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+# Function to write rows to one Parquet file per day; files are written under
+# a temporary name and renamed, so readers never see half a file
+def _write_days(output, rows, part):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[0].date(), []).append(row)
+    for day, day_rows in by_day.items():
+        directory = os.path.join(output, f"day={day.isoformat()}")
+        os.makedirs(directory, exist_ok=True)
+        table = pa.Table.from_pydict({name: [row[i] for row in day_rows] for i, name in enumerate(COLUMNS)},
+                                     schema=_schema())
+        path = os.path.join(directory, f"part-{part}.parquet")
+        pq.write_table(table, path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+    return len(by_day)
+
+
+# Function to export everything newer than the source's watermark. Rows are
+# buffered up to buffer_rows before being written, so each run makes few files.
+def export(output, key, chunks, buffer_rows=200000, chunk_size=50000):
+    os.makedirs(output, exist_ok=True)
+    watermarks = read_watermarks(output)
+    start = watermarks.get(key, 0)
+    prefix = hashlib.blake2b(key.encode('utf-8'), digest_size=4).hexdigest()
+    buffered, exported, files = [], 0, 0
+    position = start
+    for position, rows in chunks(start, chunk_size):
+        buffered.extend(rows)
+        if len(buffered) >= buffer_rows:
+            files += _write_days(output, buffered, f"{prefix}-{start}")
+            exported += len(buffered)
+            buffered = []
+            # Commit the watermark with every flush; the next flush of this
+            # run starts a new set of files
+            watermarks[key] = start = position
+            _write_watermarks(output, watermarks)
+    if buffered:
+        files += _write_days(output, buffered, f"{prefix}-{start}")
+        exported += len(buffered)
+    if position != watermarks.get(key, 0):
+        watermarks[key] = position
+        _write_watermarks(output, watermarks)
+    return {'rows': exported, 'files': files, 'watermark': position}
+
+
+# Function to merge each day's part files into one, for faster scans
+def compact(output, days=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    merged = []
+    for name in sorted(os.listdir(output)):
+        if not name.startswith('day='):
+            continue
+        if days is not None and name[4:] not in days:
+            continue
+        directory = os.path.join(output, name)
+        parts = sorted(part for part in os.listdir(directory) if part.endswith('.parquet'))
+        if len(parts) < 2:
+            continue
+        table = pq.ParquetFile(os.path.join(directory, parts[0])).read()
+        tables = [table] + [pq.read_table(os.path.join(directory, part), schema=table.schema) for part in parts[1:]]
+        target = os.path.join(directory, 'part-compacted.parquet')
+        pq.write_table(pa.concat_tables(tables).sort_by('classified_at'), target + '.tmp', compression='zstd')
+        os.replace(target + '.tmp', target)
+        for part in parts:
+            if part != 'part-compacted.parquet':
+                os.remove(os.path.join(directory, part))
+        merged.append(name[4:])
+    return merged
+
+
+def _day_filter(start=None, end=None):
+    import pyarrow.dataset as ds
+
+    expression = None
+    for op, value in (('>=', start), ('<=', end)):
+        if value is None:
+            continue
+        day = value.isoformat() if isinstance(value, date) else str(value)
+        condition = ds.field('day') >= day if op == '>=' else ds.field('day') <= day
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+# Function to open the exported history as a pyarrow dataset
+def history_dataset(output):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.dataset(output, format='parquet', schema=_schema().append(pa.field('day', pa.string())),
+                      partitioning=ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive'),
+                      exclude_invalid_files=False, ignore_prefixes=['_', '.'])
+
+
+# Function to read the history between two days (inclusive); only the
+# matching day directories are opened
+def read_history(output, start=None, end=None, columns=None, spam_only=False):
+    import pyarrow.dataset as ds
+
+    expression = _day_filter(start, end)
+    if spam_only:
+        spam = ds.field('prediction') == 1
+        expression = spam if expression is None else expression & spam
+    return history_dataset(output).to_table(columns=columns, filter=expression)
+
+
+# Function to count spam and ham per day
+def daily_summary(output, start=None, end=None):
+    import pyarrow.compute as pc
+
+    table = read_history(output, start, end, columns=['day', 'prediction', 'confidence'])
+    table = table.append_column('spam', pc.cast(pc.equal(table['prediction'], 1), 'int64'))
+    summary = table.group_by('day').aggregate([('prediction', 'count'), ('spam', 'sum'),
+                                              ('confidence', 'mean')])
+    return sorted(({'day': row['day'], 'messages': row['prediction_count'], 'spam': row['spam_sum'],
+                    'mean_confidence': round(row['confidence_mean'], 2)} for row in summary.to_pylist()),
+                  key=lambda row: row['day'])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Export the classification history to Parquet and read it back.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('export', help="Export rows newer than the watermark")
+    run.add_argument('--source', required=True,
+                     choices=['sqlite', 'mysql', 'partitioned', 'partitioned-sqlite', 'file'])
+    run.add_argument('--sqlite-path', default='spam_logs.db')
+    run.add_argument('--database', default=LOGS_DB, help="MySQL logs database")
+    run.add_argument('--log-file', default='classification_log.txt')
+    run.add_argument('--output', default='history')
+    run.add_argument('--compact', action='store_true', help="Merge each day's part files afterwards")
+
+    merge = commands.add_parser('compact', help="Merge each day's part files into one")
+    merge.add_argument('--output', default='history')
+
+    summary = commands.add_parser('summary', help="Messages, spam and mean confidence per day")
+    summary.add_argument('--output', default='history')
+    summary.add_argument('--start', type=date.fromisoformat)
+    summary.add_argument('--end', type=date.fromisoformat)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'export':
+        skipped = []
+        key, chunks = open_source(args.source, args.sqlite_path, args.database, args.log_file, skipped)
+        report = export(args.output, key, chunks)
+        if args.source == 'file':
+            report['skipped_entries'] = len(skipped)
+        print(json.dumps(report, indent=2))
+        for entry in skipped[:5]:
+            print(f"Could not parse: {entry[:200]!r}", file=sys.stderr)
+        if args.compact:
+            print(f"Compacted {len(compact(args.output))} days")
+    elif args.command == 'compact':
+        print(f"Compacted {len(compact(args.output))} days")
+    else:
+        print(f"{'day':<12}{'messages':>10}{'spam':>8}{'confidence':>12}")
+        for row in daily_summary(args.output, args.start, args.end):
+            print(f"{row['day']:<12}{row['messages']:>10}{row['spam']:>8}{row['mean_confidence']:>12.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
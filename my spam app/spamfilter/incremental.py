@@ -0,0 +1,241 @@
+# Out-of-core incremental training with MultinomialNB.partial_fit.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.incremental --source csv --data spam.csv
+#     python -m spamfilter.incremental --source db
+#
+# Labelled messages are streamed in mini-batches and folded into the model with
+# partial_fit, so memory is bounded by the batch size and a run only processes
+# what arrived since the previous one. Progress (the CSV rows or SpamRepository
+# ID already consumed) is stored together with the model in a checkpoint, so a
+# crashed or repeated run never counts the same rows twice.
+#
+# Feature spaces:
+#   hashed - HashingVectorizer, no vocabulary to fit, new words are picked up
+#            automatically. Needs no vectorizer.pkl to start from, but the
+#            model only knows the rows fed to it, and explanations, the
+#            cascade and spamfilter.quantize need a vocabulary, so it is
+#            never published into --model-dir.
+#   fixed  - the existing vectorizer.pkl (vocabulary and idf frozen), and the
+#            existing model.pkl's counts as the starting point, so the model
+#            stays a drop-in replacement for the one the apps load.
+#
+# The updated vectorizer.pkl and model.pkl go to --out-dir
+# (incremental_model/); point SPAM_MODEL_DIR at it, or copy them over.
+
+import argparse
+import os
+import pickle
+import sys
+
+from .artifacts import MODEL_FILE, VECTORIZER_FILE, atomic_pickle_dump, save_artifacts
+from .datasets import (DEFAULT_ENCODING, DEFAULT_LABEL_COLUMN, DEFAULT_TEXT_COLUMN,
+                       PREDICTED_MESSAGE_TYPES, iter_labelled_csv, iter_spam_repository)
+from .db import SPAM_REPOSITORY_DB, connect_to_db
+from .preprocessing import create_pool, ensure_nltk_data, transform_many
+from .timing import StageRecorder, write_json_report
+
+CHECKPOINT_FILE = 'incremental_checkpoint.pkl'
+OUT_DIR = 'incremental_model'
+CLASSES = [0, 1]
+HASHED_FEATURES = 2 ** 18
+
+
+# Function to build the vectorizer for a feature space
+def make_vectorizer(feature_space, model_dir, n_features=HASHED_FEATURES):
+    if feature_space == 'hashed':
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        # Non-negative, l2-normalised term frequencies: what MultinomialNB needs,
+        # on the same scale as the TF-IDF rows the shipped model was fit on
+        return HashingVectorizer(n_features=n_features, alternate_sign=False, norm='l2')
+
+    with open(os.path.join(model_dir, VECTORIZER_FILE), 'rb') as f:
+        return pickle.load(f)
+
+
+# Function to continue from the model the apps load: partial_fit adds the new
+# rows to a fitted MultinomialNB's counts
+def seed_model(model_dir, vectorizer):
+    with open(os.path.join(model_dir, MODEL_FILE), 'rb') as f:
+        model = pickle.load(f)
+    if not hasattr(model, 'feature_count_') or not hasattr(model, 'partial_fit'):
+        raise SystemExit(f"{MODEL_FILE} in {model_dir} is a {type(model).__name__}, which partial_fit cannot "
+                         f"continue; pass --fresh-model to start from an empty MultinomialNB")
+    if [int(c) for c in model.classes_] != CLASSES or model.feature_count_.shape[1] != len(vectorizer.vocabulary_):
+        raise SystemExit(f"{MODEL_FILE} in {model_dir} does not match {VECTORIZER_FILE}; "
+                         f"pass --fresh-model to start from an empty MultinomialNB")
+    return model
+
+
+# Function to load the checkpoint of a previous run, or start a new one
+def load_checkpoint(path, feature_space, model_dir, alpha=1.0, fresh_model=False):
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['feature_space'] != feature_space:
+            raise SystemExit(f"{path} was built with the {checkpoint['feature_space']!r} feature space; "
+                             f"pass --reset to start over with {feature_space!r}")
+        return checkpoint
+
+    from sklearn.naive_bayes import MultinomialNB
+
+    vectorizer = make_vectorizer(feature_space, model_dir)
+    if feature_space == 'fixed' and not fresh_model:
+        model = seed_model(model_dir, vectorizer)
+    else:
+        model = MultinomialNB(alpha=alpha)
+    return {
+        'feature_space': feature_space,
+        'vectorizer': vectorizer,
+        'model': model,
+        'csv_rows': {},     # absolute CSV path -> data rows already consumed
+        'db_last_id': 0,    # highest SpamRepository.ID already consumed
+        'rows_seen': 0,
+    }
+
+
+# Function to yield (texts, labels, advance) mini-batches from the chosen source.
+# advance(checkpoint) records the batch as consumed once it has been learned.
+def iter_batches(args, checkpoint):
+    if args.source == 'csv':
+        path = os.path.abspath(args.data)
+        done = checkpoint['csv_rows'].get(path, 0)
+        for texts, labels in iter_labelled_csv(path, chunk_size=args.batch_size,
+                                               label_column=args.label_column,
+                                               text_column=args.text_column,
+                                               encoding=args.encoding, skip_rows=done):
+            done += len(texts)
+
+            def advance(cp, done=done):
+                cp['csv_rows'][path] = done
+            yield texts, labels, advance
+        return
+
+    connection = connect_to_db(args.database)
+    try:
+        exclude_types = () if args.include_predictions else PREDICTED_MESSAGE_TYPES
+        for last_id, texts, labels in iter_spam_repository(connection, after_id=checkpoint['db_last_id'],
+                                                           batch_size=args.batch_size,
+                                                           exclude_types=exclude_types):
+            def advance(cp, last_id=last_id):
+                cp['db_last_id'] = last_id
+            yield texts, labels, advance
+    finally:
+        connection.close()
+
+
+# Function to write the checkpoint and publish model.pkl / vectorizer.pkl
+def publish(checkpoint, args):
+    atomic_pickle_dump(checkpoint, args.checkpoint)
+    save_artifacts(checkpoint['vectorizer'], checkpoint['model'], args.out_dir)
+
+
+def run(args):
+    import numpy as np
+
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    recorder = StageRecorder(trace_memory=False)
+    with recorder.stage('nltk_data'):
+        ensure_nltk_data()
+
+    checkpoint = load_checkpoint(args.checkpoint, args.feature_space, args.model_dir, args.alpha,
+                                 args.fresh_model)
+    vectorizer, model = checkpoint['vectorizer'], checkpoint['model']
+
+    new_rows = 0
+    batches_since_publish = 0
+    pool = create_pool(args.jobs) if args.jobs > 1 else None
+    try:
+        batches = iter_batches(args, checkpoint)
+        while True:
+            with recorder.stage('read'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            texts, labels, advance = batch
+
+            with recorder.stage('transform_text'):
+                corpus = transform_many(texts, pool=pool)
+            with recorder.stage('vectorize'):
+                X = vectorizer.transform(corpus)
+            with recorder.stage('partial_fit'):
+                model.partial_fit(X, np.asarray(labels), classes=CLASSES)
+
+            advance(checkpoint)
+            checkpoint['rows_seen'] += len(texts)
+            new_rows += len(texts)
+            batches_since_publish += 1
+
+            if batches_since_publish >= args.checkpoint_every:
+                with recorder.stage('publish'):
+                    publish(checkpoint, args)
+                batches_since_publish = 0
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if batches_since_publish:
+        with recorder.stage('publish'):
+            publish(checkpoint, args)
+
+    return {
+        'source': args.source,
+        'feature_space': args.feature_space,
+        'out_dir': args.out_dir,
+        'new_rows': new_rows,
+        'rows_seen': checkpoint['rows_seen'],
+        **recorder.to_dict(),
+    }, recorder
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Incrementally update the spam model with partial_fit.")
+    parser.add_argument('--source', choices=['csv', 'db'], default='csv')
+    parser.add_argument('--data', help="Labelled CSV file (for --source csv)")
+    parser.add_argument('--database', default=SPAM_REPOSITORY_DB, help="Database holding SpamRepository")
+    parser.add_argument('--include-predictions', action='store_true',
+                        help="Also learn from SpamRepository rows written by the app's own predictions")
+    parser.add_argument('--feature-space', choices=['hashed', 'fixed'], default='hashed')
+    parser.add_argument('--model-dir', default='.', help="Where the apps' vectorizer.pkl and model.pkl live")
+    parser.add_argument('--out-dir', default=OUT_DIR, help="Where to publish the updated vectorizer.pkl and model.pkl")
+    parser.add_argument('--fresh-model', action='store_true',
+                        help="With --feature-space fixed, start from an empty MultinomialNB instead of model.pkl")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_FILE)
+    parser.add_argument('--checkpoint-every', type=int, default=10,
+                        help="Publish the model every N mini-batches (and at the end)")
+    parser.add_argument('--reset', action='store_true', help="Discard the checkpoint and start from scratch")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help="MultinomialNB smoothing for a new model (hashed, or --fresh-model)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--label-column', default=DEFAULT_LABEL_COLUMN)
+    parser.add_argument('--text-column', default=DEFAULT_TEXT_COLUMN)
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING)
+    parser.add_argument('--report', help="Write the timing report to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.source == 'csv' and not args.data:
+        parser.error("--data is required with --source csv")
+    if args.feature_space == 'hashed' and os.path.abspath(args.out_dir) == os.path.abspath(args.model_dir):
+        parser.error("hashed models have no vocabulary, which explanations, the cascade and quantization need; "
+                     "publish them to a separate --out-dir")
+
+    report, recorder = run(args)
+    print(recorder.format_table())
+    print(f"Learned {report['new_rows']} new rows ({report['rows_seen']} in total); "
+          f"published to {report['out_dir']}")
+
+    if args.report:
+        write_json_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
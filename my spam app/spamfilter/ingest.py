@@ -0,0 +1,353 @@
+# Asyncio ingestion service for a continuous stream of SMS, e.g. from a
+# gateway, instead of one Predict click per message.
+#
+#   source -> incoming queue -> micro-batcher -> worker pool -> log queue -> sink
+#
+# - Sources are async iterables of message strings: SocketSource (one message
+#   per line over TCP), FileTailSource (follows a file like `tail -f`) and
+#   QueueSource (an asyncio.Queue standing in for a message broker).
+# - The batcher closes a batch at max_batch messages or max_latency seconds
+#   after its first message, whichever comes first.
+# - Scoring is CPU-bound and runs in a process pool (or a thread pool) through
+#   the engine's classify_batch, i.e. the same transform_text, vectorizer and
+#   model as the app.
+# - Results are logged to the configured sink from a separate task, off the
+#   event loop, because the sinks are blocking. Whatever is waiting in the log
+#   queue (up to log_batch results) goes to the sink in one log_many call, so
+#   the MySQL sinks use one connection and one commit per batch.
+#
+# Every stage hands over through a bounded queue or semaphore, so when the DB
+# or the workers fall behind the stage before them waits, all the way back to
+# the source: a socket stops being read (and TCP pushes back on the gateway),
+# a tailed file stops being read, a queue producer blocks on put().
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.ingest --source socket --port 9200 --preset sqlite
+#     python -m spamfilter.ingest --source tail --path gateway.log --workers 4
+#     python -m spamfilter.ingest --source tail --path "SMS MESSAGES.txt" --from-start --no-follow
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .config import load_config
+from .engine import ClassificationEngine, make_worker_engine
+from .metrics import REGISTRY, stage_timer
+
+logger = logging.getLogger(__name__)
+
+INGESTED = REGISTRY.counter('spam_ingested_total', 'Messages through the ingestion service, by step')
+INGEST_BATCH_SIZE = REGISTRY.histogram('spam_ingest_batch_size', 'Messages per ingestion micro-batch',
+                                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+
+
+class QueueSource:
+    def __init__(self, queue=None, maxsize=1000):
+        self.queue = queue if queue is not None else asyncio.Queue(maxsize)
+
+    # Put None to end the stream
+    async def put(self, message):
+        await self.queue.put(message)
+
+    async def __aiter__(self):
+        while True:
+            message = await self.queue.get()
+            if message is None:
+                return
+            yield message
+
+
+# Listens on host:port and reads one message per line (UTF-8) from every
+# connection. Lines are forwarded through a bounded queue; while it is full
+# the connections are not read.
+class SocketSource:
+    def __init__(self, host='127.0.0.1', port=9200, maxsize=1000):
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.server = None
+
+    async def _handle(self, queue, reader, writer):
+        try:
+            async for line in reader:
+                text = line.decode('utf-8', errors='replace').strip()
+                if text:
+                    await queue.put(text)
+        finally:
+            writer.close()
+
+    async def __aiter__(self):
+        queue = asyncio.Queue(self.maxsize)
+        self.server = await asyncio.start_server(lambda r, w: self._handle(queue, r, w), self.host, self.port)
+        logger.info("Listening on %s:%s", self.host, self.port)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+# Follows a file like `tail -f`, one message per line. With follow=False it
+# stops at the end of the file.
+class FileTailSource:
+    def __init__(self, path, from_start=False, follow=True, poll_interval=0.2, encoding='utf-8'):
+        self.path = path
+        self.from_start = from_start
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.encoding = encoding
+
+    async def __aiter__(self):
+        from .datasets import _NUMBERING
+
+        with open(self.path, encoding=self.encoding, errors='replace') as f:
+            if not self.from_start:
+                f.seek(0, os.SEEK_END)
+            partial = ''
+            while True:
+                line = f.readline()
+                if not line:
+                    if not self.follow:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if not line.endswith('\n') and self.follow:
+                    partial += line  # the writer is still in the middle of this line
+                    continue
+                text = _NUMBERING.sub('', (partial + line).strip())
+                partial = ''
+                if text:
+                    yield text
+
+
+# Each worker process loads its own copy of the artifacts once
+_worker_engine = None
+
+
+def _init_worker(model_dir, config=None, verdict_cache_options=None):
+    global _worker_engine
+    _worker_engine = make_worker_engine(model_dir, config, verdict_cache_options)
+    _worker_engine.load()
+
+
+def _score_in_worker(messages):
+    return _worker_engine.classify_batch(messages)
+
+
+class IngestionService:
+    # engine: a ClassificationEngine; its sink receives the results.
+    # executor: 'process' (one engine per worker process) or 'thread' (the
+    # engine is shared, which only helps while scikit-learn releases the GIL).
+    # max_pending_batches: batches scored or waiting for a worker at once.
+    # log_queue_size: results waiting to be logged before scoring pauses.
+    # log_batch: most results written to the sink in one call.
+    # on_result: optional callable (or coroutine function) called per result.
+    def __init__(self, engine, source, max_batch=256, max_latency=0.05, workers=2, executor='process',
+                 max_pending_batches=None, queue_size=None, log_queue_size=10000, log_batch=500,
+                 on_result=None):
+        self.engine = engine
+        self.source = source
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.workers = workers
+        self.executor = executor
+        self.max_pending_batches = max_pending_batches or workers * 2
+        self.queue_size = queue_size or max_batch * self.max_pending_batches
+        self.log_queue_size = log_queue_size
+        self.log_batch = log_batch
+        self.on_result = on_result
+        self.stats = {'received': 0, 'scored': 0, 'logged': 0, 'log_errors': 0, 'score_errors': 0,
+                      'batches': 0, 'backpressure_waits': 0}
+
+    def _make_pool(self):
+        if self.executor == 'process':
+            return ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                       initargs=(self.engine.model_dir, self.engine.config,
+                                                 self.engine.verdict_cache_options))
+        if self.executor == 'thread':
+            self.engine.load()
+            return ThreadPoolExecutor(self.workers, thread_name_prefix='ingest-worker')
+        raise ValueError(f"Unknown executor: {self.executor!r}")
+
+    async def _read(self, incoming):
+        async for message in self.source:
+            self.stats['received'] += 1
+            INGESTED.inc(step='received')
+            if incoming.full():
+                self.stats['backpressure_waits'] += 1
+            await incoming.put(message)
+        await incoming.put(None)
+
+    # Collects one batch: waits for a first message, then takes more until the
+    # batch is full or max_latency has passed. Returns (batch, ended).
+    async def _next_batch(self, incoming):
+        loop = asyncio.get_running_loop()
+        first = await incoming.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = loop.time() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(incoming.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if message is None:
+                return batch, True
+            batch.append(message)
+        return batch, False
+
+    # Scores one batch and queues its results for logging. The batch's
+    # pending slot is only released once every result is queued, so a slow
+    # sink holds the batcher back as well.
+    async def _score(self, pool, batch, pending, log_queue):
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                with stage_timer('ingest_score_batch'):
+                    if self.executor == 'process':
+                        results = await loop.run_in_executor(pool, _score_in_worker, batch)
+                    else:
+                        results = await loop.run_in_executor(pool, self.engine.classify_batch, batch)
+            except Exception:
+                logger.exception("Scoring a batch of %d messages failed", len(batch))
+                self.stats['score_errors'] += len(batch)
+                INGESTED.inc(len(batch), step='score_error')
+                return
+            self.stats['scored'] += len(results)
+            INGESTED.inc(len(results), step='scored')
+            for result in results:
+                if log_queue.full():
+                    self.stats['backpressure_waits'] += 1
+                await log_queue.put(result)
+        finally:
+            pending.release()
+
+    async def _batch(self, incoming, log_queue, pool):
+        pending = asyncio.Semaphore(self.max_pending_batches)
+        tasks = set()
+        ended = False
+        while not ended:
+            batch, ended = await self._next_batch(incoming)
+            if not batch:
+                continue
+            self.stats['batches'] += 1
+            INGEST_BATCH_SIZE.observe(len(batch))
+            await pending.acquire()  # waits while the workers are saturated
+            task = asyncio.create_task(self._score(pool, batch, pending, log_queue))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        await log_queue.put(None)
+
+    # Logs whatever has queued up while the previous batch was being written,
+    # up to log_batch results per call
+    async def _log(self, log_queue):
+        ended = False
+        while not ended:
+            batch = [await log_queue.get()]
+            while len(batch) < self.log_batch and not log_queue.empty():
+                batch.append(log_queue.get_nowait())
+            if batch[-1] is None:  # the end marker is always the last item
+                ended = True
+                batch.pop()
+            if not batch:
+                continue
+            errors = await asyncio.to_thread(self.engine.log_many, batch)
+            if errors:
+                self.stats['log_errors'] += len(batch)
+                logger.warning("%s", errors[0])
+            else:
+                self.stats['logged'] += len(batch)
+                INGESTED.inc(len(batch), step='logged')
+            if self.on_result is not None:
+                for result in batch:
+                    outcome = self.on_result(result)
+                    if asyncio.iscoroutine(outcome):
+                        await outcome
+
+    # Function to run until the source ends; returns the stats
+    async def run(self):
+        incoming = asyncio.Queue(self.queue_size)
+        log_queue = asyncio.Queue(self.log_queue_size)
+        pool = self._make_pool()
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(self._read(incoming), self._batch(incoming, log_queue, pool),
+                                 self._log(log_queue))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.stats['seconds'] = time.perf_counter() - start
+        return self.stats
+
+
+def make_source(args):
+    if args.source == 'socket':
+        return SocketSource(args.host, args.port)
+    if args.source == 'tail':
+        return FileTailSource(args.path, from_start=args.from_start, follow=not args.no_follow,
+                              encoding=args.encoding)
+    raise ValueError(f"Unknown source: {args.source!r}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Classify a stream of SMS with micro-batching.")
+    parser.add_argument('--source', choices=['socket', 'tail'], default='socket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--path', help="File to follow with --source tail")
+    parser.add_argument('--from-start', action='store_true', help="Read the file from the beginning")
+    parser.add_argument('--no-follow', action='store_true', help="Stop at the end of the file")
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--preset', help="Configuration preset choosing the sinks (see spamfilter.config)")
+    parser.add_argument('--sinks', help="Comma-separated sinks, overriding the preset")
+    parser.add_argument('--model-dir', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-latency-ms', type=float, default=50.0,
+                        help="Longest a message waits for its batch to fill")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process')
+    parser.add_argument('--log-queue-size', type=int, default=10000)
+    parser.add_argument('--log-batch', type=int, default=500, help="Most results logged in one transaction")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.source == 'tail' and not args.path:
+        parser.error("--path is required with --source tail")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    overrides = {}
+    if args.sinks:
+        overrides['sinks'] = [name.strip() for name in args.sinks.split(',') if name.strip()]
+    if args.model_dir:
+        overrides['model_dir'] = args.model_dir
+    engine = ClassificationEngine.from_config(load_config(args.preset, **overrides))
+    service = IngestionService(engine, make_source(args), max_batch=args.max_batch,
+                               max_latency=args.max_latency_ms / 1000, workers=args.workers,
+                               executor=args.executor, log_queue_size=args.log_queue_size,
+                               log_batch=args.log_batch)
+    try:
+        stats = asyncio.run(service.run())
+    except KeyboardInterrupt:
+        stats = service.stats
+    finally:
+        engine.close()
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
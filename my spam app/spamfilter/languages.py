@@ -0,0 +1,210 @@
+# Language- and charset-aware preprocessing.
+#
+# transform_text is English-only: Punkt tokenising, the English stopword list
+# and the Porter stemmer. Here every language has its own transform, with its
+# stopword set and Snowball stemmer built once per process and cached, and a
+# LanguageRouter sends each message to the vectorizer/model bundle trained
+# for its language:
+#
+#     <model_dir>/vectorizer.pkl, model.pkl                  English (as before)
+#     <model_dir>/languages/<code>/vectorizer.pkl, model.pkl  one per language
+#
+# Bundles are trained with `python -m spamfilter.train --language es ...`.
+#
+# Detection is cheap and only runs when there is more than one bundle:
+# pure-ASCII text is Latin script, anything else is assigned the script most
+# of its letters belong to (emoji and symbols are not letters and do not
+# count), and Latin-script text is given the language whose stopwords it
+# contains most. English keeps exactly transform_text's output, so English
+# accuracy and throughput are unchanged.
+#
+# Text read as ISO-8859-1 that was really UTF-8 ("Ã©" for "é") is repaired
+# before detection.
+
+import bisect
+import os
+import re
+from functools import lru_cache, partial
+
+from .preprocessing import transform_text
+
+LANGUAGES_DIR = 'languages'
+DEFAULT_LANGUAGE = 'en'
+
+# code -> (NLTK stopwords name, Snowball stemmer name); None when NLTK has none
+LANGUAGES = {
+    'en': ('english', 'porter'),
+    'es': ('spanish', 'spanish'),
+    'fr': ('french', 'french'),
+    'de': ('german', 'german'),
+    'it': ('italian', 'italian'),
+    'pt': ('portuguese', 'portuguese'),
+    'nl': ('dutch', 'dutch'),
+    'sv': ('swedish', 'swedish'),
+    'ru': ('russian', 'russian'),
+    'ar': ('arabic', 'arabic'),
+    'el': ('greek', None),
+    'hi': (None, None),
+    'zh': ('chinese', None),
+    'ja': (None, None),
+    'ko': (None, None),
+}
+LATIN_LANGUAGES = ('en', 'es', 'fr', 'de', 'it', 'pt', 'nl', 'sv')
+# Written without spaces between words, so tokens are character bigrams
+CHARACTER_LANGUAGES = ('zh', 'ja')
+
+# (first code point, script) for the blocks that matter, sorted by code point;
+# each block runs up to the next entry
+_SCRIPT_BLOCKS = [
+    (0x0000, 'latin'), (0x0370, 'el'), (0x0400, 'ru'), (0x0530, None), (0x0600, 'ar'), (0x0700, None),
+    (0x0900, 'hi'), (0x0980, None), (0x1E00, 'latin'), (0x1F00, 'el'), (0x2000, None),
+    (0x3040, 'ja'), (0x3100, None), (0x3400, 'zh'), (0xA000, None), (0xAC00, 'ko'), (0xD7B0, None),
+    (0xF900, 'zh'), (0xFB00, None),
+]
+_BLOCK_STARTS = [start for start, _ in _SCRIPT_BLOCKS]
+
+_WORD = re.compile(r'\w+')
+_MOJIBAKE = re.compile('[ÂÃ][\u0080-¿]|â€')
+
+
+# Function to undo UTF-8 text that was decoded as ISO-8859-1/cp1252
+def repair_mojibake(text):
+    if not _MOJIBAKE.search(text):
+        return text
+    for encoding in ('cp1252', 'latin-1'):
+        try:
+            return text.encode(encoding).decode('utf-8')
+        except UnicodeError:
+            continue
+    return text
+
+
+def _script_of(character):
+    return _SCRIPT_BLOCKS[bisect.bisect_right(_BLOCK_STARTS, ord(character)) - 1][1]
+
+
+# Function to find the script most letters of a text are written in
+def detect_script(text):
+    if text.isascii():
+        return 'latin'
+    counts = {}
+    for character in text:
+        if character.isalpha():
+            script = _script_of(character)
+            if script is not None:
+                counts[script] = counts.get(script, 0) + 1
+    return max(counts, key=counts.get) if counts else 'latin'
+
+
+@lru_cache(maxsize=None)
+def stopwords_for(language):
+    from .preprocessing import english_stopwords
+
+    if language == 'en':
+        return english_stopwords()
+    name = LANGUAGES[language][0]
+    if name is None:
+        return frozenset()
+    from nltk.corpus import stopwords
+
+    try:
+        return frozenset(stopwords.words(name))
+    except (LookupError, OSError):
+        return frozenset()
+
+
+@lru_cache(maxsize=None)
+def stemmer_for(language):
+    name = LANGUAGES[language][1]
+    if name is None:
+        return None
+    from nltk.stem.snowball import SnowballStemmer
+
+    return SnowballStemmer(name).stem
+
+
+# Function to guess the language of a text among candidates (codes with a
+# bundle); Latin-script text is scored by stopword hits
+def detect_language(text, candidates=LATIN_LANGUAGES):
+    script = detect_script(text)
+    if script != 'latin':
+        return script
+    latin = [language for language in candidates if language in LATIN_LANGUAGES]
+    if len(latin) < 2:
+        return latin[0] if latin else DEFAULT_LANGUAGE
+    words = _WORD.findall(text.lower())
+    best, best_hits = DEFAULT_LANGUAGE, 0
+    for language in latin:
+        stop_words = stopwords_for(language)
+        hits = sum(word in stop_words for word in words)
+        if hits > best_hits:
+            best, best_hits = language, hits
+    return best
+
+
+def _character_bigrams(text):
+    tokens = []
+    for run in _WORD.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+# Function to preprocess a text for one language. 'en' is transform_text.
+def transform_language(text, language=DEFAULT_LANGUAGE):
+    if language == DEFAULT_LANGUAGE:
+        return transform_text(text)
+    text = text.lower()
+    if language in CHARACTER_LANGUAGES:
+        return " ".join(_character_bigrams(text))
+    stop_words = stopwords_for(language)
+    stem = stemmer_for(language)
+    tokens = [word for word in _WORD.findall(text) if word not in stop_words and not word.isdigit()]
+    if stem is not None:
+        tokens = [stem(word) for word in tokens]
+    return " ".join(tokens)
+
+
+# Function to get a picklable transform for a language (for process pools)
+def transform_for(language=DEFAULT_LANGUAGE):
+    if language == DEFAULT_LANGUAGE:
+        return transform_text
+    if language not in LANGUAGES:
+        raise ValueError(f"Unsupported language {language!r}, expected one of {sorted(LANGUAGES)}")
+    return partial(transform_language, language=language)
+
+
+# Holds one (vectorizer, model) bundle per language and picks the bundle
+# (and transform) for each message
+class LanguageRouter:
+    def __init__(self, bundles, default=DEFAULT_LANGUAGE):
+        self.bundles = dict(bundles)
+        self.default = default
+        self.candidates = tuple(self.bundles)
+
+    # Function to load the bundles under <model_dir>/languages next to the
+    # default (vectorizer, model)
+    @classmethod
+    def load(cls, model_dir, vectorizer, model):
+        from .artifacts import load_artifacts
+
+        bundles = {DEFAULT_LANGUAGE: (vectorizer, model)}
+        root = os.path.join(model_dir, LANGUAGES_DIR)
+        if os.path.isdir(root):
+            for language in sorted(os.listdir(root)):
+                if language in LANGUAGES and language != DEFAULT_LANGUAGE:
+                    bundles[language] = load_artifacts(os.path.join(root, language))
+        return cls(bundles)
+
+    # Function to pick a message's language; returns (language, text), the
+    # text with any mojibake repaired
+    def route(self, message):
+        text = message if message.isascii() else repair_mojibake(message)
+        if len(self.bundles) == 1:
+            return self.default, text
+        language = detect_language(text, self.candidates)
+        return (language if language in self.bundles else self.default), text
+
+    def transform(self, text, language):
+        return transform_language(text, language)
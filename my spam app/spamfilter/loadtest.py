@@ -0,0 +1,289 @@
+# Load generator for the app's page and its database path.
+#
+# Streamlit runs every browser session in a thread of one server process and
+# re-runs the page script on each interaction. With show_stats (ap.py), a
+# rerun asks the sink for the spam count, classifies and logs the message
+# when Predict was clicked, and reads the five most recent logs. This tool
+# runs that sequence from N session threads against the same engine the page
+# uses (built from the preset), for a fixed time per step, and ramps N:
+#
+#   --db sqlite  the preset with its sink swapped for a SQLite stand-in in a
+#                temporary file (default; no server needed)
+#   --db mysql   the preset as configured (ap: MySQLLogSink, a connection per
+#                statement), against the server in SPAM_DB_HOST / SPAM_DB_PORT
+#
+# Per step it reports reruns per second, p50/p95/p99 latency of each call and
+# of the whole rerun, errors per call (exceptions, log errors, and None
+# answers from a sink whose circuit breaker is open) and database
+# connections: for MySQL the server's Connections counter and the peak of
+# Threads_connected, for SQLite the peak number of open handles on the file.
+# --reload-artifacts also unpickles vectorizer.pkl and model.pkl on every
+# rerun, as the original scripts did. The ramp stops at the first step whose
+# error rate passes --max-error-rate.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.loadtest --concurrency 1 2 4 8 16 32 --step-seconds 10
+#     python -m spamfilter.loadtest --db mysql --preset ap --concurrency 1 4 16 64 --report load.json
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from .timing import latency_percentiles, write_json_report
+
+SMS_MESSAGES_FILE = 'SMS MESSAGES.txt'
+CALLS = ('reload_artifacts', 'spam_count', 'classify', 'log', 'recent', 'rerun')
+
+
+# Function to count this process's open handles on a file (Linux only)
+def _open_handles(path):
+    path = os.path.realpath(path)
+    try:
+        names = os.listdir('/proc/self/fd')
+    except OSError:
+        return None
+    handles = 0
+    for name in names:
+        try:
+            handles += os.path.realpath(os.path.join('/proc/self/fd', name)) == path
+        except OSError:
+            pass
+    return handles
+
+
+# Samples the database's connection counts while a step runs
+class ConnectionMonitor:
+    def __init__(self, db, config, interval=0.2):
+        self.db = db
+        self.config = config
+        self.interval = interval
+        self.peak = 0
+        self._connection = None
+        self._opened_before = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _mysql_status(self):
+        cursor = self._connection.cursor()
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Connections', 'Threads_connected')")
+        status = {name: int(value) for name, value in cursor.fetchall()}
+        cursor.close()
+        return status
+
+    # Function to sample once; returns the current number of connections
+    def sample(self):
+        if self.db == 'mysql':
+            return self._mysql_status()['Threads_connected'] - 1  # not counting the monitor
+        return _open_handles(self.config['sqlite_path'])
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                current = self.sample()
+            except Exception:
+                continue
+            if current is not None:
+                self.peak = max(self.peak, current)
+
+    def start(self):
+        if self.db == 'mysql':
+            from .db import connect_to_db
+
+            self._connection = connect_to_db(self.config['logs_database'])
+            self._opened_before = self._mysql_status()['Connections']
+        self.peak = self.sample() or 0
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='connection-monitor', daemon=True)
+        self._thread.start()
+
+    # Function to stop sampling; returns (connections opened, peak connected)
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        opened = None
+        if self._connection is not None:
+            opened = self._mysql_status()['Connections'] - self._opened_before
+            self._connection.close()
+            self._connection = None
+        return opened, self.peak
+
+
+# Function to run one simulated rerun of the page, timing each call into
+# `samples` and counting failures into `errors`
+def rerun(engine, message, predict, samples, errors, model_dir=None):
+    clock = time.perf_counter
+
+    def call(name, fn, *args):
+        start = clock()
+        try:
+            value = fn(*args)
+        except Exception as error:
+            errors[name, type(error).__name__] += 1
+            value = None
+        else:
+            if value is None and name in ('spam_count', 'recent'):
+                errors[name, 'unavailable'] += 1
+        samples[name].append(clock() - start)
+        return value
+
+    start = clock()
+    if model_dir is not None:
+        from .artifacts import load_artifacts
+
+        call('reload_artifacts', load_artifacts, model_dir)
+    call('spam_count', engine.spam_count)
+    if predict:
+        result = call('classify', engine.classify, message)
+        if result is not None:
+            for _ in call('log', engine.log, result) or ():
+                errors['log', 'log_error'] += 1
+    call('recent', engine.recent, 5)
+    samples['rerun'].append(clock() - start)
+
+
+# Function to run `sessions` session threads for `seconds`
+def run_step(engine, messages, sessions, seconds, predict_share, think_time, monitor, model_dir=None):
+    samples = defaultdict(list)
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def session(seed):
+        rng = random.Random(seed)
+        local_samples, local_errors = defaultdict(list), Counter()
+        while time.monotonic() < deadline:
+            rerun(engine, rng.choice(messages), rng.random() < predict_share, local_samples, local_errors,
+                  model_dir)
+            if think_time:
+                time.sleep(rng.uniform(0.5, 1.5) * think_time)
+        with lock:
+            for name, values in local_samples.items():
+                samples[name].extend(values)
+            errors.update(local_errors)
+
+    monitor.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(i,), name=f'session-{i}') for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    opened, peak = monitor.stop()
+
+    reruns = len(samples['rerun'])
+    calls = sum(len(samples[name]) for name in CALLS if name != 'rerun')
+    failed = sum(errors.values())
+    return {
+        'sessions': sessions,
+        'seconds': round(elapsed, 2),
+        'reruns': reruns,
+        'reruns_per_second': round(reruns / elapsed, 1) if elapsed else None,
+        'error_rate': round(failed / calls, 4) if calls else 0.0,
+        'errors': {f'{name}:{kind}': count for (name, kind), count in sorted(errors.items())},
+        'connections_opened': opened,
+        'peak_connections': peak,
+        'latency': {name: {'calls': len(samples[name]), **latency_percentiles(samples[name])}
+                    for name in CALLS if samples[name]},
+    }
+
+
+# Function to build the engine the page would use, on the stand-in database
+# for --db sqlite
+def make_engine(args, directory):
+    from .config import load_config
+    from .engine import ClassificationEngine
+
+    overrides = {'show_stats': True, 'dashboard': args.dashboard}
+    if args.db == 'sqlite':
+        overrides.update(sinks=['sqlite'], sqlite_path=os.path.join(directory, 'loadtest.db'))
+    config = load_config(args.preset, **overrides)
+    return ClassificationEngine.from_config(config).load(), config
+
+
+def run(args):
+    from .datasets import read_message_list, synthetic_corpus
+
+    if os.path.exists(args.messages):
+        messages = read_message_list(args.messages)
+    else:
+        messages = synthetic_corpus(1000)[0]
+
+    directory = tempfile.mkdtemp(prefix='spam-loadtest-')
+    try:
+        engine, config = make_engine(args, directory)
+        monitor = ConnectionMonitor(args.db, config)
+        model_dir = config['model_dir'] if args.reload_artifacts else None
+        steps = []
+        try:
+            rerun(engine, messages[0], True, defaultdict(list), Counter(), model_dir)  # warm up
+            for sessions in args.concurrency:
+                step = run_step(engine, messages, sessions, args.step_seconds, args.predict_share,
+                                args.think_time, monitor, model_dir)
+                steps.append(step)
+                print_step(step)
+                if step['error_rate'] > args.max_error_rate:
+                    print(f"Stopping: error rate {step['error_rate']:.1%} at {sessions} sessions")
+                    break
+        finally:
+            engine.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'db': args.db, 'preset': args.preset, 'reload_artifacts': args.reload_artifacts,
+            'predict_share': args.predict_share, 'think_time': args.think_time, 'steps': steps}
+
+
+def print_step(step):
+    latency = step['latency']
+    opened = step['connections_opened']
+    print(f"{step['sessions']:>8}{step['reruns_per_second'] or 0:>10.1f}{step['error_rate']:>8.1%}"
+          f"{latency['rerun']['p50_ms'] if 'rerun' in latency else 0:>10.1f}"
+          f"{latency['rerun']['p95_ms'] if 'rerun' in latency else 0:>10.1f}"
+          f"{latency['rerun']['p99_ms'] if 'rerun' in latency else 0:>10.1f}"
+          f"{latency['spam_count']['p95_ms'] if 'spam_count' in latency else 0:>11.1f}"
+          f"{latency['recent']['p95_ms'] if 'recent' in latency else 0:>11.1f}"
+          f"{'-' if opened is None else opened:>8}{step['peak_connections'] or 0:>7}")
+    for name, count in step['errors'].items():
+        print(f"{'':>8}{count} x {name}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Ramp simulated app sessions and report throughput, "
+                                                 "latency, errors and DB connections.")
+    parser.add_argument('--db', choices=['sqlite', 'mysql'], default='sqlite',
+                        help="sqlite: a SQLite stand-in for the preset's sink; mysql: the preset's MySQL sink")
+    parser.add_argument('--preset', default='ap', help="App preset whose engine and sink to load")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--step-seconds', type=float, default=10.0, help="How long each step runs")
+    parser.add_argument('--predict-share', type=float, default=0.5,
+                        help="Share of reruns that classify and log a message (the rest only render)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Mean seconds a session waits between reruns")
+    parser.add_argument('--reload-artifacts', action='store_true',
+                        help="Unpickle vectorizer.pkl and model.pkl on every rerun, like the original scripts")
+    parser.add_argument('--dashboard', action='store_true', help="Wrap the sink in the dashboard's StatsSink")
+    parser.add_argument('--max-error-rate', type=float, default=0.05, help="Stop the ramp above this error rate")
+    parser.add_argument('--messages', default=SMS_MESSAGES_FILE,
+                        help="Messages to send (default: SMS MESSAGES.txt, or a synthetic corpus)")
+    parser.add_argument('--report', help="Write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print(f"{'sessions':>8}{'rerun/s':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'count p95':>11}{'recent p95':>11}{'opened':>8}{'peak':>7}")
+    report = run(args)
+    if args.report:
+        write_json_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,464 @@
+# Compact classification log storage.
+#
+# The original tables store the full MessageText on every row, forever, and
+# n.py writes the same text into four of them. Here:
+#
+#   MessageTexts                one row per distinct message, keyed by a 16-byte
+#                               hash of the exact text, with first/last seen
+#                               times and a count
+#   ClassificationEvents        one small row per classification (day, time,
+#                               hash, prediction, confidence, source),
+#                               partitioned by day in MySQL
+#   DailyClassificationRollups  per (day, message, prediction): count and
+#                               confidence sum/min/max
+#
+# maintain() rolls every day older than keep_days up into
+# DailyClassificationRollups, merging into rows of earlier runs (late events,
+# replayed spill journals), deletes the rolled-up events in the same
+# transaction and then drops the day's emptied partition. It also
+# deletes rollups older than keep_rollup_days and message texts that nothing
+# references any more, and adds partitions for the coming days. Storage
+# therefore grows with the number of distinct messages and days, not with raw
+# traffic.
+#
+# SQLite (the local stand-in) has no partitions; there the events table is
+# indexed by day and old days are deleted instead of dropped.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.logstore init --backend mysql
+#     python -m spamfilter.logstore maintain --backend mysql --keep-days 30
+#     python -m spamfilter.logstore stats --backend sqlite --sqlite-path spam_logs.db
+#
+# or log to it from the app with SPAM_SINKS=partitioned (MySQL, in the logs
+# database) or SPAM_SINKS=partitioned-sqlite.
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+from .db import LOGS_DB, connect_to_db
+from .metrics import timed
+from .sinks import NullSink
+
+MYSQL_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS MessageTexts (
+        MessageHash BINARY(16) PRIMARY KEY,
+        MessageText TEXT NOT NULL,
+        TransformedText TEXT NULL,
+        FirstSeen DATETIME NOT NULL,
+        LastSeen DATETIME NOT NULL,
+        SeenCount INT NOT NULL DEFAULT 1,
+        KEY idx_texts_last_seen (LastSeen)
+    )""",
+    """CREATE TABLE IF NOT EXISTS ClassificationEvents (
+        ID BIGINT NOT NULL AUTO_INCREMENT,
+        EventDay DATE NOT NULL,
+        ClassifiedAt DATETIME(3) NOT NULL,
+        MessageHash BINARY(16) NOT NULL,
+        Prediction TINYINT NOT NULL,
+        Confidence FLOAT NOT NULL,
+        Source VARCHAR(16) NOT NULL,
+        PRIMARY KEY (ID, EventDay),
+        KEY idx_events_day_prediction (EventDay, Prediction),
+        KEY idx_events_hash (MessageHash)
+    ) PARTITION BY RANGE COLUMNS (EventDay) (PARTITION pmax VALUES LESS THAN (MAXVALUE))""",
+    """CREATE TABLE IF NOT EXISTS DailyClassificationRollups (
+        Day DATE NOT NULL,
+        MessageHash BINARY(16) NOT NULL,
+        Prediction TINYINT NOT NULL,
+        Messages INT NOT NULL,
+        ConfidenceSum DOUBLE NOT NULL,
+        ConfidenceMin FLOAT NOT NULL,
+        ConfidenceMax FLOAT NOT NULL,
+        PRIMARY KEY (Day, MessageHash, Prediction),
+        KEY idx_rollups_hash (MessageHash)
+    )""",
+    """CREATE TABLE IF NOT EXISTS error_logs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        error_message TEXT,
+        error_time DATETIME
+    )""",
+]
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS MessageTexts (
+        MessageHash BLOB PRIMARY KEY,
+        MessageText TEXT NOT NULL,
+        TransformedText TEXT,
+        FirstSeen TEXT NOT NULL,
+        LastSeen TEXT NOT NULL,
+        SeenCount INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE INDEX IF NOT EXISTS idx_texts_last_seen ON MessageTexts (LastSeen);
+    CREATE TABLE IF NOT EXISTS ClassificationEvents (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        EventDay TEXT NOT NULL,
+        ClassifiedAt TEXT NOT NULL,
+        MessageHash BLOB NOT NULL,
+        Prediction INTEGER NOT NULL,
+        Confidence REAL NOT NULL,
+        Source TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_events_day_prediction ON ClassificationEvents (EventDay, Prediction);
+    CREATE INDEX IF NOT EXISTS idx_events_hash ON ClassificationEvents (MessageHash);
+    CREATE TABLE IF NOT EXISTS DailyClassificationRollups (
+        Day TEXT NOT NULL,
+        MessageHash BLOB NOT NULL,
+        Prediction INTEGER NOT NULL,
+        Messages INTEGER NOT NULL,
+        ConfidenceSum REAL NOT NULL,
+        ConfidenceMin REAL NOT NULL,
+        ConfidenceMax REAL NOT NULL,
+        PRIMARY KEY (Day, MessageHash, Prediction)
+    );
+    CREATE INDEX IF NOT EXISTS idx_rollups_hash ON DailyClassificationRollups (MessageHash);
+    CREATE TABLE IF NOT EXISTS error_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        error_message TEXT,
+        error_time TEXT
+    );
+"""
+
+
+# Function to hash the exact message text (16 bytes)
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def _partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+class _SQLiteBackend:
+    param = '?'
+    upsert_text = """
+        INSERT INTO MessageTexts (MessageHash, MessageText, TransformedText, FirstSeen, LastSeen, SeenCount)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT (MessageHash) DO UPDATE SET LastSeen = excluded.LastSeen, SeenCount = SeenCount + 1,
+            TransformedText = COALESCE(TransformedText, excluded.TransformedText)
+    """
+    merge_rollups = """
+        INSERT INTO DailyClassificationRollups
+            (Day, MessageHash, Prediction, Messages, ConfidenceSum, ConfidenceMin, ConfidenceMax)
+        SELECT EventDay, MessageHash, Prediction, COUNT(*), SUM(Confidence), MIN(Confidence), MAX(Confidence)
+        FROM ClassificationEvents WHERE EventDay = ? AND ID <= ?
+        GROUP BY EventDay, MessageHash, Prediction
+        ON CONFLICT (Day, MessageHash, Prediction) DO UPDATE SET
+            Messages = Messages + excluded.Messages, ConfidenceSum = ConfidenceSum + excluded.ConfidenceSum,
+            ConfidenceMin = MIN(ConfidenceMin, excluded.ConfidenceMin),
+            ConfidenceMax = MAX(ConfidenceMax, excluded.ConfidenceMax)
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    # Runs fn(cursor) in one transaction
+    def transaction(self, fn):
+        with self._lock, self.connection:
+            cursor = self.connection.cursor()
+            try:
+                return fn(cursor)
+            finally:
+                cursor.close()
+
+    def create_schema(self):
+        with self._lock:
+            self.connection.executescript(SQLITE_SCHEMA)
+
+    def ensure_partitions(self, first_day, last_day):
+        return []
+
+    def drop_day(self, cursor, day):
+        pass  # no partitions; rollup_day deletes the events
+
+    def close(self):
+        self.connection.close()
+
+
+class _MySQLBackend:
+    param = '%s'
+    upsert_text = """
+        INSERT INTO MessageTexts (MessageHash, MessageText, TransformedText, FirstSeen, LastSeen, SeenCount)
+        VALUES (%s, %s, %s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE LastSeen = VALUES(LastSeen), SeenCount = SeenCount + 1,
+            TransformedText = COALESCE(TransformedText, VALUES(TransformedText))
+    """
+    merge_rollups = """
+        INSERT INTO DailyClassificationRollups
+            (Day, MessageHash, Prediction, Messages, ConfidenceSum, ConfidenceMin, ConfidenceMax)
+        SELECT EventDay, MessageHash, Prediction, COUNT(*), SUM(Confidence), MIN(Confidence), MAX(Confidence)
+        FROM ClassificationEvents WHERE EventDay = %s AND ID <= %s
+        GROUP BY EventDay, MessageHash, Prediction
+        ON DUPLICATE KEY UPDATE
+            Messages = Messages + VALUES(Messages), ConfidenceSum = ConfidenceSum + VALUES(ConfidenceSum),
+            ConfidenceMin = LEAST(ConfidenceMin, VALUES(ConfidenceMin)),
+            ConfidenceMax = GREATEST(ConfidenceMax, VALUES(ConfidenceMax))
+    """
+
+    def __init__(self, database=LOGS_DB):
+        self.database = database
+
+    # Runs fn(cursor) in one transaction on a fresh connection, as the apps do
+    def transaction(self, fn):
+        connection = connect_to_db(self.database)
+        try:
+            cursor = connection.cursor()
+            try:
+                result = fn(cursor)
+                connection.commit()
+                return result
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+    def create_schema(self):
+        def create(cursor):
+            for statement in MYSQL_SCHEMA:
+                cursor.execute(statement)
+        self.transaction(create)
+
+    def _partition_days(self, cursor):
+        cursor.execute("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ClassificationEvents'
+        """)
+        return {datetime.strptime(name, 'p%Y%m%d').date() for (name,) in cursor.fetchall()
+                if name and name != 'pmax'}
+
+    # Function to split daily partitions off pmax up to last_day (partitions
+    # can only be added after the newest one)
+    def ensure_partitions(self, first_day, last_day):
+        def add(cursor):
+            existing = self._partition_days(cursor)
+            day = max(existing) + timedelta(days=1) if existing else first_day
+            added = []
+            while day <= last_day:
+                cursor.execute(f"""
+                    ALTER TABLE ClassificationEvents REORGANIZE PARTITION pmax INTO (
+                        PARTITION {_partition_name(day)} VALUES LESS THAN ('{day + timedelta(days=1)}'),
+                        PARTITION pmax VALUES LESS THAN (MAXVALUE))
+                """)
+                added.append(day)
+                day += timedelta(days=1)
+            return added
+        return self.transaction(add)
+
+    # Function to drop a day's partition once rollup_day has emptied it; a
+    # partition that received events since is kept for the next run
+    def drop_day(self, cursor, day):
+        if day not in self._partition_days(cursor):
+            return
+        cursor.execute("SELECT 1 FROM ClassificationEvents WHERE EventDay = %s LIMIT 1", (day,))
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE ClassificationEvents DROP PARTITION {_partition_name(day)}")
+
+    def close(self):
+        pass
+
+
+class LogStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self.p = backend.param
+
+    @classmethod
+    def mysql(cls, database=LOGS_DB):
+        return cls(_MySQLBackend(database))
+
+    @classmethod
+    def sqlite(cls, path='spam_logs.db'):
+        store = cls(_SQLiteBackend(path))
+        store.backend.create_schema()
+        return store
+
+    def create_schema(self, partitions_ahead=7):
+        self.backend.create_schema()
+        today = date.today()
+        self.backend.ensure_partitions(today, today + timedelta(days=partitions_ahead))
+
+    def log(self, result, when=None):
+        when = when or datetime.now()
+        digest = text_hash(result.message)
+        p = self.p
+
+        def write(cursor):
+            cursor.execute(self.backend.upsert_text, (digest, result.message, result.transformed,
+                                                      when.replace(microsecond=0), when.replace(microsecond=0)))
+            cursor.execute(f"""
+                INSERT INTO ClassificationEvents (EventDay, ClassifiedAt, MessageHash, Prediction, Confidence, Source)
+                VALUES ({p}, {p}, {p}, {p}, {p}, {p})
+            """, (when.date().isoformat(), when.isoformat(sep=' ', timespec='milliseconds'), digest,
+                  int(result.prediction), float(result.confidence), result.source))
+        self.backend.transaction(write)
+
+    def log_error(self, error_message):
+        p = self.p
+        self.backend.transaction(lambda cursor: cursor.execute(
+            f"INSERT INTO error_logs (error_message, error_time) VALUES ({p}, {p})",
+            (error_message, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))))
+
+    # Same shape as the other sinks: (message, prediction, confidence, time)
+    def recent(self, limit=5):
+        def query(cursor):
+            cursor.execute(f"""
+                SELECT t.MessageText, e.Prediction, e.Confidence, e.ClassifiedAt
+                FROM ClassificationEvents e JOIN MessageTexts t ON t.MessageHash = e.MessageHash
+                ORDER BY e.ID DESC
+                LIMIT {self.p}
+            """, (limit,))
+            return [(text, 'Spam' if prediction == 1 else 'Not Spam', confidence, str(at)[:19])
+                    for text, prediction, confidence, at in cursor.fetchall()]
+        return self.backend.transaction(query)
+
+    # Spam in the retained events plus everything already rolled up
+    def spam_count(self):
+        def query(cursor):
+            cursor.execute("SELECT COUNT(*) FROM ClassificationEvents WHERE Prediction = 1")
+            live = cursor.fetchone()[0]
+            cursor.execute("SELECT COALESCE(SUM(Messages), 0) FROM DailyClassificationRollups WHERE Prediction = 1")
+            return int(live) + int(cursor.fetchone()[0])
+        return self.backend.transaction(query)
+
+    # Function to compact one day of events into rollups; returns the number
+    # of events rolled up. The events are merged into the day's existing
+    # rollups (a day can get late events after it was rolled up, e.g. from a
+    # replayed spill journal) and deleted in the same transaction, so a
+    # re-run never counts anything twice.
+    def rollup_day(self, day):
+        p = self.p
+        day_value = day.isoformat()
+
+        def compact(cursor):
+            # Events logged while this runs are left for the next run
+            cursor.execute(f"SELECT MAX(ID) FROM ClassificationEvents WHERE EventDay = {p}", (day_value,))
+            last_id = cursor.fetchone()[0]
+            if last_id is None:
+                return 0
+            cursor.execute(self.backend.merge_rollups, (day_value, last_id))
+            cursor.execute(f"DELETE FROM ClassificationEvents WHERE EventDay = {p} AND ID <= {p}",
+                           (day_value, last_id))
+            return cursor.rowcount
+        events = self.backend.transaction(compact)
+        self.backend.transaction(lambda cursor: self.backend.drop_day(cursor, day))
+        return events
+
+    # Function to run the retention jobs; returns what was done
+    def maintain(self, keep_days=30, keep_rollup_days=400, partitions_ahead=7, today=None):
+        today = today or date.today()
+        cutoff = today - timedelta(days=keep_days)
+        p = self.p
+
+        def old_days(cursor):
+            cursor.execute(f"SELECT DISTINCT EventDay FROM ClassificationEvents WHERE EventDay < {p}",
+                           (cutoff.isoformat(),))
+            return sorted(value if isinstance(value, date) else date.fromisoformat(value)
+                          for (value,) in cursor.fetchall())
+        report = {'rolled_up_days': [], 'rolled_up_events': 0}
+        for day in self.backend.transaction(old_days):
+            report['rolled_up_events'] += self.rollup_day(day)
+            report['rolled_up_days'].append(day.isoformat())
+
+        rollup_cutoff = (today - timedelta(days=keep_rollup_days)).isoformat()
+        text_cutoff = cutoff.isoformat()
+
+        def prune(cursor):
+            cursor.execute(f"DELETE FROM DailyClassificationRollups WHERE Day < {p}", (rollup_cutoff,))
+            rollups = cursor.rowcount
+            # Texts not seen since the cutoff that no rollup refers to
+            cursor.execute(f"""
+                DELETE FROM MessageTexts WHERE LastSeen < {p}
+                AND NOT EXISTS (SELECT 1 FROM DailyClassificationRollups r WHERE r.MessageHash = MessageTexts.MessageHash)
+                AND NOT EXISTS (SELECT 1 FROM ClassificationEvents e WHERE e.MessageHash = MessageTexts.MessageHash)
+            """, (text_cutoff,))
+            return rollups, cursor.rowcount
+        report['deleted_rollups'], report['deleted_texts'] = self.backend.transaction(prune)
+        report['added_partitions'] = [day.isoformat() for day in
+                                      self.backend.ensure_partitions(today, today + timedelta(days=partitions_ahead))]
+        return report
+
+    def stats(self):
+        def query(cursor):
+            counts = {}
+            for table in ('MessageTexts', 'ClassificationEvents', 'DailyClassificationRollups'):
+                cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                counts[table] = int(cursor.fetchone()[0])
+            cursor.execute("SELECT COALESCE(SUM(SeenCount), 0) FROM MessageTexts")
+            counts['classifications_of_retained_texts'] = int(cursor.fetchone()[0])
+            return counts
+        return self.backend.transaction(query)
+
+    def close(self):
+        self.backend.close()
+
+
+# A sink writing to a LogStore (see spamfilter.sinks)
+class PartitionedLogSink(NullSink):
+    def __init__(self, store):
+        self.store = store
+
+    @timed('db_log')
+    def log(self, result):
+        self.store.log(result)
+
+    def log_error(self, error_message):
+        self.store.log_error(error_message)
+
+    def log_many(self, results, times=None):
+        for result, when in zip(results, times or [None] * len(results)):
+            self.store.log(result, when)
+
+    @timed('db_recent_logs')
+    def recent(self, limit=5):
+        return self.store.recent(limit)
+
+    @timed('db_spam_count')
+    def spam_count(self):
+        return self.store.spam_count()
+
+    def ping(self):
+        self.store.backend.transaction(lambda cursor: cursor.execute("SELECT 1"))
+
+    def close(self):
+        self.store.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Create, compact and inspect the partitioned log store.")
+    parser.add_argument('command', choices=['init', 'maintain', 'stats'])
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'], default='mysql')
+    parser.add_argument('--database', default=LOGS_DB, help="MySQL database")
+    parser.add_argument('--sqlite-path', default='spam_logs.db')
+    parser.add_argument('--keep-days', type=int, default=30, help="Days of individual events to keep")
+    parser.add_argument('--keep-rollup-days', type=int, default=400, help="Days of daily rollups to keep")
+    parser.add_argument('--partitions-ahead', type=int, default=7, help="Daily partitions to create in advance")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = LogStore.mysql(args.database) if args.backend == 'mysql' else LogStore.sqlite(args.sqlite_path)
+    try:
+        if args.command == 'init':
+            store.create_schema(args.partitions_ahead)
+            print("Log store ready")
+        elif args.command == 'maintain':
+            print(json.dumps(store.maintain(args.keep_days, args.keep_rollup_days, args.partitions_ahead), indent=2))
+        else:
+            print(json.dumps(store.stats(), indent=2))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# In-process latency histograms and counters with Prometheus text export.
+#
+# Recording a value is a bisect and two additions under an uncontended lock,
+# so timing every stage of every request costs well under a microsecond.
+# Streamlit re-runs the app script on each interaction but keeps imported
+# modules, so the module-level REGISTRY accumulates across reruns.
+#
+# Export, both optional and idempotent:
+#     start_http_server(9108)                  # GET /metrics
+#     start_periodic_dump('metrics.prom', 15)  # rewrite a file every 15 s
+# or set SPAM_METRICS_PORT / SPAM_METRICS_DUMP and call start_from_env().
+#
+# A sampling profiler (SPAM_PROFILE=profile.txt) periodically records the
+# stacks of all threads and writes them in collapsed "flamegraph" format.
+
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+
+# Seconds; covers a sub-millisecond predict up to a multi-second DB timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, help_text=''):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=''):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('spam_stage_seconds', 'Time spent in each classification stage')
+PREDICTIONS = REGISTRY.counter('spam_predictions_total', 'Messages classified, by prediction')
+ERRORS = REGISTRY.counter('spam_errors_total', 'Errors, by stage')
+
+
+# Function to time a block as one stage: with stage_timer('vectorize'): ...
+def stage_timer(stage):
+    return STAGE_SECONDS.time(stage=stage)
+
+
+# Decorator to time every call of a function as one stage, counting exceptions
+def timed(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                ERRORS.inc(stage=stage)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+_started = {}
+_start_lock = threading.Lock()
+
+
+def _start_once(key, target):
+    with _start_lock:
+        if key in _started:
+            return _started[key]
+        _started[key] = target()
+        return _started[key]
+
+
+# Function to serve the registry at http://<host>:<port>/metrics
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    def start():
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+    return _start_once(('http', host, port), start)
+
+
+# Function to rewrite a Prometheus text file every interval seconds (e.g. for
+# node_exporter's textfile collector)
+def start_periodic_dump(path, interval=15.0, registry=REGISTRY):
+    def dump_forever():
+        while True:
+            time.sleep(interval)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(registry.render())
+            os.replace(tmp_path, path)
+
+    def start():
+        thread = threading.Thread(target=dump_forever, name='metrics-dump', daemon=True)
+        thread.start()
+        return thread
+
+    return _start_once(('dump', os.path.abspath(path)), start)
+
+
+# Samples the stacks of all other threads every interval seconds and counts
+# them in collapsed-stack format ("a;b;c 12"), which flamegraph tools read
+class SamplingProfiler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = _StackCounter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack = ';'.join(reversed(names))
+                with self._lock:
+                    self.stacks[stack] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, path):
+        # The sampler keeps counting while the file is written
+        with self._lock:
+            stacks = self.stacks.most_common()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+
+
+# Function to start a sampling profiler that writes its stacks to path every
+# flush_interval seconds
+def start_profiler(path, interval=0.01, flush_interval=30.0):
+    def start():
+        profiler = SamplingProfiler(interval).start()
+
+        def flush_forever():
+            while True:
+                time.sleep(flush_interval)
+                profiler.write(path)
+
+        threading.Thread(target=flush_forever, name='profiler-flush', daemon=True).start()
+        return profiler
+
+    return _start_once(('profile', os.path.abspath(path)), start)
+
+
+# Function to start the exporters configured through environment variables:
+# SPAM_METRICS_PORT, SPAM_METRICS_DUMP (+ SPAM_METRICS_DUMP_INTERVAL) and
+# SPAM_PROFILE (+ SPAM_PROFILE_INTERVAL)
+def start_from_env():
+    port = os.environ.get('SPAM_METRICS_PORT')
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError:
+            pass  # another process (e.g. a second Streamlit worker) already serves it
+    dump_path = os.environ.get('SPAM_METRICS_DUMP')
+    if dump_path:
+        start_periodic_dump(dump_path, float(os.environ.get('SPAM_METRICS_DUMP_INTERVAL', '15')))
+    profile_path = os.environ.get('SPAM_PROFILE')
+    if profile_path:
+        start_profiler(profile_path, float(os.environ.get('SPAM_PROFILE_INTERVAL', '0.01')))
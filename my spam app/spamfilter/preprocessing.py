@@ -0,0 +1,91 @@
+import hashlib
+import string
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+# Bump this whenever transform_text changes its output, so anything cached on
+# disk from an older version is recomputed instead of silently reused.
+PREPROCESSING_VERSION = 1
+
+_PUNCTUATION = frozenset(string.punctuation)
+
+
+# Function to download the NLTK resources only when they are missing
+def ensure_nltk_data():
+    import nltk
+
+    for resource, path in (("punkt", "tokenizers/punkt"),
+                           ("punkt_tab", "tokenizers/punkt_tab"),
+                           ("stopwords", "corpora/stopwords")):
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(resource, quiet=True)
+
+
+# The stopword list is read from disk on every stopwords.words() call, so build
+# it once per process and keep it as a set for O(1) membership tests.
+@lru_cache(maxsize=None)
+def english_stopwords():
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=None)
+def _stemmer():
+    from nltk.stem.porter import PorterStemmer
+
+    return PorterStemmer()
+
+
+# Function to preprocess the text (same output as the apps and the notebook)
+def transform_text(text):
+    from nltk import word_tokenize
+
+    stop_words = english_stopwords()
+    ps = _stemmer()
+
+    y = []
+    for i in word_tokenize(text.lower()):
+        if i.isalnum() and i not in stop_words and i not in _PUNCTUATION:
+            y.append(ps.stem(i))
+
+    return " ".join(y)
+
+
+def _init_worker():
+    # Warm the per-process caches once instead of on the first message
+    english_stopwords()
+    _stemmer()
+
+
+# Function to create a process pool for transform_many
+def create_pool(n_jobs):
+    return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker)
+
+
+# Function to preprocess many texts, optionally across several processes.
+# Pass an existing pool to reuse its workers between calls, and another
+# (picklable) function such as languages.transform_for('es') as transform.
+def transform_many(texts, n_jobs=1, pool=None, chunksize=256, transform=transform_text):
+    texts = list(texts)
+    if pool is None and (n_jobs == 1 or len(texts) < chunksize):
+        return [transform(text) for text in texts]
+
+    if pool is not None:
+        return list(pool.map(transform, texts, chunksize=chunksize))
+
+    with create_pool(n_jobs) as own_pool:
+        return list(own_pool.map(transform, texts, chunksize=chunksize))
+
+
+# Function to normalise a raw message for de-duplication and caching: case and
+# runs of whitespace do not change what the message says
+def normalize_message(text):
+    return " ".join(text.lower().split())
+
+
+# Function to hash a message by its normalised text (hex digest, 32 chars)
+def message_hash(text):
+    return hashlib.blake2b(normalize_message(text).encode('utf-8'), digest_size=16).hexdigest()
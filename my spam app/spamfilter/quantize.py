@@ -0,0 +1,374 @@
+# Smaller scoring artifacts: model weights and idf in float32 or int8.
+#
+# Every model the apps load is linear in the TF-IDF features: the spam
+# log-odds of a message are X @ w + b (for MultinomialNB w is
+# feature_log_prob_[1] - feature_log_prob_[0]; the LinearEnsemble has one
+# column per member and averages their probabilities). A QuantizedModel keeps
+# only w and b, and a QuantizedVectorizer only the vocabulary and idf_, so
+# everything that is only needed for training (feature_count_, class_count_,
+# stop_words_, ...) is dropped as well.
+#
+#   float32  weights and idf as float32
+#   int8     weights as int8 codes with one float32 scale per column
+#            (symmetric, |w| / 127), idf as uint8 codes with a float32 offset
+#            and step (idf is always positive)
+#
+# Scoring gathers the weights of a message's non-zero features, so the int8
+# codes are never expanded into a float matrix. The vocabulary dict is kept as
+# it is; it is the largest part of vectorizer.pkl, so the saving there is
+# smaller than in model.pkl.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.quantize --data spam.csv
+#     python -m spamfilter.quantize --data spam.csv --dtype int8 --out-dir quantized
+#
+# The first prints, for the current model and each dtype, accuracy and
+# precision on the notebook's test split (80/20, random_state=2), how many
+# verdicts changed, the largest change in P(spam), artifact and loaded sizes,
+# batch throughput and single-message latency. The second also writes the
+# quantized vectorizer.pkl and model.pkl, which the apps load with
+# SPAM_MODEL_DIR=quantized. Quantized artifacts are for scoring only;
+# spamfilter.feedback cannot update them.
+
+import argparse
+import pickle
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from .artifacts import load_artifacts, save_artifacts
+from .timing import StageRecorder, latency_percentiles, write_json_report
+from .train import add_data_arguments, load_corpus_cached
+
+CACHE_DIR = '.corpus_cache'
+DTYPES = ('float32', 'int8')
+
+# TfidfVectorizer settings that decide how a message is split into terms
+_ANALYZER_PARAMS = ('input', 'encoding', 'decode_error', 'strip_accents', 'lowercase', 'preprocessor',
+                    'tokenizer', 'stop_words', 'token_pattern', 'ngram_range', 'analyzer')
+
+
+# Function to quantize the columns of a (n_features, n_columns) matrix;
+# returns (codes, scales) with values ~= codes * scales
+def quantize_columns(values, dtype):
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if dtype == 'float32':
+        return values.astype(np.float32), np.ones(values.shape[1], dtype=np.float32)
+    if dtype != 'int8':
+        raise ValueError(f"Unknown dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+    scales = np.abs(values).max(axis=0) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.round(values / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedModel:
+    def __init__(self, codes, scales, intercepts, member_weights, dtype):
+        import numpy as np
+
+        self.classes_ = np.array([0, 1])
+        self.dtype = dtype
+        self.codes_ = codes                      # (n_features, n_members), float32 or int8
+        self.scales_ = scales                    # (n_members,) float32
+        self.intercepts_ = np.asarray(intercepts, dtype=np.float64)
+        self.member_weights_ = np.asarray(member_weights, dtype=np.float64)
+
+    # Function to quantize a MultinomialNB, a linear scikit-learn model or a
+    # LinearEnsemble
+    @classmethod
+    def from_model(cls, model, dtype='int8'):
+        import numpy as np
+
+        from .ensemble import log_odds_weights
+
+        if hasattr(model, 'coef_matrix_'):  # LinearEnsemble
+            matrix, intercepts, members = model.coef_matrix_, model.intercepts_, model.member_weights_
+        elif hasattr(model, 'feature_log_prob_') or hasattr(model, 'coef_'):
+            if len(model.classes_) != 2:
+                raise TypeError(f"Cannot quantize a {len(model.classes_)}-class {type(model).__name__}")
+            w, b = log_odds_weights(model)
+            matrix, intercepts, members = w[:, np.newaxis], [b], [1.0]
+        else:
+            raise TypeError(f"Cannot quantize a {type(model).__name__}; it is not linear in the TF-IDF features")
+        codes, scales = quantize_columns(matrix, dtype)
+        return cls(codes, scales, intercepts, members, dtype)
+
+    # Dequantized weights, so spamfilter.explain and spamfilter.cascade work
+    # on a quantized model as on the original
+    @property
+    def coef_matrix_(self):
+        return self.codes_.astype('float64') * self.scales_
+
+    @property
+    def coef_(self):
+        return self.coef_matrix_.T
+
+    @property
+    def intercept_(self):
+        return self.intercepts_
+
+    # Function to compute the spam log-odds of every row for every member
+    def decision_function(self, X):
+        import numpy as np
+
+        X = X.tocsr()
+        products = X.data.astype(np.float32)[:, np.newaxis] * self.codes_[X.indices]
+        sums = np.zeros((X.shape[0], self.codes_.shape[1]), dtype=np.float32)
+        filled = np.diff(X.indptr) > 0
+        if products.size:
+            sums[filled] = np.add.reduceat(products, X.indptr[:-1][filled], axis=0)
+        return sums.astype(np.float64) * self.scales_ + self.intercepts_
+
+    def predict_proba(self, X):
+        import numpy as np
+
+        spam = (1.0 / (1.0 + np.exp(-self.decision_function(X)))) @ self.member_weights_
+        return np.column_stack([1.0 - spam, spam])
+
+    def predict(self, X):
+        return self.predict_proba(X).argmax(axis=1)
+
+
+class QuantizedVectorizer:
+    def __init__(self, vocabulary, analyzer_params, idf_codes, idf_offset, idf_step, norm='l2',
+                 sublinear_tf=False, binary=False, dtype='int8'):
+        self.vocabulary_ = vocabulary
+        self.analyzer_params = analyzer_params
+        self.idf_codes_ = idf_codes              # float32 idf, or uint8 codes
+        self.idf_offset_ = idf_offset
+        self.idf_step_ = idf_step
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.binary = binary
+        self.dtype = dtype
+        self._analyze = None
+        self._feature_names = None
+
+    # Function to quantize a fitted TfidfVectorizer
+    @classmethod
+    def from_vectorizer(cls, vectorizer, dtype='int8'):
+        import numpy as np
+
+        params = vectorizer.get_params()
+        idf, offset, step = fitted_idf(vectorizer), 0.0, 1.0
+        if idf is not None:
+            if dtype == 'float32':
+                idf = idf.astype(np.float32)
+            elif dtype == 'int8':
+                offset = float(idf.min())
+                step = float(idf.max() - offset) / 255 or 1.0
+                idf = np.round((idf - offset) / step).astype(np.uint8)
+            else:
+                raise ValueError(f"Unknown dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+        return cls(dict(vectorizer.vocabulary_), {name: params[name] for name in _ANALYZER_PARAMS}, idf,
+                   offset, step, vectorizer.norm, vectorizer.sublinear_tf, vectorizer.binary, dtype)
+
+    # The analyzer and feature names are rebuilt after unpickling, not stored
+    def __getstate__(self):
+        return dict(self.__dict__, _analyze=None, _feature_names=None)
+
+    def _analyzer(self):
+        if self._analyze is None:
+            from sklearn.feature_extraction.text import CountVectorizer
+
+            self._analyze = CountVectorizer(**self.analyzer_params).build_analyzer()
+        return self._analyze
+
+    def get_feature_names_out(self, input_features=None):
+        import numpy as np
+
+        if self._feature_names is None:
+            names = np.empty(len(self.vocabulary_), dtype=object)
+            for term, index in self.vocabulary_.items():
+                names[index] = term
+            self._feature_names = names
+        return self._feature_names
+
+    # Function to turn texts into the same float32 TF-IDF rows as the
+    # original vectorizer, up to the idf rounding
+    def transform(self, raw_documents):
+        import numpy as np
+        import scipy.sparse as sp
+        from sklearn.preprocessing import normalize
+
+        analyze = self._analyzer()
+        vocabulary = self.vocabulary_
+        indices, values, indptr = [], [], [0]
+        for document in raw_documents:
+            counts = Counter(index for index in map(vocabulary.get, analyze(document)) if index is not None)
+            for index in sorted(counts):
+                indices.append(index)
+                values.append(counts[index])
+            indptr.append(len(indices))
+
+        X = sp.csr_matrix((np.asarray(values, dtype=np.float32), np.asarray(indices, dtype=np.int32),
+                           np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(vocabulary)))
+        if self.binary:
+            X.data[:] = 1
+        elif self.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.idf_codes_ is not None:
+            X.data *= self.idf_codes_[X.indices].astype(np.float32) * np.float32(self.idf_step_) \
+                + np.float32(self.idf_offset_)
+        if self.norm:
+            X = normalize(X, norm=self.norm, copy=False)
+        return X
+
+
+# Function to get the idf a TfidfVectorizer was fitted with. Pickles from
+# older scikit-learn releases keep it in _tfidf._idf_diag, which newer
+# releases no longer read (they then skip the idf weighting altogether).
+def fitted_idf(vectorizer):
+    import numpy as np
+
+    if not vectorizer.use_idf:
+        return None
+    tfidf = getattr(vectorizer, '_tfidf', None)
+    if hasattr(tfidf, '_idf_diag') and not hasattr(tfidf, 'idf_'):
+        return np.asarray(tfidf._idf_diag.diagonal(), dtype=np.float64)
+    return np.asarray(vectorizer.idf_, dtype=np.float64)
+
+
+# Function to quantize a vectorizer and model together
+def quantize(vectorizer, model, dtype='int8'):
+    return QuantizedVectorizer.from_vectorizer(vectorizer, dtype), QuantizedModel.from_model(model, dtype)
+
+
+# Function to measure the pickled size of both artifacts and the memory they
+# take once unpickled
+def artifact_footprint(vectorizer, model):
+    blobs = [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL) for obj in (vectorizer, model)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        loaded = [pickle.loads(blob) for blob in blobs]
+        loaded_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del loaded
+    return {'vectorizer_kb': round(len(blobs[0]) / 1024, 1), 'model_kb': round(len(blobs[1]) / 1024, 1),
+            'loaded_kb': round(loaded_bytes / 1024, 1)}
+
+
+# Function to score the test split with one vectorizer/model pair, against
+# the current model's probabilities
+def evaluate(name, vectorizer, model, test_corpus, y_test, reference=None, single_runs=500, batch_rounds=5):
+    import numpy as np
+    from sklearn.metrics import accuracy_score, precision_score
+
+    X_test = vectorizer.transform(test_corpus)
+    proba = model.predict_proba(X_test)[:, 1]
+    y_pred = model.predict(X_test)
+
+    start = time.perf_counter()
+    for _ in range(batch_rounds):
+        model.predict_proba(vectorizer.transform(test_corpus))
+    batch_seconds = time.perf_counter() - start
+
+    # What the apps do per click: transform one message and score it
+    samples = []
+    for i in range(min(single_runs, len(test_corpus))):
+        start = time.perf_counter()
+        model.predict_proba(vectorizer.transform([test_corpus[i]]))
+        samples.append(time.perf_counter() - start)
+
+    row = {
+        'model': name,
+        'accuracy': round(accuracy_score(y_test, y_pred), 4),
+        'precision': round(precision_score(y_test, y_pred, zero_division=0), 4),
+        'changed_verdicts': 0,
+        'max_proba_delta': 0.0,
+        **artifact_footprint(vectorizer, model),
+        'batch_messages_per_second': round(batch_rounds * len(test_corpus) / batch_seconds, 1),
+        **latency_percentiles(samples),
+    }
+    if reference is not None:
+        reference_proba, reference_pred = reference
+        row['changed_verdicts'] = int((y_pred != reference_pred).sum())
+        row['max_proba_delta'] = round(float(np.abs(proba - reference_proba).max()), 6)
+    return row, (proba, y_pred)
+
+
+def run(args):
+    import numpy as np
+    from sklearn.model_selection import train_test_split
+
+    recorder = StageRecorder(trace_memory=False)
+    corpus, labels = load_corpus_cached(args, recorder, args.cache_dir)
+    with recorder.stage('load_artifacts'):
+        vectorizer, model = load_artifacts(args.model_dir)
+
+    # The notebook splits the vectorized rows; the split only depends on the
+    # number of rows and random_state, so splitting the indices is the same
+    _, test_idx, _, y_test = train_test_split(np.arange(len(corpus)), np.asarray(labels),
+                                              test_size=args.test_size, random_state=args.random_state)
+    test_corpus = [corpus[i] for i in test_idx]
+
+    results = []
+    idf = fitted_idf(vectorizer)
+    if idf is not None and not hasattr(getattr(vectorizer, '_tfidf', None), 'idf_'):
+        # Compare against the model as trained, and show what skipping idf costs
+        with recorder.stage('as-loaded'):
+            results.append(evaluate('as-loaded', vectorizer, model, test_corpus, y_test,
+                                    single_runs=args.single_runs)[0])
+        vectorizer.idf_ = idf
+    with recorder.stage('current'):
+        current, reference = evaluate('current', vectorizer, model, test_corpus, y_test,
+                                      single_runs=args.single_runs)
+    results.append(current)
+    for dtype in args.dtypes:
+        with recorder.stage(dtype):
+            quantized = quantize(vectorizer, model, dtype)
+            row, _ = evaluate(dtype, *quantized, test_corpus, y_test, reference, single_runs=args.single_runs)
+        results.append(row)
+        if args.out_dir and dtype == args.dtype:
+            save_artifacts(*quantized, args.out_dir)
+
+    return {'rows': len(corpus), 'test_rows': len(test_corpus), 'results': results, **recorder.to_dict()}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Quantize the model and measure what it costs and saves.")
+    add_data_arguments(parser)
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--random-state', type=int, default=2)
+    parser.add_argument('--dtypes', nargs='+', choices=DTYPES, default=list(DTYPES), help="Variants to compare")
+    parser.add_argument('--dtype', choices=DTYPES, default='int8', help="Variant written to --out-dir")
+    parser.add_argument('--out-dir', help="Write the quantized vectorizer.pkl and model.pkl here")
+    parser.add_argument('--single-runs', type=int, default=500, help="Messages timed one at a time")
+    parser.add_argument('--report', help="Write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.out_dir and args.dtype not in args.dtypes:
+        args.dtypes.append(args.dtype)
+    report = run(args)
+
+    print(f"Test split: {report['test_rows']} of {report['rows']} messages")
+    print(f"{'model':<9}{'acc':>8}{'prec':>8}{'changed':>9}{'max dP':>9}{'vec KB':>8}{'model KB':>10}"
+          f"{'loaded KB':>11}{'msg/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for r in report['results']:
+        print(f"{r['model']:<9}{r['accuracy']:>8.4f}{r['precision']:>8.4f}{r['changed_verdicts']:>9}"
+              f"{r['max_proba_delta']:>9.5f}{r['vectorizer_kb']:>8.1f}{r['model_kb']:>10.1f}{r['loaded_kb']:>11.1f}"
+              f"{r['batch_messages_per_second']:>10.0f}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}")
+    if args.out_dir:
+        print(f"Saved the {args.dtype} vectorizer.pkl and model.pkl in {args.out_dir}")
+
+    if args.report:
+        write_json_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    # Run the imported module's main so the saved artifacts pickle as
+    # spamfilter.quantize classes, which the apps can load, not __main__
+    from .quantize import main as module_main
+    sys.exit(module_main())
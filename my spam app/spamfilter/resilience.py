@@ -0,0 +1,360 @@
+# Keeping the page fast while MySQL is down.
+#
+# Each MySQL-backed sink is wrapped in a ResilientSink:
+#
+#   - a CircuitBreaker opens after failure_threshold consecutive failures and
+#     then refuses calls for reset_timeout seconds, so requests stop paying a
+#     connect timeout each. After the window one call is let through as a
+#     probe; if it fails too, the window doubles (up to max_reset_timeout).
+#   - results that cannot be written (breaker open, or the write failed) are
+#     appended to a local journal, one JSON line per result, with their
+#     classification time.
+#   - a background thread does the probing (sink.ping()) and then replays the
+#     journal into the sink in batches. Requests keep spilling until its probe
+#     succeeds, so none of them waits on a connect timeout. Replay renames the
+#     journal first, so new spills go to a fresh file, and records its
+#     progress, so an interrupted replay resumes instead of starting over.
+#
+# While the breaker is open, recent() and spam_count() return None (the page
+# leaves those sections out) and the repository lookup is skipped.
+#
+# The breaker state is exported as spam_db_circuit_open{sink=...} and spilled
+# and replayed records as spam_spilled_total / spam_replayed_total.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.resilience status
+#     python -m spamfilter.resilience replay --preset ap
+#
+# (the app replays by itself once the database is back; run replay while the
+# app is stopped)
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from .metrics import REGISTRY
+from .sinks import NullSink
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN = REGISTRY.gauge('spam_db_circuit_open', 'Whether the database circuit breaker is open')
+SPILLED = REGISTRY.counter('spam_spilled_total', 'Results written to the spill journal')
+REPLAYED = REGISTRY.counter('spam_replayed_total', 'Journalled results replayed into their sink')
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # probe_in_background: only calls made with probe=True may probe, so the
+    # caller's other calls never wait on a database that is still down
+    def __init__(self, name='db', failure_threshold=3, reset_timeout=5.0, max_reset_timeout=60.0,
+                 probe_in_background=False):
+        self.name = name
+        self.probe_in_background = probe_in_background
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.window = reset_timeout
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_OPEN.set(0, sink=name)
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    # Function to decide whether a call may go to the database. When the
+    # window has passed, a single caller is let through as a probe.
+    def allow(self, probe=False):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.window:
+                return False
+            if self.probe_in_background and not probe:
+                return False
+            self._probing = True
+            return True
+
+    # Seconds until a probe may be sent (0 while closed)
+    def retry_in(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.window - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.window = self.reset_timeout
+            self._probing = False
+        CIRCUIT_OPEN.set(0, sink=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing:  # the probe failed: back off further
+                self.window = min(self.window * 2, self.max_reset_timeout)
+                self.opened_at = time.monotonic()
+                self._probing = False
+            elif self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            opened = self.opened_at is not None
+        if opened:
+            CIRCUIT_OPEN.set(1, sink=self.name)
+
+    # Function to run fn through the breaker; raises CircuitOpenError without
+    # calling it while the breaker is open
+    def call(self, fn, *args, probe=False):
+        if not self.allow(probe):
+            raise CircuitOpenError(f"{self.name}: database unavailable, retrying in {self.window:.0f}s")
+        try:
+            value = fn(*args)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return value
+
+
+def _encode(result, when):
+    return json.dumps({'time': when.isoformat(), 'message': result.message, 'transformed': result.transformed,
+                       'prediction': int(result.prediction), 'confidence': float(result.confidence),
+                       'source': result.source}, ensure_ascii=False)
+
+
+def _decode(line):
+    from .engine import Classification
+
+    record = json.loads(line)
+    return (Classification(record['message'], record['transformed'], record['prediction'], record['confidence'],
+                           record['source']), datetime.fromisoformat(record['time']))
+
+
+# What a replay writes into: log_many goes through the breaker and raises, so
+# a replay stops at the first batch that fails
+class _ReplayTarget:
+    def __init__(self, sink, breaker):
+        self.sink = sink
+        self.breaker = breaker
+
+    def log_many(self, results, times=None):
+        self.breaker.call(self.sink.log_many, results, times)
+
+
+# Append-only JSON-lines journal of results that could not be written
+class SpillJournal:
+    def __init__(self, path):
+        self.path = path
+        self.replaying_path = path + '.replaying'
+        self.offset_path = path + '.replaying.offset'
+        self._lock = threading.Lock()
+
+    def append(self, result, when=None):
+        line = _encode(result, when or datetime.now()) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def pending(self):
+        return os.path.exists(self.path) or os.path.exists(self.replaying_path)
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in (self.path, self.replaying_path) if os.path.exists(path))
+
+    # Function to write the journalled results into a sink with
+    # sink.log_many, batch by batch; returns how many were replayed. A batch
+    # that fails stops the replay, and it continues from there next time.
+    def replay(self, sink, batch_size=500):
+        replayed = 0
+        while True:
+            with self._lock:
+                if not os.path.exists(self.replaying_path):
+                    if not os.path.exists(self.path):
+                        return replayed
+                    os.replace(self.path, self.replaying_path)
+            offset = 0
+            if os.path.exists(self.offset_path):
+                with open(self.offset_path, encoding='utf-8') as f:
+                    offset = int(f.read() or 0)
+            with open(self.replaying_path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    lines = [line for line in (f.readline() for _ in range(batch_size)) if line.strip()]
+                    if not lines:
+                        break
+                    records = []
+                    for line in lines:
+                        try:
+                            records.append(_decode(line.decode('utf-8')))
+                        except ValueError:  # a line cut short by a crash
+                            logger.warning("Skipping a damaged line in %s", self.replaying_path)
+                    sink.log_many([result for result, _ in records], [when for _, when in records])
+                    offset = f.tell()
+                    with open(self.offset_path, 'w', encoding='utf-8') as out:
+                        out.write(str(offset))
+                    replayed += len(records)
+                    REPLAYED.inc(len(records))
+            os.remove(self.replaying_path)
+            if os.path.exists(self.offset_path):
+                os.remove(self.offset_path)
+
+
+class ResilientSink(NullSink):
+    def __init__(self, sink, journal, breaker=None):
+        self.sink = sink
+        self.journal = journal
+        self.breaker = breaker or CircuitBreaker(type(sink).__name__, probe_in_background=True)
+        self._recovery_lock = threading.Lock()
+
+    # The wrapped sink's own extras (record_feedback, ...) stay available
+    def __getattr__(self, name):
+        if name == 'sink':
+            raise AttributeError(name)
+        return getattr(self.sink, name)
+
+    def _spill(self, result, when=None):
+        self.journal.append(result, when)
+        SPILLED.inc(sink=self.breaker.name)
+
+    # Function to replay the journal into the wrapped sink now; returns how
+    # many results were replayed
+    def replay(self):
+        return self.journal.replay(_ReplayTarget(self.sink, self.breaker))
+
+    # Function to wait out the breaker's window, probe, and replay the journal
+    # until the database is back and nothing is pending
+    def _recover(self):
+        while self.breaker.is_open or self.journal.pending():
+            time.sleep(max(self.breaker.retry_in(), 0.05))
+            try:
+                if self.breaker.is_open:
+                    self.breaker.call(self.sink.ping, probe=True)
+            except Exception:
+                continue  # still down; the window has grown
+            try:
+                self.replay()
+            except Exception as error:
+                logger.warning("Replaying %s stopped: %s", self.journal.path, error)
+                if not self.breaker.is_open:
+                    time.sleep(self.breaker.reset_timeout)
+
+    # Function to start recovering in the background, in one thread at a time
+    def _recover_in_background(self):
+        if not (self.breaker.is_open or self.journal.pending()):
+            return
+        if not self._recovery_lock.acquire(blocking=False):
+            return
+
+        def recover():
+            try:
+                self._recover()
+            finally:
+                self._recovery_lock.release()
+        threading.Thread(target=recover, name='spill-replay', daemon=True).start()
+
+    def log(self, result):
+        try:
+            self.breaker.call(self.sink.log, result)
+        except Exception as error:
+            self._spill(result)
+            if not isinstance(error, CircuitOpenError):
+                logger.warning("Spilled a result to %s: %s", self.journal.path, error)
+        self._recover_in_background()
+
+    def log_many(self, results, times=None):
+        try:
+            self.breaker.call(self.sink.log_many, results, times)
+        except Exception as error:
+            for result, when in zip(results, times or [None] * len(results)):
+                self._spill(result, when)
+            if not isinstance(error, CircuitOpenError):
+                logger.warning("Spilled %d results to %s: %s", len(results), self.journal.path, error)
+        self._recover_in_background()
+
+    def log_error(self, error_message):
+        try:
+            self.breaker.call(self.sink.log_error, error_message)
+        except Exception:
+            self._recover_in_background()
+
+    def recent(self, limit=5):
+        try:
+            return self.breaker.call(self.sink.recent, limit)
+        except CircuitOpenError:
+            self._recover_in_background()
+            return None
+
+    def spam_count(self):
+        try:
+            return self.breaker.call(self.sink.spam_count)
+        except CircuitOpenError:
+            self._recover_in_background()
+            return None
+
+    def lookup_spam(self, transformed):
+        try:
+            return self.breaker.call(self.sink.lookup_spam, transformed)
+        except Exception:
+            self._recover_in_background()
+            return False
+
+    def close(self):
+        self.sink.close()
+
+
+def journal_path(spill_dir, name):
+    return os.path.join(spill_dir, f"{name}.jsonl")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Inspect and replay the database spill journals.")
+    parser.add_argument('command', choices=['status', 'replay'])
+    parser.add_argument('--preset', help="App preset whose sinks to replay into (default: SPAM_PRESET)")
+    return parser
+
+
+def main(argv=None):
+    from .config import load_config
+
+    args = build_parser().parse_args(argv)
+    config = load_config(args.preset)
+    spill_dir = config['spill_dir']
+    names = set()
+    for file_name in os.listdir(spill_dir) if os.path.isdir(spill_dir) else []:
+        for suffix in ('.jsonl', '.jsonl.replaying'):
+            if file_name.endswith(suffix):
+                names.add(file_name[:-len(suffix)])
+    names = sorted(names)
+    if args.command == 'status':
+        for name in names:
+            print(f"{name}: {SpillJournal(journal_path(spill_dir, name)).size()} bytes pending")
+        if not names:
+            print("No spilled results")
+        return 0
+
+    from .sinks import make_sink
+
+    sink = make_sink(dict(config, sinks=[name for name in config['sinks'] if name in names], dashboard=False))
+    sinks = getattr(sink, 'sinks', [sink])
+    for wrapped in sinks:
+        if isinstance(wrapped, ResilientSink):
+            count = wrapped.replay()
+            print(f"{wrapped.journal.path}: replayed {count} results")
+    sink.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+# A two-level verdict cache shared between processes.
+#
+# Streamlit sessions share one engine, but API workers, ingestion pool
+# workers and separate app processes each score the same messages again. A
+# VerdictCache sits in front of transform_text and the model:
+#
+#   level 1  an LRU dict in the process
+#   level 2  a shared backend, looked up on a level-1 miss:
+#              MemoryBackend  - in-process store with the same interface (for
+#                               tests and single-process use)
+#              SocketBackend  - client of a cache server on a local socket,
+#                               shared by every process on the machine
+#
+# Keys are 16-byte hashes of the model version (a digest of the loaded
+# vectorizer.pkl and model.pkl) and the normalised message, so retraining
+# makes old verdicts unreachable instead of wrong. Values are the prediction,
+# the confidence and the transformed text.
+#
+# The shared tier is best effort. A slow or missing server counts as a miss;
+# after repeated failures a CircuitBreaker stops asking it for a while, so
+# scoring never waits on it.
+#
+# The server has no authentication: anyone who can connect can read verdicts
+# and store forged ones. It therefore only listens on loopback addresses.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.sharedcache serve --port 9300 --max-items 1000000
+#     python -m spamfilter.sharedcache stats --port 9300
+# then run the app with SPAM_VERDICT_CACHE=1 SPAM_SHARED_CACHE=127.0.0.1:9300.
+
+import argparse
+import hashlib
+import ipaddress
+import json
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import OrderedDict
+
+from .metrics import REGISTRY
+from .preprocessing import normalize_message
+
+LOOKUPS = REGISTRY.counter('spam_verdict_cache_lookups_total', 'Verdict cache lookups by outcome')
+
+KEY_SIZE = 16
+_VALUE = struct.Struct('<bf')
+_COUNT = struct.Struct('<I')
+_LENGTH = struct.Struct('<i')
+
+
+# Function to build the cache key of a message for a model version
+def verdict_key(model_version, message):
+    return hashlib.blake2b(f"{model_version}\x00{normalize_message(message)}".encode('utf-8'),
+                           digest_size=KEY_SIZE).digest()
+
+
+def encode_verdict(prediction, confidence, transformed):
+    return _VALUE.pack(prediction, confidence) + (transformed or '').encode('utf-8')
+
+
+def decode_verdict(value):
+    prediction, confidence = _VALUE.unpack_from(value)
+    return prediction, confidence, value[_VALUE.size:].decode('utf-8')
+
+
+# A thread-safe LRU of bytes -> bytes, the store behind both backends
+class LRUStore:
+    def __init__(self, max_items=100000):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._items.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._items.move_to_end(key)
+                values.append(value)
+        return values
+
+    def set_many(self, items):
+        with self._lock:
+            for key, value in items:
+                self._items[key] = value
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        return {'items': len(self._items), 'max_items': self.max_items, 'hits': self.hits, 'misses': self.misses}
+
+
+# The in-process fake of a shared backend
+class MemoryBackend:
+    def __init__(self, max_items=100000):
+        self.store = LRUStore(max_items)
+
+    def get_many(self, keys):
+        return self.store.get_many(keys)
+
+    def set_many(self, items):
+        self.store.set_many(items)
+
+    def stats(self):
+        return self.store.stats()
+
+    def close(self):
+        pass
+
+
+# Wire format, all integers little-endian:
+#   get:   b'G' count (key)*            -> (length value | -1)*
+#   set:   b'S' count (key length value)* -> b'K'
+#   stats: b'I'                          -> length JSON
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ConnectionError("connection closed")
+    return data
+
+
+class _CacheHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            op = self.rfile.read(1)
+            if not op:
+                return
+            if op == b'I':
+                body = json.dumps(store.stats()).encode('utf-8')
+                self.wfile.write(_LENGTH.pack(len(body)) + body)
+                continue
+            (count,) = _COUNT.unpack(_read_exactly(self.rfile, _COUNT.size))
+            if op == b'G':
+                keys = [_read_exactly(self.rfile, KEY_SIZE) for _ in range(count)]
+                self.wfile.write(b''.join(_LENGTH.pack(-1) if value is None else _LENGTH.pack(len(value)) + value
+                                          for value in store.get_many(keys)))
+            elif op == b'S':
+                items = []
+                for _ in range(count):
+                    key = _read_exactly(self.rfile, KEY_SIZE)
+                    (length,) = _LENGTH.unpack(_read_exactly(self.rfile, _LENGTH.size))
+                    items.append((key, _read_exactly(self.rfile, length)))
+                store.set_many(items)
+                self.wfile.write(b'K')
+            else:
+                return
+            self.wfile.flush()
+
+
+# Function to check that every address a host name resolves to is loopback
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split('%')[0]).is_loopback
+                                   for address in addresses)
+
+
+class CacheServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=9300, max_items=1000000):
+        if not is_loopback(host):
+            raise ValueError(f"Refusing to serve the verdict cache on {host!r}: it has no authentication, "
+                             f"so it only listens on loopback addresses")
+        self.store = LRUStore(max_items)
+        super().__init__((host, port), _CacheHandler)
+
+
+# Function to run a cache server in a background thread (e.g. next to the app)
+def start_server(host='127.0.0.1', port=9300, max_items=1000000):
+    server = CacheServer(host, port, max_items)
+    threading.Thread(target=server.serve_forever, name='verdict-cache-server', daemon=True).start()
+    return server
+
+
+# Client of a CacheServer; one connection per thread
+class SocketBackend:
+    def __init__(self, host='127.0.0.1', port=9300, timeout=0.05):
+        from .resilience import CircuitBreaker
+
+        self.address = (host, port)
+        self.timeout = timeout
+        self.breaker = CircuitBreaker('shared_cache', failure_threshold=3, reset_timeout=5.0)
+        self._local = threading.local()
+
+    @classmethod
+    def from_address(cls, address, **options):
+        host, _, port = address.rpartition(':')
+        return cls(host or '127.0.0.1', int(port), **options)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = self._local.connection = (sock, sock.makefile('rb'))
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def _request(self, payload, read_reply):
+        def exchange():
+            try:
+                sock, reader = self._connection()
+                sock.sendall(payload)
+                return read_reply(reader)
+            except Exception:
+                self._drop_connection()
+                raise
+        return self.breaker.call(exchange)
+
+    def get_many(self, keys):
+        def read_reply(reader):
+            values = []
+            for _ in keys:
+                (length,) = _LENGTH.unpack(_read_exactly(reader, _LENGTH.size))
+                values.append(None if length < 0 else _read_exactly(reader, length))
+            return values
+        try:
+            return self._request(b'G' + _COUNT.pack(len(keys)) + b''.join(keys), read_reply)
+        except Exception:
+            return [None] * len(keys)
+
+    def set_many(self, items):
+        payload = b'S' + _COUNT.pack(len(items)) + b''.join(
+            key + _LENGTH.pack(len(value)) + value for key, value in items)
+        try:
+            self._request(payload, lambda reader: _read_exactly(reader, 1))
+        except Exception:
+            pass
+
+    def stats(self):
+        def read_reply(reader):
+            (length,) = _LENGTH.unpack(_read_exactly(reader, _LENGTH.size))
+            return json.loads(_read_exactly(reader, length))
+        return self._request(b'I', read_reply)
+
+    def close(self):
+        self._drop_connection()
+
+
+# Function to build a shared backend from a configuration value: 'memory'
+# or 'host:port'
+def make_backend(address):
+    if address == 'memory':
+        return MemoryBackend()
+    return SocketBackend.from_address(address)
+
+
+class VerdictCache:
+    # local_size: entries in the in-process LRU. shared: a backend, or None
+    # for the local level only.
+    def __init__(self, model_version, local_size=10000, shared=None):
+        self.model_version = model_version
+        self.local = LRUStore(local_size)
+        self.shared = shared
+
+    # Function to look verdicts up; returns one (prediction, confidence,
+    # transformed, level) per message, None for misses. Shared hits are
+    # copied into the local level.
+    def get_many(self, messages):
+        keys = [verdict_key(self.model_version, message) for message in messages]
+        values = self.local.get_many(keys)
+        found = [None if value is None else (*decode_verdict(value), 'verdict-cache') for value in values]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.shared is not None:
+            shared_values = self.shared.get_many([keys[i] for i in missing])
+            hits = []
+            for i, value in zip(missing, shared_values):
+                if value is not None:
+                    found[i] = (*decode_verdict(value), 'shared-cache')
+                    hits.append((keys[i], value))
+            self.local.set_many(hits)
+        for verdict in found:
+            LOOKUPS.inc(outcome=verdict[3] if verdict else 'miss')
+        return found
+
+    def get(self, message):
+        return self.get_many([message])[0]
+
+    # Function to store model verdicts in both levels
+    def put_many(self, results):
+        items = [(verdict_key(self.model_version, result.message),
+                  encode_verdict(result.prediction, result.confidence, result.transformed))
+                 for result in results]
+        self.local.set_many(items)
+        if self.shared is not None:
+            self.shared.set_many(items)
+
+    def put(self, result):
+        self.put_many([result])
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run or inspect the shared verdict cache server.")
+    parser.add_argument('command', choices=['serve', 'stats'])
+    parser.add_argument('--host', default='127.0.0.1', help="A loopback address (the server has no authentication)")
+    parser.add_argument('--port', type=int, default=9300)
+    parser.add_argument('--max-items', type=int, default=1000000)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'stats':
+        print(json.dumps(SocketBackend(args.host, args.port, timeout=2.0).stats(), indent=2))
+        return 0
+    if not is_loopback(args.host):
+        parser.error(f"--host {args.host} is not a loopback address; the cache server has no authentication")
+    server = CacheServer(args.host, args.port, args.max_items)
+    print(f"Verdict cache listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,413 @@
+# Where classification results are logged. Each of the original app scripts
+# had its own strategy; they are all sinks here, chosen by configuration:
+#
+#   none        - NullSink
+#   file        - FileSink, a text log (apps.py / n.py format)
+#   sqlite      - SQLiteSink, sms_classification_logs in a local SQLite file
+#   mysql       - MySQLLogSink, sms_classification_logs + error_logs (ap.py, app.py)
+#   mysql-multi - MySQLMultiTableSink, ClassifiedSMS, SpamRepository,
+#                 PredictedMessages and MessagesClassifiedValues (n.py, new.py, newapp.py)
+#   repository  - SpamRepositorySink, SpamRepository with lookup and feedback (mysmsapps.py)
+#   partitioned - logstore.PartitionedLogSink: deduplicated texts, daily partitioned
+#                 events and rollups in the logs database (partitioned-sqlite: in
+#                 the SQLite file)
+#
+# MySQL-backed sinks are wrapped in a resilience.ResilientSink (circuit breaker
+# and spill journal) unless SPAM_DB_RESILIENCE=0.
+# With the dashboard enabled, the sink(s) are wrapped in a stats.StatsSink.
+#
+# Sinks raise on failure; the engine turns that into an error message for the UI.
+# recent() and spam_count() return None when a sink cannot answer them.
+
+from datetime import datetime
+
+from .db import LOGS_DB, SPAM_REPOSITORY_DB, connect_to_db
+from .metrics import timed
+
+# Sinks that talk to MySQL and get a circuit breaker and spill journal
+DATABASE_SINKS = ('mysql', 'mysql-multi', 'repository', 'partitioned')
+MULTI_TABLES = ('ClassifiedSMS', 'SpamRepository', 'PredictedMessages', 'MessagesClassifiedValues')
+
+
+def _timestamp():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class NullSink:
+    def log(self, result):
+        pass
+
+    def log_error(self, error_message):
+        pass
+
+    # Function to log several results, e.g. when a spill journal is replayed;
+    # sinks that store a time override it to keep the original times
+    def log_many(self, results, times=None):
+        for result in results:
+            self.log(result)
+
+    def recent(self, limit=5):
+        return None
+
+    def spam_count(self):
+        return None
+
+    def lookup_spam(self, transformed):
+        return False
+
+    # Function to check that the storage answers, with one cheap round trip;
+    # resilience probes with it before replaying into the sink
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    def __init__(self, path='classification_log.txt', detailed=False):
+        self.path = path
+        self.detailed = detailed
+
+    @timed('file_log')
+    def log(self, result):
+        if self.detailed:  # n.py's format
+            entry = (f"{datetime.now()} - Message: '{result.message}' | Transformed: '{result.transformed}' | "
+                     f"Prediction: {result.label} | Confidence: {result.confidence:.2f}%\n")
+        else:  # apps.py's format
+            entry = (f"{_timestamp()} | Message: '{result.message}' | Prediction: {result.label} | "
+                     f"Confidence: {result.confidence:.2f}%\n")
+        with open(self.path, 'a') as log_file:
+            log_file.write(entry)
+
+
+class SQLiteSink(NullSink):
+    def __init__(self, path='spam_logs.db'):
+        import sqlite3
+        import threading
+
+        self.path = path
+        # Streamlit runs each session in its own thread, so share one
+        # connection between them behind a lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sms_classification_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sms_message TEXT NOT NULL,
+                prediction TEXT NOT NULL,
+                confidence REAL,
+                classification_time TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_logs_time ON sms_classification_logs (classification_time);
+            CREATE TABLE IF NOT EXISTS error_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                error_message TEXT,
+                error_time TEXT
+            );
+        """)
+
+    @timed('db_log')
+    def log(self, result):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time) "
+                "VALUES (?, ?, ?, ?)", (result.message, result.label, result.confidence, _timestamp()))
+
+    @timed('db_log')
+    def log_many(self, results, times=None):
+        times = times or [datetime.now()] * len(results)
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time) "
+                "VALUES (?, ?, ?, ?)", [(result.message, result.label, result.confidence,
+                                         when.strftime('%Y-%m-%d %H:%M:%S')) for result, when in zip(results, times)])
+
+    def log_error(self, error_message):
+        with self._lock, self.connection:
+            self.connection.execute("INSERT INTO error_logs (error_message, error_time) VALUES (?, ?)",
+                                    (error_message, _timestamp()))
+
+    @timed('db_recent_logs')
+    def recent(self, limit=5):
+        with self._lock:
+            return self.connection.execute("""
+                SELECT sms_message, prediction, confidence, classification_time
+                FROM sms_classification_logs
+                ORDER BY classification_time DESC, id DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
+
+    @timed('db_spam_count')
+    def spam_count(self):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM sms_classification_logs WHERE prediction = 'Spam'").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+# Runs one statement on a fresh connection, as the apps did
+def _execute(database, query, params=(), fetch=None):
+    connection = connect_to_db(database)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        if fetch == 'one':
+            result = cursor.fetchone()
+        elif fetch == 'all':
+            result = cursor.fetchall()
+        else:
+            connection.commit()
+            result = None
+        cursor.close()
+        return result
+    finally:
+        connection.close()
+
+
+# Runs one statement for many rows in a single transaction
+def _execute_many(database, query, rows):
+    connection = connect_to_db(database)
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(query, rows)
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+class MySQLLogSink(NullSink):
+    def __init__(self, database=LOGS_DB):
+        self.database = database
+
+    @timed('db_log')
+    def log(self, result):
+        _execute(self.database, """
+            INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time)
+            VALUES (%s, %s, %s, %s)
+        """, (result.message, result.label, result.confidence, _timestamp()))
+
+    @timed('db_log')
+    def log_many(self, results, times=None):
+        times = times or [datetime.now()] * len(results)
+        _execute_many(self.database, """
+            INSERT INTO sms_classification_logs (sms_message, prediction, confidence, classification_time)
+            VALUES (%s, %s, %s, %s)
+        """, [(result.message, result.label, result.confidence, when.strftime('%Y-%m-%d %H:%M:%S'))
+              for result, when in zip(results, times)])
+
+    @timed('db_log_error')
+    def log_error(self, error_message):
+        _execute(self.database, "INSERT INTO error_logs (error_message, error_time) VALUES (%s, %s)",
+                 (error_message, datetime.now()))
+
+    @timed('db_recent_logs')
+    def recent(self, limit=5):
+        return _execute(self.database, """
+            SELECT sms_message, prediction, confidence, classification_time
+            FROM sms_classification_logs
+            ORDER BY classification_time DESC
+            LIMIT %s
+        """, (limit,), fetch='all')
+
+    @timed('db_spam_count')
+    def spam_count(self):
+        return _execute(self.database,
+                        "SELECT COUNT(*) FROM sms_classification_logs WHERE prediction = 'Spam'",
+                        fetch='one')[0]
+
+    def ping(self):
+        _execute(self.database, "SELECT 1", fetch='one')
+
+
+class MySQLMultiTableSink(NullSink):
+    # database: one database for all four tables (SMSClassifierDB, as in n.py
+    # and new.py), or None for one database per table as in newapp.py.
+    # spam_only: only spam goes into SpamRepository (new.py, newapp.py).
+    def __init__(self, database='SMSClassifierDB', spam_only=True):
+        self.databases = {table: database or f'{table}DB' for table in MULTI_TABLES}
+        self.spam_only = spam_only
+
+    def _connections(self):
+        connections = {}
+        try:
+            for database in set(self.databases.values()):
+                connections[database] = connect_to_db(database)
+        except Exception:
+            for connection in connections.values():
+                connection.close()
+            raise
+        return connections
+
+    @timed('db_log')
+    def log(self, result):
+        now = datetime.now()
+        statements = []
+        if result.prediction == 1 or not self.spam_only:
+            statements.append(('SpamRepository',
+                               "INSERT INTO SpamRepository (MessageText, SpamLabel, DateAdded) VALUES (%s, %s, %s)",
+                               (result.message, result.prediction == 1, now)))
+        statements.append(('PredictedMessages',
+                           "INSERT INTO PredictedMessages (MessageText, Prediction, Confidence, DatePredicted) "
+                           "VALUES (%s, %s, %s, %s)", (result.message, result.label, result.confidence, now)))
+        transformed = result.transformed
+        if transformed is None:  # decided by the cascade, which skips transform_text
+            from .preprocessing import transform_text
+
+            transformed = transform_text(result.message)
+        statements.append(('ClassifiedSMS',
+                           "INSERT INTO ClassifiedSMS (MessageText, TransformedText, Prediction) VALUES (%s, %s, %s)",
+                           (result.message, transformed, result.label)))
+        statements.append(('MessagesClassifiedValues',
+                           "INSERT INTO MessagesClassifiedValues (MessageText, ClassifiedValue, DateClassified) "
+                           "VALUES (%s, %s, %s)", (result.message, int(result.prediction), now)))
+
+        # One connection and one commit per database instead of per statement
+        connections = self._connections()
+        try:
+            for table, query, params in statements:
+                cursor = connections[self.databases[table]].cursor()
+                cursor.execute(query, params)
+                cursor.close()
+            for connection in connections.values():
+                connection.commit()
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    def ping(self):
+        for connection in self._connections().values():
+            connection.close()
+
+
+class SpamRepositorySink(NullSink):
+    def __init__(self, database=SPAM_REPOSITORY_DB):
+        self.database = database
+
+    @timed('db_log')
+    def log(self, result):
+        _execute(self.database, """
+            INSERT INTO SpamRepository (MessageText, SpamLabel, DateAdded, MessageType)
+            VALUES (%s, %s, %s, %s)
+        """, (result.message, result.prediction == 1, datetime.now(),
+              'Detected Spam' if result.prediction == 1 else 'Not Spam'))
+
+    @timed('db_log')
+    def log_many(self, results, times=None):
+        times = times or [datetime.now()] * len(results)
+        _execute_many(self.database, """
+            INSERT INTO SpamRepository (MessageText, SpamLabel, DateAdded, MessageType)
+            VALUES (%s, %s, %s, %s)
+        """, [(result.message, result.prediction == 1, when, 'Detected Spam' if result.prediction == 1 else 'Not Spam')
+              for result, when in zip(results, times)])
+
+    # mysmsapps.py looks the preprocessed text up before running the model
+    @timed('db_lookup')
+    def lookup_spam(self, transformed):
+        count = _execute(self.database, """
+            SELECT COUNT(*) FROM SpamRepository
+            WHERE MessageText = %s AND SpamLabel = 1
+        """, (transformed,), fetch='one')[0]
+        return count > 0
+
+    def ping(self):
+        _execute(self.database, "SELECT 1", fetch='one')
+
+    def record_feedback(self, message, is_spam):
+        from .feedback import record_feedback
+
+        connection = connect_to_db(self.database)
+        try:
+            record_feedback(connection, message, is_spam)
+        finally:
+            connection.close()
+
+
+class CompositeSink(NullSink):
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def log(self, result):
+        errors = []
+        for sink in self.sinks:
+            try:
+                sink.log(result)
+            except Exception as error:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+    def log_many(self, results, times=None):
+        errors = []
+        for sink in self.sinks:
+            try:
+                sink.log_many(results, times)
+            except Exception as error:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+    def log_error(self, error_message):
+        for sink in self.sinks:
+            sink.log_error(error_message)
+
+    def _first(self, method, *args):
+        for sink in self.sinks:
+            value = getattr(sink, method)(*args)
+            if value is not None:
+                return value
+        return None
+
+    def recent(self, limit=5):
+        return self._first('recent', limit)
+
+    def spam_count(self):
+        return self._first('spam_count')
+
+    def lookup_spam(self, transformed):
+        return any(sink.lookup_spam(transformed) for sink in self.sinks)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# Function to build the sink(s) named in a configuration
+def make_sink(config):
+    sinks = []
+    for name in config['sinks']:
+        if name == 'none':
+            continue
+        if name == 'file':
+            sink = FileSink(config['log_file'], detailed=config['log_format'] == 'detailed')
+        elif name == 'sqlite':
+            sink = SQLiteSink(config['sqlite_path'])
+        elif name == 'mysql':
+            sink = MySQLLogSink(config['logs_database'])
+        elif name == 'mysql-multi':
+            sink = MySQLMultiTableSink(config['multi_database'], config['repository_spam_only'])
+        elif name == 'repository':
+            sink = SpamRepositorySink(config['repository_database'])
+        elif name in ('partitioned', 'partitioned-sqlite'):
+            from .logstore import LogStore, PartitionedLogSink
+
+            store = (LogStore.mysql(config['logs_database']) if name == 'partitioned'
+                     else LogStore.sqlite(config['sqlite_path']))
+            sink = PartitionedLogSink(store)
+        else:
+            raise ValueError(f"Unknown sink: {name!r}")
+        if name in DATABASE_SINKS and config.get('db_resilience'):
+            from .resilience import CircuitBreaker, ResilientSink, SpillJournal, journal_path
+
+            sink = ResilientSink(sink, SpillJournal(journal_path(config['spill_dir'], name)),
+                                 CircuitBreaker(name, probe_in_background=True))
+        sinks.append(sink)
+    sink = NullSink() if not sinks else sinks[0] if len(sinks) == 1 else CompositeSink(sinks)
+    if config.get('dashboard'):
+        from .stats import StatsSink
+
+        sink = StatsSink(sink)
+    return sink
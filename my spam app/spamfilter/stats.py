@@ -0,0 +1,230 @@
+# Rolling dashboard statistics, maintained as results are logged.
+#
+# StatsSink wraps the configured sink. Every result it logs also updates, in
+# constant time, a set of in-memory aggregates:
+#
+#   - messages and spam per minute (last 60 minutes) and per hour (last 48 hours)
+#   - confidence histograms (10% buckets) for spam and for ham
+#   - the most frequent stemmed tokens in spam
+#   - the most repeated messages
+#   - the last 50 results, and running totals
+#
+# recent() and spam_count() are answered from memory as well. Other processes
+# (more app instances, spamfilter.ingest) log to the same database, so every
+# REFRESH_SECONDS the first caller asks the wrapped sink again and takes its
+# answer; in between, results logged here are added on top. Both can therefore
+# miss other processes' results for up to REFRESH_SECONDS. The aggregates
+# above only ever cover this process. The
+# token and message counters are bounded: when one outgrows its capacity, only
+# its most frequent half is kept, so rare entries are forgotten, not frequent
+# ones. Reads cost the same however much has been logged.
+#
+# Enable it with SPAM_DASHBOARD=1. The page then shows a Dashboard section,
+# and with SPAM_STATS_PORT=9109 the same snapshot is served as JSON at
+# http://127.0.0.1:9109/stats.
+
+import json
+import threading
+import time
+from collections import Counter, deque
+
+from .preprocessing import message_hash
+from .sinks import NullSink
+
+CONFIDENCE_BUCKETS = 10
+REFRESH_SECONDS = 30
+
+
+# Counts (messages, spam) in a ring of fixed-width time slots
+class _Window:
+    def __init__(self, slot_seconds, slots):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self._ids = [None] * slots
+        self._messages = [0] * slots
+        self._spam = [0] * slots
+
+    def add(self, when, spam):
+        slot = int(when // self.slot_seconds)
+        i = slot % self.slots
+        if self._ids[i] != slot:
+            self._ids[i], self._messages[i], self._spam[i] = slot, 0, 0
+        self._messages[i] += 1
+        self._spam[i] += spam
+
+    # Oldest first: [(slot start as epoch seconds, messages, spam)]
+    def series(self, now):
+        last = int(now // self.slot_seconds)
+        series = []
+        for slot in range(last - self.slots + 1, last + 1):
+            i = slot % self.slots
+            fresh = self._ids[i] == slot
+            series.append((slot * self.slot_seconds, self._messages[i] if fresh else 0,
+                           self._spam[i] if fresh else 0))
+        return series
+
+
+# A Counter that keeps its most frequent half when it outgrows capacity
+class _BoundedCounter:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = Counter()
+
+    def update(self, keys):
+        self.counts.update(keys)
+        if len(self.counts) > self.capacity:
+            self.counts = Counter(dict(self.counts.most_common(self.capacity // 2)))
+
+    def top(self, n):
+        return self.counts.most_common(n)
+
+
+class StatsSink(NullSink):
+    def __init__(self, sink=None, recent_size=50, token_capacity=5000, message_capacity=5000,
+                 refresh_seconds=REFRESH_SECONDS):
+        self.sink = sink if sink is not None else NullSink()
+        self._lock = threading.Lock()
+        self._minutes = _Window(60, 60)
+        self._hours = _Window(3600, 48)
+        self._confidence = {0: [0] * CONFIDENCE_BUCKETS, 1: [0] * CONFIDENCE_BUCKETS}
+        self._tokens = _BoundedCounter(token_capacity)
+        self._messages = _BoundedCounter(message_capacity)
+        self._texts = {}
+        self._recent = deque(maxlen=recent_size)
+        self.total = 0
+        self.spam = 0
+        self.refresh_seconds = refresh_seconds
+        self._refreshed = None
+        self._refresh_lock = threading.Lock()
+        self._spam_offset = 0
+
+    # The wrapped sink's own extras (record_feedback, ...) stay available
+    def __getattr__(self, name):
+        if name == 'sink':
+            raise AttributeError(name)
+        return getattr(self.sink, name)
+
+    # Function to take the spam count and recent rows from the wrapped sink
+    # again once they are REFRESH_SECONDS old. The results logged here so far
+    # are in the wrapped sink as well, so they are not counted twice. While
+    # one caller queries the sink, the others keep reading the old values.
+    def _refresh(self):
+        now = time.monotonic()
+        if self._refreshed is not None and now - self._refreshed < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            count = self.sink.spam_count()
+            rows = self.sink.recent(self._recent.maxlen)
+            with self._lock:
+                # None: the sink cannot answer, so memory is all there is
+                if count is not None:
+                    self._spam_offset = max(count - self.spam, 0)
+                if rows is not None:
+                    self._recent.clear()
+                    self._recent.extend(tuple(row) for row in reversed(rows))
+                self._refreshed = now
+        finally:
+            self._refresh_lock.release()
+
+    def observe(self, result, when=None):
+        when = time.time() if when is None else when
+        spam = int(result.prediction == 1)
+        bucket = min(int(result.confidence // (100 / CONFIDENCE_BUCKETS)), CONFIDENCE_BUCKETS - 1)
+        key = message_hash(result.message)
+        row = (result.message, result.label, result.confidence,
+               time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)))
+        with self._lock:
+            self.total += 1
+            self.spam += spam
+            self._minutes.add(when, spam)
+            self._hours.add(when, spam)
+            self._confidence[spam][bucket] += 1
+            if spam and result.transformed:
+                self._tokens.update(set(result.transformed.split()))
+            self._messages.update((key,))
+            if key in self._messages.counts:
+                self._texts[key] = result.message
+            if len(self._texts) > self._messages.capacity:
+                self._texts = {k: v for k, v in self._texts.items() if k in self._messages.counts}
+            self._recent.append(row)
+
+    def log(self, result):
+        self.sink.log(result)
+        self.observe(result)
+
+    def log_many(self, results, times=None):
+        self.sink.log_many(results, times)
+        for result, when in zip(results, times or [None] * len(results)):
+            self.observe(result, None if when is None else when.timestamp())
+
+    def log_error(self, error_message):
+        self.sink.log_error(error_message)
+
+    # Newest first, same shape as the other sinks
+    def recent(self, limit=5):
+        self._refresh()
+        with self._lock:
+            rows = list(self._recent)[-limit:]
+        return rows[::-1]
+
+    def spam_count(self):
+        self._refresh()
+        return self._spam_offset + self.spam
+
+    def lookup_spam(self, transformed):
+        return self.sink.lookup_spam(transformed)
+
+    # Function to read all aggregates at once
+    def snapshot(self, top=10):
+        now = time.time()
+        width = 100 / CONFIDENCE_BUCKETS
+        with self._lock:
+            return {
+                'total': self.total,
+                'spam': self.spam,
+                'per_minute': [{'start': start, 'messages': m, 'spam': s}
+                               for start, m, s in self._minutes.series(now)],
+                'per_hour': [{'start': start, 'messages': m, 'spam': s}
+                             for start, m, s in self._hours.series(now)],
+                'confidence': [{'bucket': f"{i * width:.0f}-{(i + 1) * width:.0f}%",
+                                'spam': self._confidence[1][i], 'ham': self._confidence[0][i]}
+                               for i in range(CONFIDENCE_BUCKETS)],
+                'top_spam_tokens': [{'token': token, 'messages': count}
+                                    for token, count in self._tokens.top(top)],
+                'top_messages': [{'message': self._texts.get(key, ''), 'count': count}
+                                 for key, count in self._messages.top(top)],
+            }
+
+    def close(self):
+        self.sink.close()
+
+
+# Function to serve stats.snapshot() as JSON at http://<host>:<port>/stats
+def start_http_server(stats, port, host='127.0.0.1'):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from .metrics import _start_once
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/stats':
+                self.send_error(404)
+                return
+            body = json.dumps(stats.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    def start():
+        server = ThreadingHTTPServer((host, port), StatsHandler)
+        threading.Thread(target=server.serve_forever, name='stats-http', daemon=True).start()
+        return server
+
+    return _start_once(('stats-http', host, port), start)
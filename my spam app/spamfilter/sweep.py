@@ -0,0 +1,159 @@
+# Hyperparameter sweep over vectorizer and model settings.
+#
+# Usage (from the "my spam app" directory):
+#     python -m spamfilter.sweep --data spam.csv --max-features 3000 5000 0 \
+#         --ngram-max 1 2 --models nb:1.0 nb:0.1 lr ensemble
+#
+# transform_text runs once per dataset and preprocessing version: the result is
+# cached under .corpus_cache/ and reused by every later sweep. The grid then
+# trains in parallel, one configuration per process, and each configuration is
+# scored on accuracy, precision and inference cost (single-message latency,
+# batch throughput, vocabulary and model size) so latency can be part of the
+# choice. Inference is timed afterwards in this process, one configuration at
+# a time, so the other workers do not skew it; train_seconds is measured
+# while they run. --max-features 0 means no limit.
+
+import argparse
+import itertools
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .timing import StageRecorder, latency_percentiles, write_json_report
+from .train import add_data_arguments, load_corpus_cached
+
+CACHE_DIR = '.corpus_cache'
+
+_corpus = None
+_labels = None
+
+
+def _init_worker(corpus, labels):
+    global _corpus, _labels
+    _corpus, _labels = corpus, labels
+
+
+# Function to build a model from a spec such as "nb:0.5", "lr:10" or "ensemble"
+def make_model(spec):
+    name, _, value = spec.partition(':')
+    if name == 'nb':
+        from sklearn.naive_bayes import MultinomialNB
+        return MultinomialNB(alpha=float(value or 1.0))
+    if name == 'lr':
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(C=float(value or 10.0), solver='liblinear')
+    if name == 'ensemble':
+        from .ensemble import LinearEnsemble
+        return LinearEnsemble()
+    raise ValueError(f"Unknown model spec: {spec!r}")
+
+
+# Function to train and score one configuration on the worker's corpus;
+# returns the row, the pickled vectorizer and model, and the test indices
+def evaluate(config):
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics import accuracy_score, precision_score
+    from sklearn.model_selection import train_test_split
+
+    start = time.perf_counter()
+    vectorizer = TfidfVectorizer(max_features=config['max_features'] or None,
+                                 ngram_range=(1, config['ngram_max']))
+    X = vectorizer.fit_transform(_corpus)
+    y = np.asarray(_labels)
+    indices = np.arange(len(_corpus))
+    X_train, X_test, y_train, y_test, _, test_idx = train_test_split(
+        X, y, indices, test_size=0.2, random_state=2)
+    model = make_model(config['model'])
+    model.fit(X_train, y_train)
+    train_seconds = time.perf_counter() - start
+
+    y_pred = model.predict(X_test)
+    vectorizer_pickle, model_pickle = pickle.dumps(vectorizer), pickle.dumps(model)
+    row = {
+        **config,
+        'accuracy': round(accuracy_score(y_test, y_pred), 4),
+        'precision': round(precision_score(y_test, y_pred, zero_division=0), 4),
+        'vocabulary': len(vectorizer.vocabulary_),
+        'artifact_kb': round((len(vectorizer_pickle) + len(model_pickle)) / 1024, 1),
+        'train_seconds': round(train_seconds, 3),
+    }
+    return row, vectorizer_pickle, model_pickle, test_idx.tolist()
+
+
+# Function to time batch and single-message inference of one trained
+# configuration on its test split
+def measure_inference(vectorizer_pickle, model_pickle, test_idx, corpus, latency_runs=300):
+    vectorizer, model = pickle.loads(vectorizer_pickle), pickle.loads(model_pickle)
+    X_test = vectorizer.transform([corpus[i] for i in test_idx])
+
+    start = time.perf_counter()
+    model.predict(X_test)
+    batch_seconds = time.perf_counter() - start
+
+    samples = []
+    for i in test_idx[:latency_runs]:
+        start = time.perf_counter()
+        model.predict_proba(vectorizer.transform([corpus[i]]))
+        samples.append(time.perf_counter() - start)
+
+    return {
+        'batch_messages_per_second': round(X_test.shape[0] / batch_seconds, 1) if batch_seconds else None,
+        **latency_percentiles(samples),
+    }
+
+
+def run(args):
+    recorder = StageRecorder(trace_memory=False)
+    corpus, labels = load_corpus_cached(args, recorder, args.cache_dir)
+
+    grid = [{'max_features': max_features, 'ngram_max': ngram_max, 'model': model}
+            for max_features, ngram_max, model in itertools.product(args.max_features, args.ngram_max, args.models)]
+
+    with recorder.stage('grid'):
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(grid)), initializer=_init_worker,
+                                 initargs=(corpus, labels)) as pool:
+            trained = list(pool.map(evaluate, grid))
+
+    with recorder.stage('inference'):
+        results = [dict(row, **measure_inference(vectorizer_pickle, model_pickle, test_idx, corpus))
+                   for row, vectorizer_pickle, model_pickle, test_idx in trained]
+
+    results.sort(key=lambda r: (-r['precision'], -r['accuracy'], r['p50_ms']))
+    return {'rows': len(corpus), 'results': results, **recorder.to_dict()}, recorder
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sweep vectorizer/model settings on a cached corpus.")
+    add_data_arguments(parser)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--max-features', type=int, nargs='+', default=[3000, 5000])
+    parser.add_argument('--ngram-max', type=int, nargs='+', default=[1])
+    parser.add_argument('--models', nargs='+', default=['nb:1.0', 'lr', 'ensemble'],
+                        help="Model specs: nb[:alpha], lr[:C], ensemble")
+    parser.add_argument('--report', help="Write the results to this JSON file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    for spec in args.models:
+        make_model(spec)  # fail fast on a typo, before preprocessing
+    report, recorder = run(args)
+
+    print(f"{'max_feat':>9}{'ngram':>6}  {'model':<10}{'acc':>8}{'prec':>8}{'vocab':>8}"
+          f"{'KB':>8}{'msg/s':>11}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in report['results']:
+        print(f"{r['max_features'] or 'all':>9}{r['ngram_max']:>6}  {r['model']:<10}{r['accuracy']:>8.4f}"
+              f"{r['precision']:>8.4f}{r['vocabulary']:>8}{r['artifact_kb']:>8.0f}"
+              f"{r['batch_messages_per_second'] or 0:>11.0f}{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}")
+    print(recorder.format_table())
+
+    if args.report:
+        write_json_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import json
+import math
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+# Records wall time and peak memory for each named stage of a job. Entering
+# the same stage again (e.g. once per chunk) adds to its time and keeps the
+# highest peak. Peak memory comes from tracemalloc, which starts with the first
+# stage, so it covers Python and NumPy allocations of this process (not of
+# worker processes) made since then. Pass trace_memory=False to skip it when
+# its overhead matters more than the number.
+class StageRecorder:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._records = {}
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self._records.get(name)
+            if record is None:
+                record = self._records[name] = {'stage': name, 'wall_seconds': 0.0, 'calls': 0}
+                self.stages.append(record)
+            record['wall_seconds'] = round(record['wall_seconds'] + time.perf_counter() - start, 4)
+            record['calls'] += 1
+            if self.trace_memory:
+                peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+                record['peak_traced_mb'] = max(peak, record.get('peak_traced_mb', 0.0))
+            rss = _max_rss_mb()
+            if rss is not None:
+                record['max_rss_mb'] = round(rss, 1)
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def total_seconds(self):
+        return round(sum(stage['wall_seconds'] for stage in self.stages), 4)
+
+    def format_table(self):
+        lines = [f"{'stage':<20}{'wall (s)':>12}{'peak (MB)':>12}{'max RSS (MB)':>14}"]
+        for stage in self.stages:
+            lines.append(f"{stage['stage']:<20}{stage['wall_seconds']:>12.3f}"
+                         f"{stage.get('peak_traced_mb', float('nan')):>12.1f}"
+                         f"{stage.get('max_rss_mb', float('nan')):>14.1f}")
+        lines.append(f"{'total':<20}{self.total_seconds():>12.3f}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {'stages': self.stages, 'total_seconds': self.total_seconds()}
+
+
+# Function to write a report dictionary as JSON
+def write_json_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+# Function to compute latency percentiles (in milliseconds) from seconds
+def latency_percentiles(samples, percentiles=(50, 95, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f'p{p}_ms': None for p in percentiles}
+    result = {}
+    for p in percentiles:
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)  # nearest rank
+        result[f'p{p}_ms'] = round(ordered[index] * 1000, 4)
+    return result
@@ -0,0 +1,318 @@
+# The Streamlit front-end shared by all the app scripts. Which sink results
+# are logged to, and which widgets are shown, comes from spamfilter.config.
+
+import streamlit as st
+
+from . import metrics
+from .config import load_config
+from .datasets import DEFAULT_ENCODING
+from .engine import ClassificationEngine
+from .stats import StatsSink
+from .uploads import ResultWriter, classify_chunks, iter_upload_chunks
+
+UPLOAD_CHUNK_SIZE = 1000
+# The download button reads the results file from disk only when clicked; its
+# label (the number of results so far) is refreshed every this many rows
+DOWNLOAD_REFRESH_ROWS = 10000
+
+HEADER_CSS = """
+    <style>
+    .main-header {
+        font-size:48px;
+        text-align:center;
+        color:white;
+        background-color:#6A5ACD;
+        padding:20px;
+        border-radius:15px;
+    }
+    .input-text-area textarea {
+        padding: 20px;
+        border-radius: 10px;
+        border: 2px solid #6A5ACD;
+        font-size: 16px;
+    }
+    </style>
+"""
+
+
+# One engine per configuration for the whole server, instead of loading the
+# pickles again on every rerun. Loading starts in the background, so the page
+# renders before nltk and scikit-learn are even imported.
+@st.cache_resource(show_spinner=False)
+def get_engine(config_items):
+    engine = ClassificationEngine.from_config(dict(config_items))
+    engine.warm_up()
+    return engine
+
+
+def _config_key(config):
+    return tuple(sorted((key, tuple(value) if isinstance(value, list) else value)
+                        for key, value in config.items()))
+
+
+def render_result(result):
+    if result.source == 'repository':
+        st.markdown(
+            "<div style='text-align: center; color: white; background-color: #FF4B4B; padding: 15px; border-radius: 15px;'>"
+            "<h2>🚨 Spam (Detected from Database) 🚨</h2>"
+            "</div>",
+            unsafe_allow_html=True
+        )
+    elif result.prediction == 1:
+        st.markdown(
+            f"<div style='text-align: center; color: white; background-color: #FF4B4B; padding: 15px; border-radius: 15px;'>"
+            f"<h2>🚨 Spam 🚨</h2>"
+            f"<p>Confidence: {result.confidence:.2f}%</p>"
+            "</div>",
+            unsafe_allow_html=True
+        )
+    else:
+        st.markdown(
+            f"<div style='text-align: center; color: white; background-color: #4CAF50; padding: 10px; border-radius: 10px;'>"
+            f"<h2>✅ Not Spam ✅</h2>"
+            f"<p>Confidence: {result.confidence:.2f}%</p>"
+            "</div>",
+            unsafe_allow_html=True
+        )
+
+
+# Shows the warm-up state in a placeholder, which is returned so it can be
+# cleared once a prediction has waited for the model
+def render_warm_up_status(engine):
+    status = st.empty()
+    if engine.load_error is not None:
+        status.warning(f"The model could not be loaded: {engine.load_error}")
+    elif not engine.loaded:
+        status.info("⏳ Model warming up… you can type your message in the meantime.")
+    return status
+
+
+def render_explanation(engine, result):
+    try:
+        explanation = engine.explain(result)
+    except Exception as e:
+        st.warning(f"Could not explain this prediction: {e}")
+        return
+    direction = "towards Spam" if result.prediction == 1 else "towards Not Spam"
+    if explanation.contributions:
+        st.markdown(f"**Words that pushed the prediction {direction}:**")
+        st.table({'Word (stemmed)': [c.token for c in explanation.contributions],
+                  'Log-odds contribution': [f"{c.weight:+.3f}" for c in explanation.contributions]})
+    else:
+        st.write(f"None of the message's words pushed the prediction {direction}.")
+    st.caption(f"Class prior {explanation.prior:+.3f}, other words {explanation.others:+.3f}: "
+               f"spam log-odds {explanation.log_odds:+.3f} (above 0 means Spam).")
+
+
+def wait_for_model(engine, status=None):
+    if not engine.loaded:
+        with st.spinner("Model warming up…"):
+            engine.wait_until_loaded()
+    if status is not None:
+        status.empty()
+
+
+def render_download(slot, writer, name, finished):
+    label = "Download results ⬇️" if finished else f"Download the results so far ({writer.rows}+) ⬇️"
+    # writer.read_bytes is only called when the button is clicked, so the
+    # page never holds a copy of the file. on_click='ignore': a rerun would
+    # stop the classification in progress.
+    slot.download_button(label, writer.read_bytes, file_name=f"{name}-classified.csv", mime='text/csv',
+                         key=f"upload-download-{writer.rows}-{finished}", on_click='ignore')
+
+
+# Function to delete the results file of this session's previous upload; the
+# latest one is kept so its download button keeps working
+def discard_previous_results():
+    previous = st.session_state.pop('upload_results', None)
+    if previous is not None:
+        previous.close(remove=True)
+
+
+# Upload mode: streams a CSV/TXT export through the batch pipeline, writing
+# results to disk as they come, with progress and a download of the results
+# so far
+def render_upload(engine, status):
+    uploaded = st.file_uploader("Upload a CSV or TXT export", type=['csv', 'txt'])
+    if uploaded is None:
+        return
+    columns = st.columns(2)
+    text_column = columns[0].text_input("Message column (CSV only, blank to detect)", "")
+    encoding = columns[1].selectbox("Encoding", ['utf-8', DEFAULT_ENCODING])
+    if not st.button('Classify file 🚀'):
+        return
+
+    wait_for_model(engine, status)
+    progress = st.progress(0.0, text="Starting…")
+    download_slot = st.empty()
+    errors_slot = st.container()
+    name = uploaded.name.rsplit('.', 1)[0]
+    discard_previous_results()
+    writer = ResultWriter()
+    errors = []
+    try:
+        uploaded.seek(0)
+        chunks = iter_upload_chunks(uploaded, uploaded.name, UPLOAD_CHUNK_SIZE, encoding, text_column or None)
+        refreshed_at = errors_shown = 0
+        for _ in classify_chunks(engine, chunks, writer, errors):
+            fraction = min(uploaded.tell() / max(uploaded.size, 1), 1.0)
+            progress.progress(fraction, text=f"{writer.rows} messages classified, {writer.spam} spam so far")
+            if writer.rows - refreshed_at >= DOWNLOAD_REFRESH_ROWS:
+                render_download(download_slot, writer, name, finished=False)
+                refreshed_at = writer.rows
+            for first_row, count, error in errors[errors_shown:]:
+                errors_slot.error(f"Rows {first_row}-{first_row + count - 1} could not be classified: {error}")
+            errors_shown = len(errors)
+        writer.close()
+        progress.progress(1.0, text=f"Done: {writer.rows} messages classified, {writer.spam} spam"
+                                    + (f", {writer.failed} failed" if writer.failed else ""))
+        render_download(download_slot, writer, name, finished=True)
+        st.session_state['upload_results'] = writer
+    except ValueError as e:
+        st.error(f"Could not read the file: {e}")
+    except FileNotFoundError:
+        st.error("The required files (vectorizer.pkl or model.pkl) were not found. Please ensure they exist in the application directory.")
+    except Exception as e:
+        st.error(f"Classification stopped after {writer.rows} messages: {e}")
+    finally:
+        if st.session_state.get('upload_results') is not writer:
+            writer.close(remove=True)
+
+
+# Single-message mode: the original text area and Predict button
+def render_message(engine, status, explain=False):
+    input_sms = st.text_area(
+        "Enter the message below:",
+        height=150,
+        placeholder="Type your SMS message here...",
+        key="input",
+        help="Type the SMS message you want to classify."
+    )
+
+    show_explanation = explain and st.toggle("Explain the prediction", key="explain")
+
+    if st.button('Predict 🚀'):
+        if input_sms.strip() == "":
+            st.warning("Please enter an SMS message to classify.")
+        else:
+            try:
+                wait_for_model(engine, status)
+                result = engine.classify(input_sms)
+            except FileNotFoundError:
+                st.error("The required files (vectorizer.pkl or model.pkl) were not found. Please ensure they exist in the application directory.")
+            except Exception as e:
+                from sklearn.exceptions import NotFittedError
+
+                if isinstance(e, NotFittedError):
+                    st.error("The model or vectorizer has not been fitted properly. Please check the training process.")
+                    engine.log_error("Model not fitted error.")
+                else:
+                    st.error(f"An error occurred during prediction: {e}")
+                    engine.log_error(f"Prediction error: {e}")
+            else:
+                render_result(result)
+                if show_explanation and result.source != 'repository':
+                    render_explanation(engine, result)
+                if result.source != 'repository':
+                    for error in engine.log(result):
+                        st.error(error)
+                st.session_state['last_prediction'] = (input_sms, result.prediction)
+
+
+def render_feedback(engine):
+    if 'last_prediction' not in st.session_state or not hasattr(engine.sink, 'record_feedback'):
+        return
+    last_message, last_prediction = st.session_state['last_prediction']
+    if st.button('This was wrong 👎'):
+        try:
+            engine.sink.record_feedback(last_message, last_prediction != 1)
+            del st.session_state['last_prediction']
+            st.success("Thanks! Your correction will be used to improve the model.")
+        except Exception as e:
+            st.error(f"Could not save your feedback: {e}")
+
+
+def render_recent(engine):
+    st.markdown("### Recently Classified Messages")
+    try:
+        logs = engine.recent(5)
+    except Exception as e:
+        st.error(f"Failed to retrieve logs: {e}")
+        logs = None
+    if logs:
+        for log in logs:
+            st.write(f"**Message:** {log[0]} | **Prediction:** {log[1]} | **Confidence:** {log[2]:.2f}% | **Time:** {log[3]}")
+    else:
+        st.write("No classification logs available.")
+
+
+# Reads the StatsSink's in-memory aggregates; no database queries
+def render_dashboard(engine):
+    import pandas as pd
+
+    snapshot = engine.sink.snapshot()
+    with st.expander("Dashboard", expanded=True):
+        st.write(f"**Classified since start:** {snapshot['total']} | **Spam:** {snapshot['spam']}")
+        per_minute = pd.DataFrame(snapshot['per_minute'])
+        per_minute['start'] = pd.to_datetime(per_minute['start'], unit='s')
+        st.markdown("#### Last hour")
+        st.line_chart(per_minute, x='start', y=['messages', 'spam'])
+        st.markdown("#### Confidence")
+        st.bar_chart(pd.DataFrame(snapshot['confidence']), x='bucket', y=['spam', 'ham'])
+        left, right = st.columns(2)
+        with left:
+            st.markdown("#### Top spam words")
+            st.table(pd.DataFrame(snapshot['top_spam_tokens'], columns=['token', 'messages']))
+        with right:
+            st.markdown("#### Most repeated messages")
+            st.table(pd.DataFrame(snapshot['top_messages'], columns=['message', 'count']))
+
+
+# Function to render the whole page
+def run_app(preset=None, **overrides):
+    config = load_config(preset, **overrides)
+    metrics.start_from_env()
+    engine = get_engine(_config_key(config))
+    dashboard = isinstance(engine.sink, StatsSink)
+    if dashboard and config['stats_port']:
+        from .stats import start_http_server
+
+        start_http_server(engine.sink, config['stats_port'])
+
+    st.markdown(HEADER_CSS, unsafe_allow_html=True)
+    st.markdown(f'<div class="main-header">{config["title"]}</div>', unsafe_allow_html=True)
+    st.write("<p style='text-align: center;'>Detect whether an SMS message is <strong>Spam</strong> or <strong>Not Spam</strong>.</p>", unsafe_allow_html=True)
+
+    status = render_warm_up_status(engine)
+
+    if config['show_stats']:
+        try:
+            spam_count = engine.spam_count()
+        except Exception as e:
+            st.error(f"Failed to retrieve spam count: {e}")
+            spam_count = None
+        if spam_count is not None:
+            st.markdown(f"### Spam Messages Detected So Far: {spam_count}")
+
+    if config['upload'] and st.radio("Mode", ["Single message", "Upload a file"], horizontal=True,
+                                      label_visibility='collapsed') == "Upload a file":
+        render_upload(engine, status)
+    else:
+        render_message(engine, status, config['explain'])
+
+    if config['feedback']:
+        render_feedback(engine)
+
+    if config['show_stats']:
+        render_recent(engine)
+
+    if dashboard:
+        render_dashboard(engine)
+
+    st.markdown(
+        f"""
+        <hr style='border-top: 3px solid #bbb;'>
+        <p style='text-align: center; color: grey;'>{config['footer']}</p>
+        """,
+        unsafe_allow_html=True
+    )
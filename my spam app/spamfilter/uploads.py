@@ -0,0 +1,132 @@
+# Classifying an uploaded export chunk by chunk: a CSV with a message column,
+# or a plain-text message list such as "SMS MESSAGES.txt". The file is read
+# as a stream and only one chunk of messages is held at a time; results are
+# appended to a CSV on disk as each chunk is scored, so memory stays bounded
+# whatever the size of the file and partial results can be downloaded early
+# (the file is read from disk when the download is requested).
+
+import csv
+import io
+import os
+import tempfile
+
+from .datasets import _NUMBERING, DEFAULT_TEXT_COLUMN
+
+# Tried in order (case-insensitively) when no message column is given
+TEXT_COLUMN_CANDIDATES = (DEFAULT_TEXT_COLUMN, 'message', 'messagetext', 'sms_message', 'sms', 'text')
+RESULT_COLUMNS = ('row', 'message', 'prediction', 'confidence')
+
+
+def _chunked(messages, chunk_size):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Function to pick the message column from a CSV header
+def find_text_column(header, text_column=None):
+    lowered = [name.strip().lower() for name in header]
+    wanted = [text_column] if text_column else TEXT_COLUMN_CANDIDATES
+    for name in wanted:
+        if name.strip().lower() in lowered:
+            return lowered.index(name.strip().lower())
+    if text_column is None and len(header) == 1:
+        return 0
+    raise ValueError(f"No message column {'named ' + repr(text_column) if text_column else 'found'} "
+                     f"in the CSV header {header}")
+
+
+def _iter_csv_messages(stream, text_column=None):
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    index = find_text_column(header, text_column)
+    for row in reader:
+        if len(row) > index and row[index].strip():
+            yield row[index]
+
+
+def _iter_text_messages(stream):
+    for line in stream:
+        text = _NUMBERING.sub('', line.strip())
+        if text:
+            yield text
+
+
+# Function to stream an uploaded file (any binary file object) as lists of at
+# most chunk_size messages. Files ending in .csv are read as CSV, anything
+# else as one message per line.
+def iter_upload_chunks(fileobj, filename, chunk_size=1000, encoding='utf-8', text_column=None):
+    stream = io.TextIOWrapper(fileobj, encoding=encoding, errors='replace', newline='')
+    try:
+        if filename.lower().endswith('.csv'):
+            messages = _iter_csv_messages(stream, text_column)
+        else:
+            messages = _iter_text_messages(stream)
+        yield from _chunked(messages, chunk_size)
+    finally:
+        stream.detach()  # leave the caller's file object open
+
+
+# Appends classification results to a CSV file (a temporary one by default)
+class ResultWriter:
+    def __init__(self, path=None):
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix='spam-results-', suffix='.csv')
+            os.close(handle)
+        self.path = path
+        self.rows = 0
+        self.spam = 0
+        self.failed = 0
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(RESULT_COLUMNS)
+
+    def write(self, results):
+        for result in results:
+            self.rows += 1
+            self.spam += result.prediction == 1
+            self._writer.writerow((self.rows + self.failed, result.message, result.label,
+                                   f"{result.confidence:.2f}"))
+        self._file.flush()
+
+    # Function to leave out `count` input rows that could not be classified,
+    # keeping the row numbers of the ones after them
+    def skip(self, count):
+        self.failed += count
+
+    # Function to read everything written so far, e.g. for a download button
+    def read_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def close(self, remove=False):
+        if not self._file.closed:
+            self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Function to score chunks of messages with the engine's batch path, writing
+# each chunk's results before reading the next; yields the results per chunk.
+# With an `errors` list, a chunk that fails to score is skipped and recorded
+# there as (first row, rows, error) instead of ending the run.
+def classify_chunks(engine, chunks, writer, errors=None):
+    for messages in chunks:
+        try:
+            results = engine.classify_batch(messages)
+        except Exception as error:
+            if errors is None:
+                raise
+            errors.append((writer.rows + writer.failed + 1, len(messages), error))
+            engine.log_error(f"Upload chunk error: {error}")
+            writer.skip(len(messages))
+            results = []
+        writer.write(results)
+        yield results
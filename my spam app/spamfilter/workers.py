@@ -0,0 +1,400 @@
+# Scoring on several cores with a pool of worker processes.
+#
+# One Python process scores on one core: transform_text and most of
+# scikit-learn hold the GIL. A ScoringPool starts N worker processes, each
+# with its own engine (and its own verdict cache), and routes every message to
+# a worker by consistent hashing on its message_hash. The same message always
+# goes to the same worker, so each worker's cache stays warm for its share of
+# the traffic, and when a worker leaves or joins only its share moves.
+#
+# Each worker's engine is built like the parent's (make_worker_engine with
+# the parent's configuration and verdict cache options).
+#
+# A health thread pings every worker every health_interval seconds. A worker
+# that dies, times out or closes its pipe is taken off the ring (its messages
+# move to the neighbouring workers), restarted, and put back once it has
+# loaded. A batch that was on a failing worker is sent again to the new
+# owners. An exception raised while scoring is an error in the batch, not in
+# the worker: it is raised to the caller as WorkerError and the worker stays
+# on the ring. When no worker is left, PoolUnavailable is raised and the
+# engine scores in process.
+#
+# Exposed metrics: spam_scoring_workers_healthy and spam_scoring_worker_restarts_total.
+#
+# Enable it in the app with SPAM_SCORING_WORKERS=4, or benchmark it:
+#     python -m spamfilter.workers --workers 1 2 4
+
+import argparse
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from .metrics import REGISTRY
+from .preprocessing import message_hash
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = REGISTRY.gauge('spam_scoring_workers_healthy', 'Scoring workers on the hash ring')
+RESTARTS = REGISTRY.counter('spam_scoring_worker_restarts_total', 'Scoring workers restarted')
+
+
+# An exception raised by the engine inside a worker; the worker itself is fine
+class WorkerError(RuntimeError):
+    pass
+
+
+# No healthy worker could score the messages
+class PoolUnavailable(RuntimeError):
+    pass
+
+
+# Consistent hash ring: every node owns `replicas` points on a 64-bit circle
+# and a key belongs to the first point at or after its hash
+class HashRing:
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    @property
+    def nodes(self):
+        return set(self._owners)
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("the hash ring is empty")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def _worker_main(connection, model_dir, verdict_cache_size, config=None, verdict_cache_options=None):
+    from .engine import make_worker_engine
+
+    engine = make_worker_engine(model_dir, config, verdict_cache_options)
+    if engine.verdict_cache_options is None and verdict_cache_size:
+        engine.enable_verdict_cache(verdict_cache_size)
+    engine.load()
+    connection.send(('ready', os.getpid()))
+    scored = 0
+    while True:
+        try:
+            op, payload = connection.recv()
+        except EOFError:
+            return
+        if op == 'stop':
+            return
+        try:
+            if op == 'ping':
+                connection.send(('ok', {'pid': os.getpid(), 'scored': scored}))
+            elif op == 'classify':
+                results = engine.classify_batch(payload)
+                scored += len(results)
+                connection.send(('ok', [(r.transformed, r.prediction, r.confidence, r.source) for r in results]))
+            else:
+                connection.send(('error', f"unknown operation {op!r}"))
+        except Exception as error:
+            connection.send(('error', repr(error)))
+
+
+class _Worker:
+    def __init__(self, index, context, model_dir, verdict_cache_size, config=None, verdict_cache_options=None):
+        self.index = index
+        self.context = context
+        self.model_dir = model_dir
+        self.verdict_cache_size = verdict_cache_size
+        self.config = config
+        self.verdict_cache_options = verdict_cache_options
+        self.lock = threading.Lock()
+        self.process = None
+        self.connection = None
+
+    def start(self, timeout):
+        parent, child = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, name=f'scoring-worker-{self.index}',
+                                            args=(child, self.model_dir, self.verdict_cache_size, self.config,
+                                                  self.verdict_cache_options), daemon=True)
+        self.process.start()
+        child.close()
+        self.connection = parent
+        if not parent.poll(timeout):
+            self.kill()
+            raise TimeoutError(f"scoring worker {self.index} did not load within {timeout}s")
+        try:
+            parent.recv()
+        except EOFError:
+            self.kill()
+            raise RuntimeError(f"scoring worker {self.index} exited while loading") from None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, op, payload=None):
+        self.connection.send((op, payload))
+
+    def receive(self, timeout):
+        if not self.connection.poll(timeout):
+            raise TimeoutError(f"scoring worker {self.index} did not answer within {timeout:.1f}s")
+        status, payload = self.connection.recv()  # EOFError when the worker died
+        if status != 'ok':
+            raise WorkerError(f"scoring worker {self.index}: {payload}")
+        return payload
+
+    def kill(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join(5)
+        if self.connection is not None:
+            self.connection.close()
+        self.process = self.connection = None
+
+    def stop(self):
+        try:
+            self.send('stop')
+            self.process.join(5)
+        except Exception:
+            pass
+        self.kill()
+
+
+class ScoringPool:
+    # workers: number of worker processes (default: one per core).
+    # verdict_cache_size: entries in each worker's verdict cache (0: none)
+    # when config and verdict_cache_options do not set one up. config /
+    # verdict_cache_options: as for make_worker_engine.
+    # request_timeout: seconds a worker may take for one batch before it is
+    # treated as hung. load_timeout: seconds a worker may take to start.
+    def __init__(self, model_dir='.', workers=None, verdict_cache_size=10000, replicas=160, request_timeout=30.0,
+                 load_timeout=120.0, health_interval=2.0, config=None, verdict_cache_options=None):
+        self.model_dir = model_dir
+        self.size = workers or os.cpu_count() or 1
+        self.verdict_cache_size = verdict_cache_size
+        self.request_timeout = request_timeout
+        self.load_timeout = load_timeout
+        self.health_interval = health_interval
+        self.ring = HashRing(replicas=replicas)
+        self.restarts = 0
+        context = multiprocessing.get_context('spawn')
+        self.workers = {index: _Worker(index, context, model_dir, verdict_cache_size, config, verdict_cache_options)
+                        for index in range(self.size)}
+        self._ring_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._health_thread = None
+
+    # Function to start the workers (in parallel) and the health checks
+    def start(self):
+        threads = [threading.Thread(target=self._start_worker, args=(worker,)) for worker in self.workers.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not self.ring.nodes:
+            raise RuntimeError("no scoring worker could be started")
+        self._health_thread = threading.Thread(target=self._check_health, name='scoring-health', daemon=True)
+        self._health_thread.start()
+        return self
+
+    def _start_worker(self, worker):
+        try:
+            worker.start(self.load_timeout)
+        except Exception as error:
+            logger.warning("Scoring worker %s failed to start: %s", worker.index, error)
+            return
+        with self._ring_lock:
+            self.ring.add(worker.index)
+            HEALTHY.set(len(self.ring.nodes))
+
+    # Function to take a worker off the ring and kill it; the caller holds
+    # worker.lock, so a restart cannot happen in between and be killed instead
+    def _mark_down(self, worker, reason):
+        logger.warning("Scoring worker %s taken off the ring: %s", worker.index, reason)
+        with self._ring_lock:
+            self.ring.remove(worker.index)
+            HEALTHY.set(len(self.ring.nodes))
+        worker.kill()
+
+    def _check_health(self):
+        while not self._stopped.wait(self.health_interval):
+            for worker in self.workers.values():
+                if self._stopped.is_set():
+                    return
+                on_ring = worker.index in self.ring.nodes
+                if on_ring and worker.alive:
+                    # A busy worker is answering a batch, which is check enough
+                    if not worker.lock.acquire(blocking=False):
+                        continue
+                    try:
+                        worker.send('ping')
+                        worker.receive(min(self.request_timeout, 5.0))
+                        continue
+                    except WorkerError:
+                        continue  # it answered
+                    except Exception as error:
+                        self._mark_down(worker, error)
+                    finally:
+                        worker.lock.release()
+                with worker.lock:
+                    if worker.index in self.ring.nodes:
+                        self._mark_down(worker, "process exited")
+                    self.restarts += 1
+                    RESTARTS.inc()
+                    self._start_worker(worker)
+
+    # Function to score a group of messages on each worker at once; returns
+    # the workers that failed. A WorkerError is raised once the failed
+    # workers are off the ring.
+    def _dispatch(self, groups, messages, results):
+        failed = []
+        errors = []
+        workers = [self.workers[index] for index in sorted(groups)]
+        for worker in workers:  # always locked in index order
+            worker.lock.acquire()
+        try:
+            sent = []
+            for worker in workers:
+                try:
+                    worker.send('classify', [messages[i] for i in groups[worker.index]])
+                    sent.append(worker)
+                except Exception as error:
+                    failed.append((worker, error))
+            deadline = time.monotonic() + self.request_timeout
+            for worker in sent:
+                try:
+                    scored = worker.receive(max(deadline - time.monotonic(), 0.0))
+                except WorkerError as error:
+                    errors.append(error)
+                    continue
+                except Exception as error:
+                    failed.append((worker, error))
+                    continue
+                for i, values in zip(groups[worker.index], scored):
+                    results[i] = values
+            for worker, error in failed:
+                self._mark_down(worker, error)
+        finally:
+            for worker in workers:
+                worker.lock.release()
+        if errors:
+            raise errors[0]
+        return [worker.index for worker, _ in failed]
+
+    # Function to classify messages on the workers; returns Classification
+    # objects in input order
+    def classify_batch(self, messages):
+        from .engine import Classification
+
+        messages = list(messages)
+        results = [None] * len(messages)
+        pending = list(range(len(messages)))
+        for _ in range(3):
+            if not pending:
+                break
+            groups = {}
+            with self._ring_lock:
+                if not self.ring.nodes:
+                    raise PoolUnavailable("no healthy scoring workers")
+                for i in pending:
+                    groups.setdefault(self.ring.node_for(message_hash(messages[i])), []).append(i)
+            failed = self._dispatch(groups, messages, results)
+            pending = [i for index in failed for i in groups[index]]
+        if pending:
+            raise PoolUnavailable(f"{len(pending)} messages could not be scored")
+        return [Classification(message, *values) for message, values in zip(messages, results)]
+
+    def classify(self, message):
+        return self.classify_batch([message])[0]
+
+    def close(self):
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+        for worker in self.workers.values():
+            with worker.lock:
+                worker.stop()
+        HEALTHY.set(0)
+
+
+# Function to time scoring `messages` in batches from `callers` threads
+def _throughput(classify_batch, messages, batch_size, callers):
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    lock = threading.Lock()
+
+    def caller():
+        while True:
+            with lock:
+                if not batches:
+                    return
+                batch = batches.pop()
+            classify_batch(batch)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(messages) / (time.perf_counter() - start)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark scoring throughput with 1..N worker processes.")
+    parser.add_argument('--model-dir', default='.', help="Where vectorizer.pkl and model.pkl live")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--messages', type=int, default=20000, help="Distinct messages per run")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--callers', type=int, default=4, help="Threads submitting batches")
+    return parser
+
+
+def main(argv=None):
+    from .datasets import synthetic_corpus
+    from .engine import ClassificationEngine
+
+    args = build_parser().parse_args(argv)
+    texts, _ = synthetic_corpus(args.messages)
+    # Distinct messages, so the workers' caches do not flatter the numbers
+    messages = [f"{text} ref {i}" for i, text in enumerate(texts)]
+
+    engine = ClassificationEngine(args.model_dir).load()
+    engine.classify_batch(messages[:100])
+    baseline = _throughput(engine.classify_batch, messages, args.batch_size, args.callers)
+    print(f"{'workers':>8}{'msg/s':>10}{'speedup':>9}{'warm msg/s':>12}")
+    print(f"{'in-proc':>8}{baseline:>10.0f}{1.0:>9.2f}{'':>12}")
+    for size in args.workers:
+        pool = ScoringPool(args.model_dir, size).start()
+        try:
+            pool.classify_batch(messages[:100])
+            cold = _throughput(pool.classify_batch, messages, args.batch_size, args.callers)
+            warm = _throughput(pool.classify_batch, messages, args.batch_size, args.callers)
+        finally:
+            pool.close()
+        print(f"{size:>8}{cold:>10.0f}{cold / baseline:>9.2f}{warm:>12.0f}")
+    print(f"\n{os.cpu_count()} cores available")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
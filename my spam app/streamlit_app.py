@@ -0,0 +1,7 @@
+# SMS spam filter front-end. Choose how results are logged with SPAM_PRESET
+# (ap, app, apps, n, new, newapp, mysmsapps, sqlite) and/or SPAM_SINKS
+# (none, file, sqlite, mysql, mysql-multi, repository; comma separated).
+# Run with: streamlit run streamlit_app.py
+from spamfilter.ui import run_app
+
+run_app()
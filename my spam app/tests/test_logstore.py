@@ -0,0 +1,62 @@
+# Run from the "my spam app" directory:
+#     python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from spamfilter.engine import Classification
+from spamfilter.logstore import LogStore, text_hash
+
+
+class RollupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = LogStore.sqlite(os.path.join(self.directory, 'logs.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def log(self, message, prediction, confidence, when):
+        self.store.log(Classification(message, None, prediction, confidence, 'model'), when)
+
+    def rollup(self, message, prediction):
+        def query(cursor):
+            cursor.execute("""
+                SELECT Messages, ConfidenceSum, ConfidenceMin, ConfidenceMax FROM DailyClassificationRollups
+                WHERE Day = ? AND MessageHash = ? AND Prediction = ?
+            """, ('2026-01-05', text_hash(message), prediction))
+            return cursor.fetchone()
+        return self.store.backend.transaction(query)
+
+    def test_late_event_is_merged_into_the_rolled_up_day(self):
+        day = date(2026, 1, 5)
+        for minute in range(6):
+            self.log("WIN a prize", 1, 90.0 + minute, datetime(2026, 1, 5, 12, minute))
+        self.log("see you", 0, 99.0, datetime(2026, 1, 5, 13, 0))
+        self.assertEqual(self.store.rollup_day(day), 7)
+        self.assertEqual(self.store.spam_count(), 6)
+
+        # A late event for the same day, e.g. replayed from a spill journal
+        self.log("WIN a prize", 1, 80.0, datetime(2026, 1, 5, 23, 59))
+        self.assertEqual(self.store.spam_count(), 7)
+        self.assertEqual(self.store.rollup_day(day), 1)
+
+        self.assertEqual(self.store.spam_count(), 7)
+        self.assertEqual(self.rollup("WIN a prize", 1), (7, 555.0 + 80.0, 80.0, 95.0))
+        self.assertEqual(self.rollup("see you", 0), (1, 99.0, 99.0, 99.0))
+        self.assertEqual(self.store.stats()['ClassificationEvents'], 0)
+
+    def test_rerun_does_not_count_twice(self):
+        day = date(2026, 1, 5)
+        self.log("WIN a prize", 1, 90.0, datetime(2026, 1, 5, 12, 0))
+        self.store.rollup_day(day)
+        self.assertEqual(self.store.rollup_day(day), 0)
+        self.assertEqual(self.rollup("WIN a prize", 1), (1, 90.0, 90.0, 90.0))
+
+
+if __name__ == '__main__':
+    unittest.main()